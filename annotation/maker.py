@@ -108,16 +108,16 @@ def batcheval(args):
     for row in fp:
         cid = row.strip()
         b = g.parents(cid, 1).next()
-        query = "{0}:{1}-{2}".format(b.chrom, b.start, b.stop)
+        query = "{0}:{1}-{2}".format(b.seqid, b.start, b.end)
         children = [c for c in g.children(cid, 1)]
 
         cidbed = prefix + ".bed"
         fw = open(cidbed, "w")
         for c in children:
-            if c.featuretype not in type:
+            if c.type not in type:
                 continue
 
-            fw.write(c.to_bed())
+            print >> fw, c.bedline
 
         fw.close()
 
@@ -4,6 +4,9 @@
 """
 Collect gene statistics based on gff file:
 Exon length, Intron length, Gene length, Exon count
+
+The statistics of many gff files are stored in one binary table, which the
+summary and histogram actions read.
 """
 
 import os.path as op
@@ -12,8 +15,10 @@ import logging
 
 from optparse import OptionParser
 
+import numpy as np
+
 from jcvi.utils.cbook import SummaryStats
-from jcvi.formats.gff import GffLine, make_index
+from jcvi.formats.gff import Gff
 from jcvi.apps.base import ActionDispatcher, debug, mkdir
 debug()
 
@@ -32,29 +37,109 @@ def main():
     p.dispatch(globals())
 
 
+def gene_stats(gff_file, gene="mRNA", exon="CDS"):
+    """
+    Collect the metrics of one gff file in a single pass. Exons are accumulated
+    per parent as they stream by, and the parents of the gene type are resolved
+    at the end, so the file needs no sorting nor index. Returns a dict of
+    metric => array.
+    """
+    genes = {}
+    ngenes = 0
+    parents, starts, ends = [], [], []
+    for g in Gff(gff_file).iter_lines():
+        if g.type == gene:
+            genes[g.accn] = ngenes
+            ngenes += 1
+        elif g.type == exon:
+            for parent in g.get_attr("Parent", first=False) or []:
+                parents.append(parent)
+                starts.append(g.start)
+                ends.append(g.end)
+
+    codes = np.array([genes.get(x, -1) for x in parents], dtype=int)
+    keep = codes >= 0
+    codes = codes[keep]
+    starts = np.array(starts, dtype=int)[keep]
+    ends = np.array(ends, dtype=int)[keep]
+
+    order = np.lexsort((ends, starts, codes))
+    codes, starts, ends = codes[order], starts[order], ends[order]
+    exon_lengths = ends - starts + 1
+
+    # Introns are the gaps between the merged exons of the same gene, i.e.
+    # from the running max of exon ends to the next exon start
+    intron_lengths = np.zeros(0, dtype=int)
+    if len(codes):
+        shift = ends.max() + 1
+        reach = np.maximum.accumulate(ends + codes * shift) - codes * shift
+        gaps = starts[1:] - reach[:-1] - 1
+        intron_lengths = gaps[(codes[1:] == codes[:-1]) & (gaps > 0)]
+
+    gene_lengths = np.bincount(codes, weights=exon_lengths,
+                               minlength=ngenes).astype(int)
+    exon_counts = np.bincount(codes, minlength=ngenes)
+
+    return dict(zip(metrics, (exon_lengths, intron_lengths,
+                              gene_lengths, exon_counts)))
+
+
+def write_table(tablefile, prefixes, results):
+    """
+    Store the metrics of all gff files in one npz table. Each metric is the
+    concatenated values, with `metric_ptr` delimiting the files.
+    """
+    arrays = {"prefixes": np.array(prefixes)}
+    for metric in metrics:
+        values = [x[metric] for x in results]
+        sizes = [len(x) for x in values]
+        arrays[metric] = np.concatenate(values).astype(int)
+        arrays[metric + "_ptr"] = np.concatenate(([0], np.cumsum(sizes)))
+
+    fw = open(tablefile, "wb")
+    np.savez(fw, **arrays)
+    fw.close()
+    logging.debug("Gene statistics of {0} files written to `{1}`.".\
+                    format(len(prefixes), tablefile))
+
+
+def read_table(tablefile):
+    """
+    Load the table written by stats(), returns the list of prefixes and a dict
+    of metric => list of arrays, one per file.
+    """
+    t = np.load(tablefile)
+    prefixes = [str(x) for x in t["prefixes"]]
+    data = {}
+    for metric in metrics:
+        values, ptr = t[metric], t[metric + "_ptr"]
+        data[metric] = [values[a:b] for a, b in zip(ptr[:-1], ptr[1:])]
+
+    return prefixes, data
+
+
 def summary(args):
     """
-    %prog summary *.gff
+    %prog summary genestats.npz
 
-    Print gene statistics table.
+    Print gene statistics table, based on output of stats.
     """
     from jcvi.utils.table import tabulate
 
     p = OptionParser(summary.__doc__)
     opts, args = p.parse_args(args)
 
-    if len(args) < 1:
+    if len(args) != 1:
         sys.exit(not p.print_help())
 
-    gff_files = args
+    tablefile, = args
+    prefixes, data = read_table(tablefile)
     for metric in metrics:
-        logging.debug("Parsing files in `{0}`..".format(metric))
-
+        logging.debug("Summarizing `{0}`..".format(metric))
         table = {}
-        for x in gff_files:
-            pf = op.basename(x).split(".")[0]
-            numberfile = op.join(metric, pf + ".txt")
-            ar = [int(x.strip()) for x in open(numberfile)]
+        for pf, ar in zip(prefixes, data[metric]):
+            if not len(ar):
+                continue
             sum = SummaryStats(ar).todict().items()
             keys, vals = zip(*sum)
             keys = [(pf, x) for x in keys]
@@ -65,103 +150,85 @@ def summary(args):
 
 def histogram(args):
     """
-    %prog histogram *.gff
+    %prog histogram genestats.npz
 
-    Plot gene statistics based on output of stats. For each gff file, look to
-    see if the metrics folder (i.e. Exon_Length) contains the data and plot
-    them.
+    Plot gene statistics based on output of stats, one plot per metric with
+    the gff files side-by-side.
     """
-    from jcvi.graphics.histogram import histogram_multiple
+    from jcvi.graphics.histogram import histogram_arrays
 
     p = OptionParser(histogram.__doc__)
     p.add_option("--bins", dest="bins", default=40, type="int",
             help="number of bins to plot in the histogram [default: %default]")
     opts, args = p.parse_args(args)
 
-    if len(args) < 1:
+    if len(args) != 1:
         sys.exit(not p.print_help())
 
-    gff_files = args
+    tablefile, = args
+    prefixes, data = read_table(tablefile)
     # metrics = ("Exon_Length", "Intron_Length", "Gene_Length", "Exon_Count")
     colors = ("red", "green", "blue", "black")
     vmaxes = (1000, 1000, 4000, 20)
     xlabels = ("bp", "bp", "bp", "number")
     for metric, color, vmax, xlabel in zip(metrics, colors, vmaxes, xlabels):
-        logging.debug("Parsing files in `{0}`..".format(metric))
-        numberfiles = [op.join(metric, op.basename(x).split(".")[0] + ".txt") \
-                        for x in gff_files]
-
-        histogram_multiple(numberfiles, 0, vmax, xlabel, metric,
+        datasets = zip(prefixes, data[metric])
+        histogram_arrays(datasets, 0, vmax, xlabel, metric,
                        bins=opts.bins, facet=True, fill=color,
                        prefix=metric + ".")
 
 
 def stats(args):
     """
-    %prog stats infile.gff
+    %prog stats infile.gff [infile2.gff ...]
 
-    Collect gene statistics based on gff file. There are some terminology issues
-    here and so normally we call "gene" are actually mRNA, and sometimes "exon"
-    are actually CDS, but they are configurable.
+    Collect gene statistics based on gff files. There are some terminology
+    issues here and so normally we call "gene" are actually mRNA, and sometimes
+    "exon" are actually CDS, but they are configurable.
 
-    Use --txt to send the numbers to text file in four separate folders,
-    corresponding to the four metrics:
+    Each gff file is read once. The four metrics:
 
     Exon length, Intron length, Gene length, Exon count
 
-    With data written to disk then you can run $prog histogram
+    of all files are written to one binary table (--table), then you can run
+    $prog summary or $prog histogram on it. Use --txt to also send the numbers
+    to text files in four separate folders, one per metric.
     """
-    from jcvi.utils.range import range_interleave
-
     p = OptionParser(stats.__doc__)
     p.add_option("--gene", default="mRNA",
                  help="The gene type [default: %default]")
     p.add_option("--exon", default="CDS",
                  help="The exon type [default: %default]")
+    p.add_option("--table", default="genestats.npz",
+                 help="Write the numbers to binary table [default: %default]")
     p.add_option("--txt", default=False, action="store_true",
                  help="Print out numbers for further analyses [default: %default]")
     opts, args = p.parse_args(args)
 
-    if len(args) != 1:
+    if len(args) < 1:
         sys.exit(not p.print_help())
 
-    gff_file, = args
-    g = make_index(gff_file)
-    exon_lengths = []
-    intron_lengths = []
-    gene_lengths = []
-    exon_counts = []
-    for feat in g.features_of_type(opts.gene):
-        exons = []
-        for c in g.children(feat.id, 1):
-            if c.featuretype != opts.exon:
+    gff_files = args
+    prefixes, results = [], []
+    for gff_file in gff_files:
+        pf = op.basename(gff_file).split(".")[0]
+        logging.debug("Collecting gene statistics in `{0}`..".format(gff_file))
+        r = gene_stats(gff_file, gene=opts.gene, exon=opts.exon)
+        prefixes.append(pf)
+        results.append(r)
+
+        for metric in metrics:
+            if not len(r[metric]):
                 continue
-            exons.append((c.chrom, c.start, c.stop))
-        introns = range_interleave(exons)
-        feat_exon_lengths = [(stop - start + 1) for (chrom, start, stop) in exons]
-        feat_intron_lengths = [(stop - start + 1) for (chrom, start, stop) in introns]
-        exon_lengths += feat_exon_lengths
-        intron_lengths += feat_intron_lengths
-        gene_lengths.append(sum(feat_exon_lengths))
-        exon_counts.append(len(feat_exon_lengths))
-
-    a = SummaryStats(exon_lengths)
-    b = SummaryStats(intron_lengths)
-    c = SummaryStats(gene_lengths)
-    d = SummaryStats(exon_counts)
-    for x, title in zip((a, b, c, d), metrics):
-        x.title = title
-        print >> sys.stderr, x
-
-    if not opts.txt:
-        return
-
-    prefix = gff_file.split(".")[0]
-    for x in (a, b, c, d):
-        dirname = x.title
-        mkdir(dirname)
-        txtfile = op.join(dirname, prefix + ".txt")
-        x.tofile(txtfile)
+            x = SummaryStats(r[metric], title=metric)
+            print >> sys.stderr, x
+
+            if opts.txt:
+                mkdir(metric)
+                x.tofile(op.join(metric, pf + ".txt"))
+
+    write_table(opts.table, prefixes, results)
+    return opts.table
 
 
 if __name__ == '__main__':
@@ -92,6 +92,18 @@ def set_params(instance):
             help="extra parameters to run")
 
 
+def set_cpus(instance, cpus=None):
+    """
+    Add --cpus options for programs that run on multiple processes
+    """
+    from multiprocessing import cpu_count
+
+    assert isinstance(instance, OptionParser)
+
+    instance.add_option("--cpus", default=cpus or cpu_count(), type="int",
+            help="Number of processes to run [default: %default]")
+
+
 def set_outfile(instance, outfile="stdout"):
     """
     Add --outfile options to print out to filename.
@@ -87,13 +87,17 @@ def deduplicate(args):
     """
     %prog deduplicate fastafile
 
-    Wraps `cd-hit-454` to remove duplicate reads.
+    Wraps `cd-hit-454` to remove duplicate reads. With --exact, collapse only
+    identical reads (either strand) by hashing, without running CD-HIT. The
+    clusters are written to `fastafile.cdhit.clusters`.
     """
     p = OptionParser(deduplicate.__doc__)
     p.add_option("--identity", default=.98, type="float",
                  help="Sequence identity threshold [default: %default]")
     p.add_option("--cpus", default=0, type="int",
                  help="Number of CPUs to use, 0=unlimited [default: %default]")
+    p.add_option("--exact", default=False, action="store_true",
+                 help="Collapse exact matches only [default: %default]")
     set_grid(p)
 
     opts, args = p.parse_args(args)
@@ -103,6 +107,14 @@ def deduplicate(args):
 
     fastafile, = args
 
+    if opts.exact:
+        from jcvi.formats.fasta import write_uniq
+
+        uniqfile = fastafile + ".cdhit"
+        write_uniq(fastafile, uniqfile, mode="seq", rc_canonical=True,
+                   clustersfile=uniqfile + ".clusters")
+        return uniqfile
+
     from jcvi.apps.command import CDPATH
 
     cmd = CDPATH("cd-hit-454")
@@ -8,12 +8,17 @@ Procedure to cut genome using restriction enzymes.
 import sys
 import logging
 
+import numpy as np
+
+from itertools import product
 from optparse import OptionParser
 
-from Bio.Restriction.Restriction import AllEnzymes, Analysis
+from Bio.Data.IUPACData import ambiguous_dna_values
+from Bio.Restriction.Restriction import AllEnzymes
 
-from jcvi.formats.fasta import Fasta, SeqRecord, SeqIO
-from jcvi.apps.base import ActionDispatcher, debug
+from jcvi.formats.base import must_open
+from jcvi.formats.fasta import Fasta, rc
+from jcvi.apps.base import ActionDispatcher, debug, set_outfile
 debug()
 
 
@@ -21,64 +26,230 @@ def main():
 
     actions = (
         ('fragment', 'extract upstream and downstream seq of particular RE'),
+        ('digest', 'report cut sites of several REs in one pass'),
             )
     p = ActionDispatcher(actions)
     p.dispatch(globals())
 
 
+BASES = "ACGT"
+MAXVARIANTS = 2 ** 20
+
+
+def expand_site(site):
+    """
+    Expand an IUPAC-degenerate recognition site into all concrete sites.
+
+    >>> sorted(expand_site("GANTC"))
+    ['GAATC', 'GACTC', 'GAGTC', 'GATTC']
+    """
+    choices = [ambiguous_dna_values[x] for x in site.upper()]
+    nvariants = np.prod([len(x) for x in choices])
+    assert nvariants <= MAXVARIANTS, \
+            "Site `{0}` too degenerate ({1} variants)".format(site, nvariants)
+    return ["".join(x) for x in product(*choices)]
+
+
+def encode(seq):
+    """
+    Convert a sequence string into 2-bit codes (A=0, C=1, G=2, T=3), any other
+    character is coded as 4.
+    """
+    table = np.empty(256, dtype=np.int64)
+    table.fill(4)
+    for i, b in enumerate(BASES):
+        table[ord(b)] = table[ord(b.lower())] = i
+    return table[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def kmer_code(kmer):
+    code = 0
+    for b in kmer:
+        code = (code << 2) | BASES.index(b)
+    return code
+
+
+class RestrictionDigest (object):
+    """
+    Find the cut sites of many enzymes in one pass over a sequence. All
+    concrete variants of the sites (both strands) are packed into 2-bit codes,
+    the sequence is rolled into k-mer codes once per distinct site length, and
+    every window is matched against all enzymes at once. Windows with an N
+    (or any other non-ACGT character) only match where the site has an N.
+
+    Cut positions follow `Bio.Restriction`, i.e. 1-based position of the first
+    base after the cut on the top strand.
+    """
+    def __init__(self, enzymes, chunksize=10000000):
+        self.enzymes = enzymes
+        self.chunksize = chunksize
+        # (Site length, N positions) => [(code, enzyme index, offset to cut)]
+        patterns = {}
+        for i, e in enumerate(enzymes):
+            assert e.fst5 is not None and not e.cut_twice(), \
+                    "Enzyme `{0}` has unsupported cut ({1})".\
+                    format(e, e.elucidate())
+            site = str(e.site)
+            fwd = set(expand_site(site))
+            rev = set(rc(x) for x in fwd)
+            L = len(site)
+            mask = tuple(j for j, b in enumerate(site.upper()) if b == 'N')
+            pp = patterns.setdefault((L, mask), [])
+            pp.extend((kmer_code(x), i, e.fst5) for x in fwd)
+            if fwd != rev:  # Non-palindromic, also search the other strand
+                rmask = tuple(sorted(L - 1 - j for j in mask))
+                pp = patterns.setdefault((L, rmask), [])
+                pp.extend((kmer_code(x), i, -e.fst3) for x in rev)
+
+        # (Site length, N positions) => (unique codes, ownership matrix)
+        self.patterns = {}
+        owners = sorted(set((i, shift) for pp in patterns.values()
+                                       for c, i, shift in pp))
+        self.owners = owners
+        ownerindex = dict((x, j) for j, x in enumerate(owners))
+        for key, pp in patterns.items():
+            codes = np.unique([c for c, i, shift in pp])
+            matrix = np.zeros((len(codes), len(owners)), dtype=bool)
+            rows = np.searchsorted(codes, [c for c, i, shift in pp])
+            cols = [ownerindex[(i, shift)] for c, i, shift in pp]
+            matrix[rows, cols] = True
+            self.patterns[key] = (codes, matrix)
+
+        self.maxlen = max(L for L, mask in self.patterns.keys())
+
+    def _search_chunk(self, codes, start, end, hits):
+        """
+        Scan codes[start:end + maxlen - 1], only windows that begin before
+        `end` are reported.
+        """
+        chunk = codes[start:end + self.maxlen - 1]
+        isbad = chunk == 4
+        bad = np.concatenate(([0], np.cumsum(isbad)))
+        for (L, mask), (pcodes, matrix) in self.patterns.items():
+            nwin = min(end - start, len(chunk) - L + 1)
+            if nwin <= 0:
+                continue
+            kmers = np.zeros(nwin, dtype=np.int64)
+            for j in xrange(L):
+                kmers = (kmers << 2) | (chunk[j:j + nwin] & 3)
+            nbad = bad[L:L + nwin] - bad[:nwin]
+            for j in mask:  # Any base matches where the site has an N
+                nbad -= isbad[j:j + nwin]
+            valid = nbad == 0
+            idx = np.nonzero(np.in1d(kmers, pcodes) & valid)[0]
+            if not len(idx):
+                continue
+            rows = np.searchsorted(pcodes, kmers[idx])
+            for j, (i, shift) in enumerate(self.owners):
+                found = idx[matrix[rows, j]]
+                if len(found):
+                    hits[i].append(found + start + 1 + shift)
+
+    def search(self, seq):
+        """
+        Returns {enzyme: sorted np.array of cut positions}.
+        """
+        codes = encode(str(seq))
+        size = len(codes)
+        hits = [[] for e in self.enzymes]
+        for start in xrange(0, size, self.chunksize):
+            end = min(start + self.chunksize, size)
+            self._search_chunk(codes, start, end, hits)
+
+        sites = {}
+        for e, h in zip(self.enzymes, hits):
+            h = np.unique(np.concatenate(h)) if h else \
+                np.array([], dtype=np.int64)
+            sites[e] = h[(h > 1) & (h <= size)]
+        return sites
+
+    def iter_sites(self, fastafile):
+        """
+        Yields (rec, {enzyme: sites}) for each sequence in fastafile.
+        """
+        f = Fasta(fastafile, lazy=True)
+        for name, rec in f.iteritems_ordered():
+            yield rec, self.search(rec.seq)
+
+
+def get_enzymes(names):
+    """
+    Convert comma-separated names to Bio.Restriction enzymes.
+    """
+    allenzymes = dict((str(x), x) for x in AllEnzymes)
+    enzymes = []
+    for name in names.split(","):
+        assert name in allenzymes, "Unknown enzyme `{0}`".format(name)
+        enzymes.append(allenzymes[name])
+    return enzymes
+
+
+def format_fasta(name, seq, width=60):
+    """
+    Same output as SeqIO.write(), without building a SeqRecord.
+    """
+    lines = [">{0}".format(name)]
+    lines.extend(seq[i:i + width] for i in xrange(0, len(seq), width))
+    return "\n".join(lines) + "\n"
+
+
 def extract_full(rec, sites, flank, fw):
     """
     Full extraction of seq flanking the sites.
     """
+    seq = str(rec.seq)
+    size = len(seq)
+    recs = []
     for s in sites:
         newid = "{0}:{1}".format(rec.name, s)
         left = max(s - flank, 0)
-        right = min(s + flank, len(rec))
-        frag = rec.seq[left:right].strip("Nn")
-        newrec = SeqRecord(frag, id=newid, description="")
-        SeqIO.write([newrec], fw, "fasta")
+        right = min(s + flank, size)
+        frag = seq[left:right].strip("Nn")
+        recs.append(format_fasta(newid, frag))
+
+    fw.write("".join(recs))
 
 
 def extract_ends(rec, sites, flank, fw, maxfragsize=800):
     """
     Extraction of ends of fragments above certain size.
     """
+    seq = str(rec.seq)
     nsites = len(sites)
-    size = len(rec)
+    size = len(seq)
+    recs = []
     for i, s in enumerate(sites):
         newid = "{0}:{1}".format(rec.name, s)
-        recs = []
 
         if i == 0 or s - sites[i - 1] <= maxfragsize:
             newidL = newid + "L"
             left = max(s - flank, 0)
             right = s
-            frag = rec.seq[left:right].strip("Nn")
-            recL = SeqRecord(frag, id=newidL, description="")
+            frag = seq[left:right].strip("Nn")
             if i == 0 and s > maxfragsize:  # Contig L-end
                 pass
             else:
-                recs.append(recL)
+                recs.append(format_fasta(newidL, frag))
 
         if i == nsites - 1 or sites[i + 1] - s <= maxfragsize:
             newidR = newid + "R"
             left = s
             right = min(s + flank, size)
-            frag = rec.seq[left:right].strip("Nn")
-            recR = SeqRecord(frag, id=newidR, description="")
+            frag = seq[left:right].strip("Nn")
             if i == nsites - 1 and size - s > maxfragsize:  # Contig R-end
                 pass
             else:
-                recs.append(recR)
+                recs.append(format_fasta(newidR, frag))
 
-        SeqIO.write(recs, fw, "fasta")
+    fw.write("".join(recs))
 
 
 def fragment(args):
     """
     %prog fragment fastafile enzyme
 
-    Cut the fastafile using the specified enzyme, and grab upstream and
+    Cut the fastafile using the specified enzyme (or several, separated by
+    comma, which are all searched in one pass), and grab upstream and
     downstream nucleotide sequence along with the cut site. In this case, the
     sequences extracted are:
 
@@ -112,20 +283,50 @@ def fragment(args):
     extract = extract_full if opts.full else extract_ends
     tag = "full" if opts.full else "ends"
 
-    assert enzyme in set(str(x) for x in AllEnzymes)
+    enzymes = get_enzymes(enzyme)
     fragfastafile = fastafile.split(".")[0] + \
-        ".{0}.flank{1}.{2}.fasta".format(enzyme, flank, tag)
-    enzyme = [x for x in AllEnzymes if str(x) == enzyme][0]
+        ".{0}.flank{1}.{2}.fasta".format(enzyme.replace(",", "_"), flank, tag)
 
-    f = Fasta(fastafile, lazy=True)
+    rd = RestrictionDigest(enzymes)
     fw = open(fragfastafile, "w")
-    for name, rec in f.iteritems_ordered():
-        a = Analysis([enzyme], rec.seq)
-        sites = a.full()[enzyme]
+    for rec, sites in rd.iter_sites(fastafile):
+        sites = np.unique(np.concatenate(sites.values())).tolist()
         extract(rec, sites, flank, fw)
 
     logging.debug("Fragments written to `{0}`.".format(fragfastafile))
 
 
+def digest(args):
+    """
+    %prog digest fastafile EcoRI,PstI,..
+
+    In-silico digest of the fastafile with several enzymes in one pass. Cut
+    sites are written in BED format, one line per site, named by the enzyme.
+    Position is the first base after the cut, same as Bio.Restriction.
+    """
+    p = OptionParser(digest.__doc__)
+    set_outfile(p)
+    opts, args = p.parse_args(args)
+
+    if len(args) != 2:
+        sys.exit(not p.print_help())
+
+    fastafile, enzymes = args
+    enzymes = get_enzymes(enzymes)
+    rd = RestrictionDigest(enzymes)
+    fw = must_open(opts.outfile, "w")
+    nsites = 0
+    for rec, sites in rd.iter_sites(fastafile):
+        for e in enzymes:
+            ss = sites[e]
+            fw.write("".join("{0}\t{1}\t{2}\t{3}\n".\
+                    format(rec.id, x - 1, x, e) for x in ss))
+            nsites += len(ss)
+    fw.close()
+
+    logging.debug("A total of {0} sites written to `{1}`.".\
+                  format(nsites, opts.outfile))
+
+
 if __name__ == '__main__':
     main()
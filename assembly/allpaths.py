@@ -12,7 +12,7 @@ import numpy as np
 
 from glob import glob
 from struct import pack, unpack
-from itertools import islice, izip
+from itertools import izip
 from optparse import OptionParser
 
 from jcvi.formats.base import BaseFile
@@ -181,49 +181,105 @@ def fill(args):
         sh(cmd)
 
 
-def extract_pairs(fastqfile, p1fw, p2fw, fragsfw, p):
+_pairs = {}
+
+
+def read_spans(fp, offsets, starts, stops, bufsize=1 << 24):
     """
-    Take fastqfile and array of pair ID, extract adjacent pairs to outfile.
-    Perform check on numbers when done. p1fw, p2fw is a list of file handles,
-    each for one end. p is a Pairs instance.
+    Yield the bytes of records starts[i]:stops[i] in the indexed fastqfile.
     """
-    fp = open(fastqfile)
-    currentID = 0
-    npairs = nfrags = 0
-    for x, lib in izip(p.r1, p.libs):
-        while currentID != x:
-            fragsfw.writelines(islice(fp, 4))  # Exhaust the iterator
-            currentID += 1
-            nfrags += 1
-        a = list(islice(fp, 4))
-        b = list(islice(fp, 4))
-        b[0] = a[0]  # Keep same read ID for pairs
-
-        p1fw[lib].writelines(a)
-        p2fw[lib].writelines(b)
-        currentID += 2
-        npairs += 2
-
-    # Write the remaining single reads
-    while True:
-        contents = list(islice(fp, 4))
-        if not contents:
-            break
-        fragsfw.writelines(contents)
-        nfrags += 1
-
-    logging.debug("A total of {0} paired reads written to `{1}`.".\
-                  format(npairs, ",".join(x.name for x in p1fw + p2fw)))
-    logging.debug("A total of {0} single reads written to `{1}`.".\
-                  format(nfrags, fragsfw.name))
+    for start, stop in izip(starts, stops):
+        fp.seek(offsets[start])
+        nbytes = offsets[stop] - offsets[start]
+        while nbytes > 0:
+            buf = fp.read(min(nbytes, bufsize))
+            assert buf, "Unexpected end of file `{0}`".format(fp.name)
+            nbytes -= len(buf)
+            yield buf
+
+
+def _extract_lib(task):
+    """
+    Copy the pairs of one library, or the single reads when lib is None, by
+    seeking into the fastqfile. Returns the number of reads written.
+    """
+    fastqfile, lib, outfiles = task
+    p, offsets = _pairs["pairs"], _pairs["offsets"]
+    fp = open(fastqfile, "rb")
+
+    if lib is None:
+        single = np.ones(p.nreads, dtype=np.int8)
+        single[p.r1] = single[p.r2] = 0
+        edges = np.diff(np.concatenate(([0], single, [0])))
+        starts, = np.nonzero(edges == 1)
+        stops, = np.nonzero(edges == -1)
+        fw = open(outfiles[0], "w")
+        fw.writelines(read_spans(fp, offsets, starts, stops))
+        fw.close()
+        return int((stops - starts).sum())
+
+    selected = p.libs == lib
+    r1, r2 = p.r1[selected], p.r2[selected]
+    p1fw, p2fw = [open(x, "w") for x in outfiles]
+    for i in xrange(0, len(r1), 10000):
+        a = list(read_spans(fp, offsets, r1[i:i + 10000], r1[i:i + 10000] + 1))
+        b = list(read_spans(fp, offsets, r2[i:i + 10000], r2[i:i + 10000] + 1))
+        # Keep same read ID for pairs
+        b = [x.split("\n", 1)[0] + "\n" + y.split("\n", 1)[1] \
+                for x, y in izip(a, b)]
+        p1fw.writelines(a)
+        p2fw.writelines(b)
+    p1fw.close()
+    p2fw.close()
+    return 2 * len(r1)
+
+
+def extract_pairs(fastqfile, p1files, p2files, fragsfile, p, libs=None,
+                  cpus=1):
+    """
+    Take fastqfile and array of pair ID, extract pairs to p1files, p2files
+    (one for each library) and single reads to fragsfile. Reads are located by
+    seeking through an offset index of the fastqfile, so the libraries are
+    copied in parallel, and a subset of libraries can be regenerated alone
+    (the single reads are then skipped). p is a PairsFile instance.
+    """
+    from jcvi.formats.fastq import index_offsets
+
+    offsets = index_offsets(fastqfile)
+    nreads = len(offsets) - 1
+    assert nreads == p.nreads, "Expect {0} reads in `{1}`, got {2} instead".\
+              format(p.nreads, fastqfile, nreads)
+    assert p.npairs == 0 or max(p.r1.max(), p.r2.max()) < nreads
+
+    libs = range(p.nlibs) if libs is None else libs
+    tasks = [(fastqfile, lib, (p1files[lib], p2files[lib])) for lib in libs]
+    if len(libs) == p.nlibs:
+        tasks.append((fastqfile, None, (fragsfile,)))
+
+    _pairs.update(pairs=p, offsets=offsets)
+    if cpus > 1 and len(tasks) > 1:
+        from multiprocessing import Pool
+
+        pool = Pool(min(cpus, len(tasks)))
+        counts = pool.map(_extract_lib, tasks)
+        pool.close()
+        pool.join()
+    else:
+        counts = [_extract_lib(x) for x in tasks]
 
     # Validate the numbers
-    expected_pairs = 2 * p.npairs
-    expected_frags = p.nreads - 2 * p.npairs
-    assert npairs == expected_pairs, "Expect {0} paired reads, got {1} instead".\
-              format(expected_pairs, npairs)
-    assert nfrags == expected_frags, "Expect {0} single reads, got {1} instead".\
-              format(expected_frags, nfrags)
+    libcounts = np.bincount(p.libs, minlength=p.nlibs)
+    for (fastqfile, lib, outfiles), count in zip(tasks, counts):
+        if lib is None:
+            expected = p.nreads - 2 * p.npairs
+            kind = "single"
+        else:
+            expected = 2 * libcounts[lib]
+            kind = "paired"
+        assert count == expected, "Expect {0} {1} reads, got {2} instead".\
+                  format(expected, kind, count)
+        logging.debug("A total of {0} {1} reads written to `{2}`.".\
+                  format(count, kind, ",".join(outfiles)))
 
 
 def pairs(args):
@@ -232,13 +288,18 @@ def pairs(args):
 
     Parse ALLPATHS pairs file, and write pairs IDs and single read IDs in
     respective ids files: e.g. `lib1.pairs.fastq`, `lib2.pairs.fastq`,
-    and single `frags.fastq` (with single reads from lib1/2).
+    and single `frags.fastq` (with single reads from lib1/2). Use --libs to
+    regenerate only some of the libraries.
     """
     from jcvi.assembly.preprocess import run_FastbAndQualb2Fastq
+    from jcvi.apps.base import set_cpus
 
     p = OptionParser(pairs.__doc__)
     p.add_option("--header", default=False, action="store_true",
             help="Print header only [default: %default]")
+    p.add_option("--libs",
+            help="Extract these libraries only, separated by comma")
+    set_cpus(p)
     opts, args = p.parse_args(args)
 
     if len(args) != 2:
@@ -252,19 +313,26 @@ def pairs(args):
     if opts.header:
         return
 
+    libs = None
+    if opts.libs:
+        libnames = opts.libs.split(",")
+        for x in libnames:
+            assert x in p.libnames, "Library `{0}` not in `{1}`".\
+                    format(x, pairsfile)
+        libs = [p.libnames.index(x) for x in libnames]
+
     if fastqfile.endswith(".fastb"):
         fastbfile = fastqfile
         fastqfile = fastbfile.replace(".fastb", ".fastq")
-        run_FastbAndQualb2Fastq(infile=fastbfile, outfile=fastqfile)
+        if need_update(fastbfile, fastqfile):
+            run_FastbAndQualb2Fastq(infile=fastbfile, outfile=fastqfile)
 
-    p1file = "{0}.1.corr.fastq"
-    p2file = "{0}.2.corr.fastq"
-    fragsfile = "{0}.corr.fastq"
-    p1fw = [open(p1file.format(x), "w") for x in p.libnames]
-    p2fw = [open(p2file.format(x), "w") for x in p.libnames]
-    fragsfw = open(fragsfile.format(pf), "w")
+    p1files = ["{0}.1.corr.fastq".format(x) for x in p.libnames]
+    p2files = ["{0}.2.corr.fastq".format(x) for x in p.libnames]
+    fragsfile = "{0}.corr.fastq".format(pf)
 
-    extract_pairs(fastqfile, p1fw, p2fw, fragsfw, p)
+    extract_pairs(fastqfile, p1files, p2files, fragsfile, p, libs=libs,
+                  cpus=opts.cpus)
 
 
 ALLPATHSRUN = r"""#!/bin/bash
@@ -14,6 +14,7 @@ import sys
 import logging
 
 from glob import glob
+from itertools import izip
 from optparse import OptionParser
 from collections import defaultdict
 
@@ -21,7 +22,8 @@ from Bio import SeqIO
 
 from jcvi.formats.base import must_open
 from jcvi.formats.fasta import Fasta, SeqRecord, \
-    get_qual, iter_fasta_qual, write_fasta_qual
+    get_qual, iter_fasta_qual, write_fasta_qual, shred_ranges, \
+    format_fragments, emit_fragments
 from jcvi.formats.blast import Blast
 from jcvi.utils.range import range_minmax
 from jcvi.utils.table import tabulate
@@ -48,7 +50,7 @@ def main():
 
 frgTemplate = '''{{FRG
 act:A
-acc:{fragID}
+acc:{name}
 rnd:1
 sta:G
 lib:{libID}
@@ -60,7 +62,7 @@ seq:
 {seq}
 .
 qlt:
-{qvs}
+{qual}
 .
 hps:
 .
@@ -103,8 +105,29 @@ def emitFragment(fw, fragID, libID, shredded_seq, fasta=False):
     slen = len(seq)
     qvs = DEFAULTQV * slen  # shredded reads have default low qv
 
-    print >> fw, frgTemplate.format(fragID=fragID, libID=libID,
-        seq=seq, qvs=qvs, slen=slen)
+    print >> fw, frgTemplate.format(name=fragID, libID=libID,
+        seq=seq, qual=qvs, slen=slen)
+
+
+def shred_contigs(contigs, libID, depth=2, readlen=1000, fasta=False):
+    """
+    Shred a chunk of (ctgID, seq) into pseudo-reads, returns the formatted
+    text in a tuple (one output).
+    """
+    if fasta:
+        template, defaultqv, width = ">{name}\n{seq}\n", None, 60
+    else:
+        template, defaultqv, width = frgTemplate + "\n", DEFAULTQV, None
+
+    texts = []
+    for ctgID, seq in contigs:
+        begins, ends = shred_ranges(len(seq), readlen, depth)
+        names = ["{0}.{1}.frag{2}.{3}-{4}".format(libID, ctgID, i, b, e) \
+                    for i, (b, e) in enumerate(izip(begins, ends))]
+        texts.append(format_fragments(template, seq, begins, ends, names,
+                                      defaultqv=defaultqv, width=width,
+                                      libID=libID))
+    return ("".join(texts),)
 
 
 def shred(args):
@@ -114,6 +137,9 @@ def shred(args):
     Similar to the method of `shredContig` in runCA script. The contigs are
     shredded into pseudo-reads with certain length and depth.
     """
+    from functools import partial
+    from jcvi.apps.base import set_cpus
+
     p = OptionParser(shred.__doc__)
     p.add_option("--depth", default=2, type="int",
             help="Desired depth of the reads [default: %default]")
@@ -123,6 +149,7 @@ def shred(args):
             help="Ignore contig sequence less than [default: %default]")
     p.add_option("--fasta", default=False, action="store_true",
             help="Output shredded reads as FASTA sequences [default: %default]")
+    set_cpus(p, cpus=1)
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
@@ -153,37 +180,11 @@ def shred(args):
     *** - center_increments
     ### - center_range_width
     """
-    for ctgID, (name, rec) in enumerate(f.iteritems_ordered()):
-        seq = rec.seq
-        seqlen = len(seq)
-        if seqlen < opts.minctglen:
-            continue
-
-        shredlen = min(seqlen - 50, opts.readlen)
-        numreads = max(seqlen * opts.depth / shredlen, 1)
-        center_range_width = seqlen - shredlen
-
-        ranges = []
-        if numreads == 1:
-            ranges.append((0, shredlen))
-        else:
-            prev_begin = -1
-            center_increments = center_range_width * 1. / (numreads - 1)
-            for i in xrange(numreads):
-                begin = center_increments * i
-                end = begin + shredlen
-                begin, end = int(begin), int(end)
-
-                if begin == prev_begin:
-                    continue
-
-                ranges.append((begin, end))
-                prev_begin = begin
-
-        for shredID, (begin, end) in enumerate(ranges):
-            shredded_seq = seq[begin:end]
-            fragID = "{0}.{1}.frag{2}.{3}-{4}".format(libID, ctgID, shredID, begin, end)
-            emitFragment(fw, fragID, libID, shredded_seq, fasta=opts.fasta)
+    contigs = ((ctgID, str(rec.seq)) for ctgID, (name, rec) in \
+                enumerate(f.iteritems_ordered()) if len(rec) >= opts.minctglen)
+    func = partial(shred_contigs, libID=libID, depth=opts.depth,
+                   readlen=opts.readlen, fasta=opts.fasta)
+    emit_fragments(func, contigs, [fw], cpus=opts.cpus)
 
     fw.close()
     logging.debug("Shredded reads are written to `{0}`.".format(outfile))
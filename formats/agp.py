@@ -15,7 +15,7 @@ import logging
 from copy import deepcopy
 from optparse import OptionParser, OptionGroup
 from collections import defaultdict
-from itertools import groupby
+from itertools import groupby, izip
 
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
@@ -905,7 +905,11 @@ def liftover(args):
     %prog liftover agpfile bedfile
 
     Given coordinates in components, convert to the coordinates in chromosomes.
+    Features partially in a component are clipped, and features on components
+    not in the AGP are kept as is.
     """
+    from jcvi.formats.chain import LiftOver, MAPPED, CLIPPED, MISSING
+
     p = OptionParser(liftover.__doc__)
     p.add_option("--prefix", default=False, action="store_true",
                  help="Prepend prefix to accn names [default: %default]")
@@ -915,39 +919,29 @@ def liftover(args):
         sys.exit(p.print_help())
 
     agpfile, bedfile = args
-    agp = AGP(agpfile).order
+    lo = LiftOver.from_agp(agpfile)
+    # Components can also be named without Genbank version
+    aliases = dict((x.rsplit(".", 1)[0], x) for x in lo.snames)
     bed = Bed(bedfile)
+    components = [b.seqid if b.seqid in lo.index else \
+                  aliases.get(b.seqid, b.seqid) for b in bed]
+    objects, starts, ends, reverse, status = lo.lift(components,
+                    [b.start for b in bed], [b.end for b in bed])
+
     newbed = Bed()
-    for b in bed:
-        component = b.seqid
-        if component not in agp:
+    for b, object, s, t, st in izip(bed, objects.tolist(), starts.tolist(),
+                                    ends.tolist(), status.tolist()):
+        if st == MISSING:
             newbed.append(b)
             continue
-
-        i, a = agp[component]
-
-        assert a.component_beg < a.component_end
-        arange = a.component_beg, a.component_end
-        assert b.start < b.end
-        brange = b.start, b.end
-
-        st = range_intersect(arange, brange)
-        if not st:
+        if st not in (MAPPED, CLIPPED):
             continue
-        start, end = st
-        assert start <= end
-
-        if a.orientation == '-':
-            d = a.object_end + a.component_beg
-            s, t = d - end, d - start
-        else:
-            d = a.object_beg - a.component_beg
-            s, t = d + start, d + end
 
+        component = b.seqid
         name = b.accn.replace(" ", "_")
         if opts.prefix:
             name = component + "_" + name
-        bline = "\t".join(str(x) for x in (a.object, s - 1, t, name))
+        bline = "\t".join(str(x) for x in (object, s - 1, t, name))
         newbed.append(BedLine(bline))
 
     newbed.print_to_file(sorted=True)
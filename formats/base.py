@@ -3,14 +3,18 @@
 
 import os
 import os.path as op
+import re
 import math
+import marshal
 import sys
 import logging
 
-from itertools import groupby, islice, cycle, izip
+import numpy as np
+
+from zlib import crc32
+from itertools import groupby, islice, izip
 from optparse import OptionParser
 
-from Bio import SeqIO
 from jcvi.apps.base import ActionDispatcher, sh, debug, need_update, \
         mkdir, popen, set_outfile
 debug()
@@ -104,12 +108,108 @@ class FileMerger (object):
         sh("cat {0}".format(files), outfile=outfile)
 
 
+def gzip_member(text):
+    """
+    Compress text into one gzip member. Members can be concatenated into a
+    valid gzip file, so that chunks can be compressed in parallel.
+    """
+    import gzip
+    from cStringIO import StringIO
+
+    buf = StringIO()
+    fw = gzip.GzipFile(fileobj=buf, mode="wb")
+    fw.write(text)
+    fw.close()
+    return buf.getvalue()
+
+
+def split_records(text, format="txt"):
+    """
+    Split a text that contains whole records into a list of raw records.
+    """
+    if format == "fastq":
+        lines = text.splitlines(True)
+        return ["".join(lines[i:i + 4]) for i in xrange(0, len(lines), 4)]
+    if format == "fasta":
+        parts = ("\n" + text).split("\n>")
+        parts[0] = parts[0][1:]  # Leading lines before the first header
+        records = [x + "\n" for x in parts[:-1]] + [parts[-1]]
+        records[1:] = [">" + x for x in records[1:]]
+        return records if parts[0] else records[1:]
+    return text.splitlines(True)
+
+
+def iter_records(filename, format="txt"):
+    """
+    Yield the raw records in a file, as text.
+    """
+    fp = must_open(filename)
+    if format == "fastq":
+        for a in izip(fp, fp, fp, fp):
+            yield "".join(a)
+    elif format == "fasta":
+        from jcvi.formats.fasta import iter_fasta_lines
+        for header, lines in iter_fasta_lines(fp):
+            yield header + "".join(lines)
+    else:
+        for row in fp:
+            yield row
+    fp.close()
+
+
+def read_chunk(filename, offset, nbytes):
+    fp = open(filename, "rb")
+    fp.seek(offset)
+    text = fp.read(nbytes)
+    fp.close()
+    return text
+
+
+def _copy_chunk(task):
+    """
+    Copy a record-aligned chunk to outfile, returns the number of records.
+    """
+    filename, offset, nbytes, outfile, format = task
+    text = read_chunk(filename, offset, nbytes)
+    fw = must_open(outfile, "w")
+    fw.write(text)
+    fw.close()
+    return len(split_records(text, format))
+
+
+def _cycle_chunk(task):
+    """
+    Deal the records in a chunk to N outputs in turn, starting from output 0.
+    Returns the N texts (compressed if asked) and the number of records.
+    """
+    source, format, N, compress = task
+    if isinstance(source, tuple):
+        records = split_records(read_chunk(*source), format)
+    else:
+        records = source
+    texts = ["".join(records[i::N]) for i in xrange(N)]
+    if compress:
+        texts = [gzip_member(x) if x else x for x in texts]
+    return texts, len(records)
+
+
 class FileSplitter (object):
+    """
+    Split a file into N record-aligned files, without a counting pass. Split
+    points are picked by byte offsets that are snapped to record boundaries,
+    and chunks are processed on a pool of `cpus` workers. Paired files (e.g.
+    reads 1 and reads 2) can be split alongside so that the outputs stay in
+    sync. Outputs are gzipped if the input is.
+    """
 
-    def __init__(self, filename, outputdir=None, mode="cycle"):
+    def __init__(self, filename, outputdir=None, mode="cycle", pairfile=None,
+                 cpus=1, chunksize=16 * 1024 * 1024):
         self.filename = filename
         self.outputdir = outputdir
         self.mode = mode
+        self.pairfile = pairfile
+        self.cpus = cpus
+        self.chunksize = chunksize
 
         self.format = format = self._guess_format(filename)
         logging.debug("format is %s" % format)
@@ -118,65 +218,53 @@ class FileSplitter (object):
             self.klass = "seqio"
         else:
             self.klass = "txt"
+        self.signal = {"fasta": ">", "fastq": "@"}.get(format, "")
 
         mkdir(outputdir)
 
-    def _open(self, filename):
-
-        if self.klass == "seqio":
-            handle = SeqIO.parse(open(filename), self.format)
-        else:
-            handle = open(filename)
-        return handle
-
     @property
     def num_records(self):
-        handle = self._open(self.filename)
-        return sum(1 for x in handle)
+        return sum(1 for x in iter_records(self.filename, self.format))
 
     def _guess_format(self, filename):
+        if filename.endswith(".gz"):
+            filename = filename[:-3]
         root, ext = op.splitext(filename)
         ext = ext.strip(".")
 
         if ext in ("fasta", "fa", "fna", "cds", "pep", "faa"):
             format = "fasta"
-        elif ext in ("fastq",):
+        elif ext in ("fastq", "fq"):
             format = "fastq"
         else:
             format = "txt"
         return format
 
-    def _batch_iterator(self, N=1):
-        """Returns N lists of records.
-
-        This can be used on any iterator, for example to batch up
-        SeqRecord objects from Bio.SeqIO.parse(...), or to batch
-        Alignment objects from Bio.AlignIO.parse(...), or simply
-        lines from a file handle.
-
-        This is a generator function, and it returns lists of the
-        entries from the supplied iterator.  Each list will have
-        batch_size entries, although the final list may be shorter.
-        """
-        batch_size = math.ceil(self.num_records / float(N))
-        handle = self._open(self.filename)
-        while True:
-            batch = list(islice(handle, batch_size))
-            if not batch:
-                break
-            yield batch
-
     @classmethod
     def get_names(cls, filename, N):
-        root, ext = op.splitext(op.basename(filename))
+        gz = ""
+        basename = op.basename(filename)
+        if basename.endswith(".gz"):
+            basename, gz = basename[:-3], ".gz"
+        root, ext = op.splitext(basename)
 
         names = []
         for i in xrange(N):
-            name = "%s_%02d%s" % (root, i, ext)
+            name = "%s_%02d%s%s" % (root, i, ext, gz)
             names.append(name)
 
         return names
 
+    def _names(self, filename, N):
+        names = self.__class__.get_names(filename, N)
+        if self.outputdir:
+            names = [op.join(self.outputdir, x) for x in names]
+        return names
+
+    def _pool(self):
+        from multiprocessing import Pool
+        return Pool(self.cpus) if self.cpus > 1 else None
+
     def split(self, N, force=False):
         """
         There are two modes of splitting the records
@@ -189,40 +277,621 @@ class FileSplitter (object):
         assert mode in ("batch", "cycle")
         logging.debug("set split mode=%s" % mode)
 
-        self.names = self.__class__.get_names(self.filename, N)
-        if self.outputdir:
-            self.names = [op.join(self.outputdir, x) for x in self.names]
+        self.names = self._names(self.filename, N)
+        inputs = [(self.filename, self.names)]
+        if self.pairfile:
+            self.pairnames = self._names(self.pairfile, N)
+            inputs.append((self.pairfile, self.pairnames))
 
         if not need_update(self.filename, self.names) and not force:
             logging.error("file %s already existed, skip file splitting" % \
                     self.names[0])
             return
 
-        filehandles = [open(x, "w") for x in self.names]
-
+        pool = self._pool()
         if mode == "batch":
-            for batch, fw in zip(self._batch_iterator(N), filehandles):
+            counts = self._split_batch(self.filename, self.names, N, pool)
+            if self.pairfile:
+                self._split_counts(self.pairfile, self.pairnames, counts)
+        else:
+            for filename, names in inputs:
+                self._split_cycle(filename, names, N, pool)
 
-                if self.klass == "seqio":
-                    count = SeqIO.write(batch, fw, self.format)
-                else:
-                    for line in batch:
-                        fw.write(line)
-                    count = len(batch)
+        if pool:
+            pool.close()
+            pool.join()
 
-                logging.debug("write %d records to %s" % (count, fw.name))
+    def _split_batch(self, filename, names, N, pool):
+        """
+        Split into N chunks of about equal sizes, returns the record counts.
+        """
+        format = self.format
+        if not filename.endswith(".gz"):
+            chunksize = int(math.ceil(op.getsize(filename) / float(N))) or 1
+            spans = snap_chunks(filename, chunksize, signal=self.signal)
+            tasks = [(filename, offset, nbytes, name, format) for \
+                        (offset, nbytes), name in zip(spans, names)]
+            counts = pool.map(_copy_chunk, tasks) if pool else \
+                        map(_copy_chunk, tasks)
+            for name in names[len(tasks):]:
+                must_open(name, "w").close()
+            counts += [0] * (N - len(tasks))
+        else:
+            from jcvi.apps.base import getfilesize
+
+            # Compressed input cannot seek, so switch by estimated size
+            chunksize = getfilesize(filename, ratio=1) / N + 1
+            counts = [0] * N
+            i, size = 0, 0
+            fw = must_open(names[0], "w")
+            for record in iter_records(filename, format):
+                if size >= chunksize and i < N - 1:
+                    fw.close()
+                    i, size = i + 1, 0
+                    fw = must_open(names[i], "w")
+                fw.write(record)
+                size += len(record)
+                counts[i] += 1
+            fw.close()
+            for name in names[i + 1:]:
+                must_open(name, "w").close()
 
-        elif mode == "cycle":
-            handle = self._open(self.filename)
-            for record, fw in izip(handle, cycle(filehandles)):
+        for count, name in zip(counts, names):
+            logging.debug("write %d records to %s" % (count, name))
+        return counts
+
+    def _split_counts(self, filename, names, counts):
+        """
+        Split the records in order, following the counts of the paired file.
+        """
+        records = iter_records(filename, self.format)
+        for count, name in zip(counts, names):
+            fw = must_open(name, "w")
+            fw.writelines(islice(records, count))
+            fw.close()
+        assert next(records, None) is None, \
+                "`{0}` has more records than `{1}`".\
+                format(filename, self.filename)
+
+    def _iter_cycle_tasks(self, filename, N, compress):
+        format = self.format
+        if not filename.endswith(".gz"):
+            for span in snap_chunks(filename, self.chunksize,
+                                    signal=self.signal):
+                yield (filename,) + span, format, N, compress
+            return
+
+        records = iter_records(filename, format)
+        batchsize = max(self.chunksize / 1000, N)
+        while True:
+            batch = list(islice(records, batchsize))
+            if not batch:
+                break
+            yield batch, format, N, compress
 
-                if self.klass == "seqio":
-                    SeqIO.write(record, fw, self.format)
-                else:
-                    fw.write(record)
+    def _split_cycle(self, filename, names, N, pool):
+        """
+        Deal records to the N outputs in turn. Workers take chunks, and the
+        outputs of each chunk are rotated by the number of records before it.
+        """
+        compress = filename.endswith(".gz")
+        tasks = self._iter_cycle_tasks(filename, N, compress)
+        results = pool.imap(_cycle_chunk, tasks) if pool else \
+                    (_cycle_chunk(x) for x in tasks)
+
+        fws = HandlePool(compress=False)  # Chunks come compressed
+        start = 0
+        for texts, count in results:
+            for i, text in enumerate(texts):
+                if text:
+                    fws.write(names[(start + i) % N], text)
+            start += count
+        for name in names:
+            fws.write(name, "")
+        fws.close()
+        logging.debug("write %d records to %d files" % (start, N))
+
+
+class HandlePool (object):
+    """
+    Write to many files while keeping at most `maxopen` handles open. Output is
+    buffered per file and written out in blocks of `bufsize` bytes, through the
+    least recently used handles; closed files are reopened in append mode.
+    All buffers are flushed once they hold `maxbuffer` bytes in total, which
+    bounds the memory with many files.
+    Files ending with .gz are written as (multi-member) gzip, unless compress is
+    off, e.g. when the texts are already gzip members.
+    """
+    def __init__(self, maxopen=256, bufsize=1 << 20, compress=True,
+                 maxbuffer=1 << 28):
+        from collections import defaultdict
+        from jcvi.utils.orderedcollections import OrderedDict
+
+        self.maxopen = maxopen
+        self.bufsize = bufsize
+        self.maxbuffer = maxbuffer
+        self.compress = compress
+        self.handles = OrderedDict()
+        self.buffers = defaultdict(list)
+        self.sizes = defaultdict(int)
+        self.total = 0
+        self.created = set()
+        self.nopens = 0
+
+    def __len__(self):
+        return len(self.created | set(self.buffers))
 
-        for fw in filehandles:
+    def _open(self, filename):
+        fw = self.handles.pop(filename, None)
+        if fw is None:
+            if len(self.handles) >= self.maxopen:
+                oldname, oldfw = self.handles.popitem(last=False)
+                oldfw.close()
+            mode = "a" if filename in self.created else "w"
+            if filename.endswith(".gz") and self.compress:
+                import gzip
+                fw = gzip.open(filename, mode + "b")
+            else:
+                fw = open(filename, mode + "b")
+            self.created.add(filename)
+            self.nopens += 1
+        self.handles[filename] = fw  # Most recently used
+        return fw
+
+    def write(self, filename, text):
+        self.buffers[filename].append(text)
+        self.sizes[filename] += len(text)
+        self.total += len(text)
+        if self.sizes[filename] >= self.bufsize:
+            self.flush(filename)
+        elif self.total >= self.maxbuffer:
+            self.flushall()
+
+    def writelines(self, filename, lines):
+        for line in lines:
+            self.write(filename, line)
+
+    def flush(self, filename):
+        buf = self.buffers.pop(filename, None)
+        self.total -= self.sizes.pop(filename, 0)
+        if buf:
+            self._open(filename).write("".join(buf))
+
+    def flushall(self):
+        # Open files first, to save reopening the others
+        for filename in sorted(self.buffers.keys(),
+                               key=lambda x: x not in self.handles):
+            self.flush(filename)
+
+    def close(self):
+        self.flushall()
+        for fw in self.handles.values():
             fw.close()
+        self.handles.clear()
+        logging.debug("Wrote {0} files with {1} opens.".\
+                      format(len(self.created), self.nopens))
+
+
+def _split_part(task):
+    filename, keyed, part, nparts, maxopen, bufsize = task
+    pool = HandlePool(maxopen=maxopen, bufsize=bufsize)
+    owned = {}
+    for outfile, text in keyed(filename):
+        if nparts > 1:
+            mine = owned.get(outfile)
+            if mine is None:
+                mine = owned[outfile] = \
+                        (crc32(outfile) & 0xffffffff) % nparts == part
+            if not mine:
+                continue
+        pool.write(outfile, text)
+    pool.close()
+    return len(pool)
+
+
+def split_keyed(filename, keyed, cpus=1, maxopen=256, bufsize=1 << 20):
+    """
+    Split a file in one streaming pass, where keyed(filename) yields (outfile,
+    text) pairs, through a HandlePool. With cpus > 1, every worker reads the
+    input but owns a disjoint share of the outfiles (by hash of the name), so
+    no file is written by two processes. `keyed` must be picklable then, e.g.
+    a module-level function or a partial of one. Returns the number of files.
+    """
+    if cpus > 1:
+        from multiprocessing import Pool
+
+        tasks = [(filename, keyed, i, cpus, maxopen, bufsize) \
+                    for i in xrange(cpus)]
+        pool = Pool(cpus)
+        nfiles = sum(pool.map(_split_part, tasks))
+        pool.close()
+        pool.join()
+    else:
+        nfiles = _split_part((filename, keyed, 0, 1, maxopen, bufsize))
+
+    logging.debug("`{0}` split into {1} files.".format(filename, nfiles))
+    return nfiles
+
+
+def imap_ordered(func, items, cpus=1):
+    """
+    Yield func(item) for every item, in order. With cpus > 1, the items go to
+    a pool of workers, with at most 2 * cpus of them in flight, so that memory
+    stays bounded when the results are consumed in a stream.
+    """
+    if cpus <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    from collections import deque
+    from multiprocessing import Pool
+
+    pool = Pool(cpus)
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= 2 * cpus:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+    pool.close()
+    pool.join()
+
+
+class SpillDict (object):
+    """
+    Dict of key (str) => value (anything marshal takes) that spills into an
+    on-disk btree once more than `maxsize` items are held in memory.
+    """
+    def __init__(self, maxsize=1000000, dbfile=None):
+        self.maxsize = maxsize
+        self.dbfile = dbfile
+        self.tmpdir = None
+        self.mem = {}
+        self.db = None
+
+    def __len__(self):
+        return len(self.mem) + (len(self.db) if self.db is not None else 0)
+
+    def __setitem__(self, key, value):
+        self.mem[key] = value
+        if len(self.mem) >= self.maxsize:
+            self.spill()
+
+    def get(self, key, default=None):
+        if key in self.mem:
+            return self.mem[key]
+        if self.db is not None and self.db.has_key(key):
+            return marshal.loads(self.db[key])
+        return default
+
+    def pop(self, key, default=None):
+        if key in self.mem:
+            return self.mem.pop(key)
+        if self.db is not None and self.db.has_key(key):
+            value = marshal.loads(self.db[key])
+            del self.db[key]
+            return value
+        return default
+
+    def iteritems(self):
+        for item in self.mem.iteritems():
+            yield item
+        if self.db is not None:
+            for key, value in self.db.iteritems():
+                yield key, marshal.loads(value)
+
+    def spill(self):
+        import bsddb
+        from tempfile import mkdtemp
+
+        if self.db is None:
+            if not self.dbfile:
+                self.tmpdir = mkdtemp()
+                self.dbfile = op.join(self.tmpdir, "spill")
+            self.db = bsddb.btopen(self.dbfile, "n")
+            logging.debug("Spill {0} items to `{1}`.".\
+                          format(len(self.mem), self.dbfile))
+
+        for key, value in self.mem.iteritems():
+            self.db[key] = marshal.dumps(value)
+        self.mem = {}
+
+    def close(self):
+        if self.db is None:
+            return
+
+        self.db.close()
+        self.db = None
+        if self.tmpdir:
+            import shutil
+
+            shutil.rmtree(self.tmpdir)
+        else:
+            os.remove(self.dbfile)
+
+
+def external_sort(items, maxbytes=1 << 28, tmpdir=None):
+    """
+    Sort (key, text) items in bounded memory: runs holding up to maxbytes of
+    items (text and marshalled key) are sorted in memory and spilled to
+    temporary files, which are then merged k-way. Yields the items in order.
+    """
+    import heapq
+    import shutil
+    from tempfile import mkdtemp
+
+    rundir = None
+    runs = []
+    run, size = [], 0
+    for item in items:
+        run.append(item)
+        size += len(item[1]) + len(marshal.dumps(item[0]))
+        if size < maxbytes:
+            continue
+
+        rundir = rundir or mkdtemp(dir=tmpdir)
+        runs.append(spill_run(run, op.join(rundir, str(len(runs)))))
+        run, size = [], 0
+
+    if not runs:
+        run.sort()
+        for item in run:
+            yield item
+        return
+
+    if run:
+        runs.append(spill_run(run, op.join(rundir, str(len(runs)))))
+    logging.debug("Merge {0} sorted runs in `{1}`.".format(len(runs), rundir))
+    for item in heapq.merge(*[iter_run(x) for x in runs]):
+        yield item
+    shutil.rmtree(rundir)
+
+
+def spill_run(run, runfile):
+    run.sort()
+    fw = open(runfile, "wb")
+    for item in run:
+        marshal.dump(item, fw)
+    fw.close()
+    return runfile
+
+
+def iter_run(runfile):
+    fp = open(runfile, "rb")
+    while True:
+        try:
+            yield marshal.load(fp)
+        except EOFError:
+            break
+    fp.close()
+
+
+class ReadNames (object):
+    """
+    Read-name dictionary that maps names to dense integer IDs, the rank of the
+    name in sorted order. The sorted unique names are kept as a fixed-width
+    string table, memory-mapped when loaded from a .npy file, and names are
+    resolved by binary search instead of through a dict of strings.
+    """
+    def __init__(self, names):
+        self.names = names
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        return str(self.names[i])
+
+    def __contains__(self, name):
+        return self.lookup([name])[0] >= 0
+
+    @classmethod
+    def load(cls, filename):
+        return cls(np.load(filename, mmap_mode="r"))
+
+    @classmethod
+    def build(cls, names, filename=None, chunksize=1000000):
+        """
+        Build the string table from an iterable of names, collected in compact
+        chunks of chunksize. Saved to filename (.npy) if given.
+        """
+        names = iter(names)
+        chunks = []
+        while True:
+            chunk = list(islice(names, chunksize))
+            if not chunk:
+                break
+            chunks.append(np.unique(np.array(chunk, dtype=str)))
+
+        table = np.unique(np.concatenate(chunks)) if chunks else \
+                np.array([], dtype="S1")
+        if filename:
+            np.save(filename, table)
+            logging.debug("{0} read names written to `{1}`.".\
+                          format(len(table), filename))
+        return cls(table)
+
+    def lookup(self, names):
+        """
+        IDs of the names, -1 for the names not in the dictionary.
+        """
+        names = np.asarray(names)
+        if names.dtype.kind != "S":
+            names = names.astype(str)
+        if not len(self.names):
+            return -np.ones(len(names), dtype=np.int64)
+
+        ids = np.searchsorted(self.names, names).astype(np.int64)
+        ids[ids == len(self.names)] = 0
+        ids[self.names[ids] != names] = -1
+        return ids
+
+
+def pair_indices(names, key=str):
+    """
+    Group the names into mates that share the same key, through a ReadNames
+    dictionary of the keys. Returns the index arrays (i, j) of the entries that
+    pair up (keys seen exactly twice, in key order), and the number of
+    fragments (the entries whose key is not seen exactly twice).
+    """
+    keys = [key(x) for x in names]
+    ids = ReadNames.build(keys).lookup(keys)
+    counts = np.bincount(ids, minlength=1)
+    order = np.argsort(ids, kind="mergesort")
+    starts = np.cumsum(counts) - counts
+    paired = starts[counts == 2]
+    nfrags = int(counts[counts != 2].sum())
+    return order[paired], order[paired + 1], nfrags
+
+
+MATE_SUFFIX = re.compile(r"[/._:][12]$")
+
+
+def mate_key(rclip=None, separator=None):
+    """
+    Function that reduces a read name to the name shared by its mates: the
+    part before the separator, or the name without the last rclip chars, or by
+    default the name without a trailing /1 or /2 (also .1, _1 or :1).
+    """
+    if separator:
+        return lambda x: x.split(separator, 1)[0]
+    if rclip:
+        return lambda x: x[:-rclip]
+    return lambda x: MATE_SUFFIX.sub("", x)
+
+
+def record_name(text):
+    """
+    Name of a raw FASTA/FASTQ record, the first word of the header.
+    """
+    atoms = text[1:text.find("\n")].split(None, 1)
+    return atoms[0] if atoms else ""
+
+
+def iter_named_records(filename, format="fastq"):
+    """
+    Yield (name, text) of the raw records in a FASTA/FASTQ file.
+    """
+    for text in iter_records(filename, format):
+        yield record_name(text), text
+
+
+def rename_record(text, name):
+    """
+    Replace the header line of a raw FASTA/FASTQ record.
+    """
+    return text[0] + name + text[text.find("\n"):]
+
+
+def set_pair_options(p, rclip=None):
+    """
+    Add options that control how mates are matched, see `mate_key()`.
+    """
+    p.add_option("-r", dest="rclip", default=rclip, type="int",
+            help="pair ID is derived from rstrip N chars [default: %default]")
+    p.add_option("-d", dest="separator", default=None,
+            help="separater in the name field to reduce to the same clone " +\
+                 "[e.g. GFNQ33242/1 use /, BOT01-2453H.b1 use .]" +\
+                 "[default: strip trailing /1 and /2]")
+    p.add_option("--unsorted", default=False, action="store_true",
+            help="find mates that are not adjacent [default: %default]")
+    p.add_option("--maxsize", default=1000000, type="int",
+            help="unmatched reads kept in memory before spilling to disk " +\
+                 "[default: %default]")
+
+
+def iter_mates(a, b=None, key=str, unsorted=False, maxsize=1000000):
+    """
+    Pair up mates, from (name, item) iterables. Yields (item1, item2) for the
+    pairs and (item1, None) or (None, item2) for the reads without a mate.
+
+    With two streams, the reads are compared in lockstep, so that memory stays
+    constant when the streams are in the same order. Reads that do not match
+    wait in a SpillDict until the mate shows up. With one stream (interleaved
+    or bulk), adjacent reads are paired; non-adjacent mates are only found with
+    `unsorted`, otherwise unmatched reads are single.
+
+    Items must be str or tuples of str.
+    """
+    if b is None:
+        for pair in _iter_adjacent_mates(a, key, unsorted, maxsize):
+            yield pair
+        return
+
+    from itertools import izip_longest
+
+    pa, pb = SpillDict(maxsize), SpillDict(maxsize)
+    for ra, rb in izip_longest(a, b):
+        if ra and rb:
+            ka, kb = key(ra[0]), key(rb[0])
+            if ka == kb:
+                yield ra[1], rb[1]
+                continue
+        if ra:
+            ka = key(ra[0])
+            mate = pb.pop(ka)
+            if mate is not None:
+                yield ra[1], mate
+            else:
+                dup = pa.pop(ka)
+                if dup is not None:
+                    yield dup, None
+                pa[ka] = ra[1]
+        if rb:
+            kb = key(rb[0])
+            mate = pa.pop(kb)
+            if mate is not None:
+                yield mate, rb[1]
+            else:
+                dup = pb.pop(kb)
+                if dup is not None:
+                    yield None, dup
+                pb[kb] = rb[1]
+
+    if len(pa) or len(pb):
+        logging.debug("Unmatched reads: {0} and {1}.".format(len(pa), len(pb)))
+    for k, item in pa.iteritems():
+        yield item, None
+    for k, item in pb.iteritems():
+        yield None, item
+    pa.close()
+    pb.close()
+
+
+def _iter_adjacent_mates(records, key, unsorted, maxsize):
+    pending = SpillDict(maxsize) if unsorted else None
+    prev = prevkey = None
+    for name, item in records:
+        k = key(name)
+        if prev is not None and k == prevkey:
+            yield prev, item
+            prev = None
+            continue
+
+        if prev is not None:
+            if pending is None:
+                yield prev, None
+            else:
+                dup = pending.pop(prevkey)
+                if dup is not None:
+                    yield dup, None
+                pending[prevkey] = prev
+
+        prev, prevkey = item, k
+        if pending is not None:
+            mate = pending.pop(k)
+            if mate is not None:
+                yield mate, item
+                prev = None
+
+    if prev is not None:
+        yield prev, None
+    if pending is not None:
+        for k, item in pending.iteritems():
+            yield item, None
+        pending.close()
 
 
 def check_exists(filename):
@@ -299,6 +968,48 @@ def must_open(filename, mode="r", checkexists=False, skipcheck=False):
     return fp
 
 
+def snap_chunks(filename, chunksize, signal=">"):
+    """
+    Split a plain file into chunks of about `chunksize` bytes, without reading
+    through it. Each split point is moved forward to the next line that starts
+    with `signal`, so that the chunks break at record boundaries. For FASTQ
+    (signal "@"), the line after next must also start with "+", as quality
+    lines can start with "@".
+
+    Returns a list of (offset, nbytes).
+    """
+    filesize = op.getsize(filename)
+    fp = open(filename, "rb")
+    offsets = [0]
+    pos = chunksize
+    while pos < filesize:
+        fp.seek(pos - 1)
+        fp.readline()  # Finish the current line
+        while True:
+            pos = fp.tell()
+            row = fp.readline()
+            if not row:
+                break
+            if not row.startswith(signal):
+                continue
+            if signal != "@":
+                break
+            fp.readline()
+            if fp.readline().startswith("+"):
+                break
+            fp.seek(pos)
+            fp.readline()
+        if pos >= filesize:
+            break
+        if pos > offsets[-1]:
+            offsets.append(pos)
+        pos += chunksize
+    fp.close()
+
+    offsets.append(filesize)
+    return [(a, b - a) for a, b in zip(offsets[:-1], offsets[1:])]
+
+
 def read_until(handle, start):
     # read each line until a certain start, then puts the start tag back
     while 1:
@@ -432,8 +1143,11 @@ def split(args):
     """
     %prog split file outdir
 
-    split file into records
+    split file into records. Use --pair to split the mates (e.g. reads 2 of
+    reads 1) into the same number of records per chunk.
     """
+    from jcvi.apps.base import set_cpus
+
     p = OptionParser(split.__doc__)
     p.add_option("-n", dest="N", type="int", default=1,
             help="split into N chunks [default: %default]")
@@ -441,6 +1155,8 @@ def split(args):
             help="split all records [default: %default]")
     p.add_option("--cycle", default=False, action="store_true",
             help="splitted records in Round Robin fashion [default: %default]")
+    p.add_option("--pair", help="paired file to split in sync [default: %default]")
+    set_cpus(p)
 
     opts, args = p.parse_args(args)
 
@@ -449,7 +1165,8 @@ def split(args):
 
     mode = "cycle" if opts.cycle else "batch"
     filename, outdir = args
-    fs = FileSplitter(filename, outputdir=outdir, mode=mode)
+    fs = FileSplitter(filename, outputdir=outdir, mode=mode,
+                      pairfile=opts.pair, cpus=opts.cpus)
 
     if opts.all:
         logging.debug("option -all override -n")
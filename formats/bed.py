@@ -8,15 +8,15 @@ import sys
 import shutil
 import logging
 
-from itertools import groupby
+from itertools import groupby, izip
 from optparse import OptionParser
 
-from jcvi.formats.base import LineFile, must_open
+from jcvi.formats.base import LineFile, must_open, pair_indices
 from jcvi.utils.cbook import depends, thousands
 from jcvi.utils.range import Range, range_union, range_chain, \
         range_distance, range_intersect
-from jcvi.apps.base import ActionDispatcher, debug, sh, \
-        need_update, popen, set_outfile
+from jcvi.apps.base import ActionDispatcher, debug, sh, mkdir, \
+        need_update, popen, set_outfile, set_cpus
 debug()
 
 
@@ -238,11 +238,51 @@ def main():
         ('distance', 'calculate distance between bed features'),
         ('sample', 'sample bed file and remove high-coverage regions'),
         ('refine', 'refine bed file using a second bed file'),
+        ('split', 'split the bed into one seqid per file'),
             )
     p = ActionDispatcher(actions)
     p.dispatch(globals())
 
 
+def iter_split_bed(bedfile, outdir="."):
+    """
+    Route the lines of the bed to `outdir/seqid.bed`, as (outfile, text).
+    Track and browser lines are dropped.
+    """
+    for row in must_open(bedfile):
+        if row[0] == '#' or not row.strip() or \
+                row.startswith("track") or row.startswith("browser"):
+            continue
+        seqid = row.split("\t", 1)[0]
+        yield op.join(outdir, seqid + ".bed"), row
+
+
+def split(args):
+    """
+    %prog split bedfile outdir
+
+    Split the bed into one seqid per file. The bed is read once, with at most
+    --maxopen files open; --cpus splits the output files among processes.
+    """
+    from functools import partial
+    from jcvi.formats.base import split_keyed
+
+    p = OptionParser(split.__doc__)
+    p.add_option("--maxopen", default=256, type="int",
+                 help="Maximum number of open output files [default: %default]")
+    set_cpus(p, cpus=1)
+    opts, args = p.parse_args(args)
+
+    if len(args) != 2:
+        sys.exit(not p.print_help())
+
+    bedfile, outdir = args
+    mkdir(outdir)
+
+    split_keyed(bedfile, partial(iter_split_bed, outdir=outdir),
+                cpus=opts.cpus, maxopen=opts.maxopen)
+
+
 def uniq(args):
     """
     %prog uniq bedfile > newbedfile
@@ -918,8 +958,8 @@ def mates(args):
     bedfile, = args
     rclip = opts.rclip
 
-    key = (lambda x: x.accn[:-rclip]) if rclip else (lambda x: x.accn)
-    bed = Bed(bedfile, key=key)
+    key = (lambda x: x[:-rclip]) if rclip else str
+    bed = Bed(bedfile, sorted=False)
 
     pf = bedfile.rsplit(".", 1)[0]
     matesfile = pf + ".mates"
@@ -934,16 +974,12 @@ def mates(args):
         print >> fw, "\t".join(str(x) for x in \
                 ("library", pf, mindist, maxdist))
 
-    num_fragments = num_pairs = 0
+    num_pairs = 0
     matesbedfile = matesfile + ".bed"
     fwm = open(matesbedfile, "w")
-    for pe, lines in groupby(bed, key=key):
-        lines = list(lines)
-        if len(lines) != 2:
-            num_fragments += len(lines)
-            continue
-
-        a, b = lines
+    ii, jj, num_fragments = pair_indices((x.accn for x in bed), key=key)
+    for i, j in izip(ii, jj):
+        a, b = bed[i], bed[j]
 
         if opts.nointra and a.seqid == b.seqid:
             continue
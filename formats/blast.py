@@ -8,13 +8,13 @@ import sys
 import math
 import logging
 
-from itertools import groupby
+from itertools import groupby, izip
 from collections import defaultdict
 from optparse import OptionParser
 
 import numpy as np
 
-from jcvi.formats.base import LineFile, must_open
+from jcvi.formats.base import LineFile, must_open, pair_indices
 from jcvi.formats.coords import print_stats
 from jcvi.formats.sizes import Sizes
 from jcvi.utils.grouper import Grouper
@@ -809,30 +809,23 @@ def report_pairs(data, cutoff=0, mateorientation=None,
     if mateorientation:
         assert mateorientation in allowed_mateorientations
 
-    num_fragments, num_pairs = 0, 0
-
     all_dist = []
     linked_dist = []
     # +- (forward-backward) is `innie`, -+ (backward-forward) is `outie`
     orientations = defaultdict(int)
 
     # clip how many chars from end of the read name to get pair name
-    key = (lambda x: x.accn[:-rclip]) if rclip else (lambda x: x.accn)
-    data.sort(key=key)
+    key = (lambda x: x[:-rclip]) if rclip else str
+    ii, jj, num_fragments = pair_indices((x.accn for x in data), key=key)
+    num_pairs = len(ii)
 
     if pairsfile:
         pairsfw = open(pairsfile, "w")
     if insertsfile:
         insertsfw = open(insertsfile, "w")
 
-    for pe, lines in groupby(data, key=key):
-        lines = list(lines)
-        if len(lines) != 2:
-            num_fragments += len(lines)
-            continue
-
-        num_pairs += 1
-        a, b = lines
+    for i, j in izip(ii, jj):
+        a, b = data[i], data[j]
 
         asubject, astart, astop = a.seqid, a.start, a.end
         bsubject, bstart, bstop = b.seqid, b.start, b.end
@@ -26,9 +26,12 @@ import os.path as op
 import sys
 import logging
 
+from itertools import izip
 from optparse import OptionParser
 
-from jcvi.formats.base import BaseFile, read_block
+import numpy as np
+
+from jcvi.formats.base import BaseFile, must_open, read_block
 from jcvi.apps.base import ActionDispatcher, debug, sh, need_update, set_outfile
 debug()
 
@@ -67,16 +70,211 @@ class Chain (BaseFile):
         return len(self.chains)
 
     def iter_chain(self):
-        fp = open(self.filename)
-        for row in fp:
-            if row[0] != '#':
-                break
-
+        fp = (row for row in open(self.filename) if row[0] != '#')
         for chain, lines in read_block(fp, "chain"):
             lines = list(lines)
             yield ChainLine(chain, lines)
 
 
+MAPPED, CLIPPED, SPLIT, UNMAPPED, MISSING = range(5)
+
+
+class LiftOver (object):
+    """
+    Coordinate mapping compiled into ungapped blocks, sorted by source seqid
+    and start: source start, length, target seqid, target start and strand,
+    all 1-based. Intervals are mapped in bulk by binary search over the
+    blocks.
+    """
+    def __init__(self, blocks):
+        blocks = list(blocks) or [("", 1, 0, "", 1, "+")]
+        sseqids, sstarts, sizes, tseqids, tstarts, strands = zip(*blocks)
+        self.snames, scodes = np.unique(np.array(sseqids, dtype=str),
+                                        return_inverse=True)
+        self.tnames, tcodes = np.unique(np.array(tseqids, dtype=str),
+                                        return_inverse=True)
+        self.index = dict((x, i) for i, x in enumerate(self.snames))
+
+        sstarts = np.array(sstarts, dtype=np.int64)
+        order = np.lexsort((sstarts, scodes))
+        self.scodes = scodes[order]
+        self.sstarts = sstarts[order]
+        self.sizes = np.array(sizes, dtype=np.int64)[order]
+        self.tcodes = tcodes[order]
+        self.tstarts = np.array(tstarts, dtype=np.int64)[order]
+        self.reverse = (np.array(strands) == '-')[order]
+
+        # One sorted key for all seqids, each shifted beyond any coordinate
+        self.shift = 1 << 40
+        self.keys = self.scodes * self.shift + self.sstarts
+        logging.debug("A total of {0} blocks loaded.".format(len(self)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_agp(cls, agpfile):
+        """
+        Components to objects.
+        """
+        from jcvi.formats.agp import AGP
+
+        return cls((a.component_id, a.component_beg, a.component_span,
+                    a.object, a.object_beg, a.orientation) \
+                    for a in AGP(agpfile) if not a.is_gap)
+
+    @classmethod
+    def from_chain(cls, chainfile):
+        """
+        Targets (old) to queries (new) of the chains.
+        """
+        def iter_blocks():
+            for c in Chain(chainfile).chains:
+                atoms = c.chain.split()
+                tName, qName, qStrand = atoms[2], atoms[7], atoms[9]
+                tpos, qpos, qSize = int(atoms[5]), int(atoms[10]), int(atoms[8])
+                for size, dt, dq in c.blocks:
+                    qstart = qSize - qpos - size if qStrand == '-' else qpos
+                    yield tName, tpos + 1, size, qName, qstart + 1, qStrand
+                    tpos += size + dt
+                    qpos += size + dq
+
+        return cls(iter_blocks())
+
+    @classmethod
+    def load(cls, filename):
+        if filename.endswith(".agp"):
+            return cls.from_agp(filename)
+        return cls.from_chain(filename)
+
+    def lift(self, seqids, starts, ends):
+        """
+        Map intervals start..end (1-based, closed). Returns the target seqids,
+        starts and ends, whether the strand is flipped, and the status of each
+        interval, one of:
+
+        MAPPED: within one block
+        CLIPPED: overlaps one block only, mapped after clipping to the block
+        SPLIT: crosses block boundaries, mapped to the span of its two ends
+        UNMAPPED: overlaps no block
+        MISSING: seqid not in the mapping
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        names, inverse = np.unique(np.array(seqids, dtype=str),
+                                   return_inverse=True)
+        codes = np.array([self.index.get(x, -1) for x in names],
+                         dtype=np.int64)[inverse]
+
+        n = len(self)
+        scodes, sstarts, sizes = self.scodes, self.sstarts, self.sizes
+        # Block of the start, or the next one if the start falls in a gap
+        i = np.searchsorted(self.keys, codes * self.shift + starts,
+                            side="right") - 1
+        ic = i.clip(0, n - 1)
+        inside = (i >= 0) & (scodes[ic] == codes) & \
+                 (starts < sstarts[ic] + sizes[ic])
+        i = np.where(inside, i, i + 1)
+        ic = i.clip(0, n - 1)
+        # Block of the end, or the previous one if the end falls in a gap
+        j = np.searchsorted(self.keys, codes * self.shift + ends,
+                            side="right") - 1
+        jc = j.clip(0, n - 1)
+
+        ok = (codes >= 0) & (j >= 0) & (i <= j) & (scodes[jc] == codes)
+        a = np.maximum(starts, sstarts[ic])
+        b = np.minimum(ends, sstarts[jc] + sizes[jc] - 1)
+
+        def project(x, k):
+            offset = x - sstarts[k]
+            return np.where(self.reverse[k],
+                            self.tstarts[k] + sizes[k] - 1 - offset,
+                            self.tstarts[k] + offset)
+
+        ta, tb = project(a, ic), project(b, jc)
+        tstarts, tends = np.minimum(ta, tb), np.maximum(ta, tb)
+
+        status = np.where(i < j, SPLIT,
+                 np.where((a != starts) | (b != ends), CLIPPED, MAPPED))
+        status[~ok] = UNMAPPED
+        status[codes < 0] = MISSING
+        tseqids = self.tnames[self.tcodes[ic]]
+
+        return tseqids, tstarts, tends, self.reverse[ic], status
+
+
+Lift_formats = {
+    # seqid, start, end, strand columns and the offset of start
+    "bed": (0, 1, 2, 5, 1),
+    "gff": (0, 3, 4, 6, 0),
+}
+
+Lift_reasons = {
+    CLIPPED: "#Partially deleted in new",
+    SPLIT: "#Split in new",
+    UNMAPPED: "#Deleted in new",
+    MISSING: "#Deleted in new",
+}
+
+
+def liftover_file(lo, filename, fw, fwunmapped=None, format="bed",
+                  chunksize=100000):
+    """
+    Lift a BED or GFF file, chunk by chunk. Features that are not MAPPED are
+    written to fwunmapped with the reason, as UCSC liftOver does. Comments and
+    headers are copied; for GFF, the ##FASTA section is dropped.
+    """
+    sc, stc, ec, oc, offset = Lift_formats[format]
+    counts = [0] * 5
+
+    def flush(rows):
+        feats = [x for x in rows if isinstance(x, list)]
+        if feats:
+            tseqids, tstarts, tends, reverse, status = \
+                lo.lift([x[sc] for x in feats],
+                        [int(x[stc]) + offset for x in feats],
+                        [int(x[ec]) for x in feats])
+            it = izip(tseqids.tolist(), tstarts.tolist(), tends.tolist(),
+                      reverse.tolist(), status.tolist())
+        for row in rows:
+            if not isinstance(row, list):
+                fw.write(row)
+                continue
+
+            tseqid, tstart, tend, rev, st = it.next()
+            counts[st] += 1
+            if st != MAPPED:
+                if fwunmapped:
+                    print >> fwunmapped, Lift_reasons[st]
+                    print >> fwunmapped, "\t".join(row)
+                continue
+
+            row[sc], row[stc], row[ec] = tseqid, str(tstart - offset), str(tend)
+            if rev and len(row) > oc and row[oc] in ('+', '-'):
+                row[oc] = '-' if row[oc] == '+' else '+'
+            print >> fw, "\t".join(row)
+
+    rows = []
+    for row in must_open(filename):
+        if row.startswith("##FASTA"):
+            break
+        if row[0] == '#' or not row.strip() or \
+                row.startswith("track") or row.startswith("browser"):
+            rows.append(row)
+            continue
+
+        rows.append(row.rstrip("\r\n").split("\t"))
+        if len(rows) >= chunksize:
+            flush(rows)
+            rows = []
+    flush(rows)
+
+    logging.debug("Lifted {0}: {1} mapped, {2} clipped, {3} split, "
+                  "{4} unmapped, {5} on missing seqids.".\
+                  format(filename, *counts))
+    return counts
+
+
 def main():
 
     actions = (
@@ -85,6 +283,7 @@ def main():
         ('frompsl', 'generate chain file from PSL format'),
         ('fromagp', 'generate chain file from AGP format'),
         ('summary', 'provide stats of the chain file'),
+        ('liftover', 'lift BED or GFF coordinates through chain or AGP file'),
             )
     p = ActionDispatcher(actions)
     p.dispatch(globals())
@@ -184,6 +383,35 @@ def fromagp(args):
     logging.debug("File written to `{0}`.".format(chainfile))
 
 
+def liftover(args):
+    """
+    %prog liftover old.new.chain input.bed|input.gff > output
+
+    Lift BED or GFF coordinates through the chain file, or through the AGP file
+    (components to objects) if the name ends with .agp. The blocks are loaded
+    into sorted arrays and the features are mapped in chunks. Features that
+    are not within one block are written to --unmapped with the reason.
+    """
+    p = OptionParser(liftover.__doc__)
+    p.add_option("--unmapped",
+                 help="Write the features not lifted to file [default: %default]")
+    p.add_option("--format", choices=Lift_formats.keys(),
+                 help="Input format, guessed from extension if not given")
+    set_outfile(p)
+    opts, args = p.parse_args(args)
+
+    if len(args) != 2:
+        sys.exit(not p.print_help())
+
+    mapfile, infile = args
+    format = opts.format or ("gff" if infile.rsplit(".", 1)[-1] in \
+                ("gff", "gff3", "gtf") else "bed")
+    lo = LiftOver.load(mapfile)
+    fw = must_open(opts.outfile, "w")
+    fwunmapped = must_open(opts.unmapped, "w") if opts.unmapped else None
+    liftover_file(lo, infile, fw, fwunmapped=fwunmapped, format=format)
+
+
 def faToTwoBit(fastafile):
     twobitfile = fastafile.rsplit(".", 1)[0] + ".2bit"
     cmd = "faToTwoBit {0} {1}".format(fastafile, twobitfile)
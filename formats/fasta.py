@@ -11,15 +11,17 @@ import string
 
 from random import sample
 from optparse import OptionParser
-from itertools import groupby, izip_longest
+from itertools import groupby, izip, izip_longest
+
+import numpy as np
 
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
-from jcvi.formats.base import BaseFile, DictFile, must_open
+from jcvi.formats.base import BaseFile, DictFile, SpillDict, must_open
 from jcvi.utils.table import banner
-from jcvi.apps.base import ActionDispatcher, debug, set_outfile, sh
+from jcvi.apps.base import ActionDispatcher, debug, set_outfile, set_cpus, sh
 from jcvi.apps.console import red, green
 debug()
 
@@ -297,15 +299,402 @@ def parse_fasta(infile):
         yield header, seq
 
 
+def iter_fasta_lines(fp):
+    """
+    Yields (header, seqlines) with the raw lines (newlines included), so that
+    records can be copied out byte-for-byte without building SeqRecords.
+    """
+    header, lines = None, []
+    for row in fp:
+        if row[0] == '>':
+            if header is not None:
+                yield header, lines
+            header, lines = row, []
+        elif header is not None:
+            lines.append(row)
+
+    if header is not None:
+        yield header, lines
+
+
+def header_name(header):
+    """
+    Sequence ID from a raw header line, the same as SeqRecord.id
+    """
+    atoms = header[1:].split(None, 1)
+    return atoms[0] if atoms else ""
+
+
+def seq_digest(seqlines, rc_canonical=False):
+    """
+    Digest of the case-folded sequence. With `rc_canonical`, a sequence and its
+    reverse complement share the same digest.
+    """
+    from hashlib import md5
+
+    seq = "".join(x.strip() for x in seqlines).upper()
+    if rc_canonical:
+        seq = min(seq, rc(seq))
+    return md5(seq).digest()
+
+
+def name_digest(name):
+    from hashlib import md5
+
+    return md5(name).digest()
+
+
+def iter_uniq(fastafile, mode="name", rc_canonical=False, maxsize=10000000,
+              dups=None):
+    """
+    Streams the unique records (the first occurrence wins) in `fastafile` as
+    (header, seqlines), keeping only the digests of the names or sequences seen
+    so far. Duplicates are appended to `dups` as (representative record number,
+    duplicate name) when a list is given, see `resolve_clusters()`.
+    """
+    assert mode in ("name", "seq")
+    seen = SpillDict(maxsize=maxsize)
+    ndups = 0
+    for i, (header, seqlines) in enumerate(iter_fasta_lines(must_open(fastafile))):
+        if mode == "name":
+            digest = name_digest(header_name(header))
+        else:
+            digest = seq_digest(seqlines, rc_canonical=rc_canonical)
+
+        rep = seen.get(digest)
+        if rep is not None:
+            ndups += 1
+            if dups is not None:
+                dups.append((rep, header_name(header)))
+            continue
+
+        seen[digest] = i
+        yield header, seqlines
+
+    seen.close()
+    logging.debug("A total of {0} duplicate records removed.".format(ndups))
+
+
+def resolve_clusters(fastafile, dups):
+    """
+    Convert (representative record number, duplicate name) from `iter_uniq()`
+    into {representative name: [duplicate names]} with a header-only pass.
+    """
+    from collections import defaultdict
+
+    wanted = set(rep for rep, name in dups)
+    repnames = {}
+    for i, (header, seqlines) in enumerate(iter_fasta_lines(must_open(fastafile))):
+        if i in wanted:
+            repnames[i] = header_name(header)
+
+    clusters = defaultdict(list)
+    for rep, name in dups:
+        clusters[repnames[rep]].append(name)
+    return clusters
+
+
+def write_uniq(fastafile, uniqfastafile, mode="name", rc_canonical=False,
+               maxsize=10000000, trimname=False, clustersfile=None):
+    """
+    Write the unique records to `uniqfastafile`, and optionally the duplicate
+    clusters to `clustersfile` (representative, then comma-separated members).
+    """
+    dups = [] if clustersfile else None
+    fw = must_open(uniqfastafile, "w")
+    nuniq = 0
+    for header, seqlines in iter_uniq(fastafile, mode=mode,
+                    rc_canonical=rc_canonical, maxsize=maxsize, dups=dups):
+        if trimname:
+            header = ">{0}\n".format(header_name(header))
+        fw.write(header)
+        fw.writelines(seqlines)
+        nuniq += 1
+    fw.close()
+    logging.debug("A total of {0} unique records written to `{1}`.".\
+                  format(nuniq, uniqfastafile))
+
+    if clustersfile:
+        clusters = resolve_clusters(fastafile, dups)
+        fw = must_open(clustersfile, "w")
+        for rep, members in sorted(clusters.items()):
+            print >> fw, "\t".join((rep, ",".join(members)))
+        fw.close()
+        logging.debug("A total of {0} duplicate clusters written to `{1}`.".\
+                      format(len(clusters), clustersfile))
+
+    return nuniq
+
+
+class RecordContext (object):
+    """
+    Passed to the record transforms in `process_records()`. `index` is the
+    0-based record number in the input when known (None otherwise), `stats`
+    counts whatever the transform wants to report, and `notes` collects extra
+    output lines that are written in input order.
+    """
+    def __init__(self, index=None):
+        from collections import Counter
+
+        self.index = index
+        self.stats = Counter()
+        self.notes = []
+
+
+def read_fasta_texts(texts):
+    from cStringIO import StringIO
+
+    return SeqIO.parse(StringIO(texts[0]), "fasta")
+
+
+def read_fasta_qual_texts(texts):
+    """
+    Records from a FASTA chunk, with quality from the matching .qual chunk (or
+    a default quality if there is none), see `iter_fasta_qual()`.
+    """
+    from cStringIO import StringIO
+
+    fastahandle = StringIO(texts[0])
+    if len(texts) > 1:
+        return iter_fasta_qual(fastahandle, StringIO(texts[1]), modify=True)
+
+    return (modify_qual(set_qual(rec)) for rec in \
+                SeqIO.parse(fastahandle, "fasta"))
+
+
+# Set before the worker pool forks, so that the transform and its arguments
+# are inherited by the workers instead of pickled with every chunk
+_pipeline = {}
+
+
+def _process_chunk(task):
+    from cStringIO import StringIO
+
+    filenames = _pipeline["filenames"]
+    transform = _pipeline["transform"]
+    reader = _pipeline["reader"]
+    outformats = _pipeline["outformats"]
+
+    spans, texts, first = task
+    if texts is None:
+        texts = []
+        for filename, (offset, nbytes) in zip(filenames, spans):
+            fp = open(filename, "rb")
+            fp.seek(offset)
+            texts.append(fp.read(nbytes))
+            fp.close()
+
+    ctx = RecordContext()
+    outputs = [StringIO() for x in outformats]
+    nin = nout = 0
+    for i, rec in enumerate(reader(texts)):
+        ctx.index = None if first is None else first + i
+        nin += 1
+        rec = transform(rec, ctx)
+        if rec is None:
+            continue
+        for fw, outformat in zip(outputs, outformats):
+            SeqIO.write([rec], fw, outformat)
+        nout += 1
+
+    ctx.stats["records_in"] += nin
+    ctx.stats["records_out"] += nout
+    ctx.stats["bytes_in"] += sum(len(x) for x in texts)
+    return [x.getvalue() for x in outputs], ctx.notes, ctx.stats
+
+
+def _iter_text_chunks(filenames, chunksize):
+    """
+    Batch raw records from the inputs (read in lockstep) into text chunks, used
+    when the inputs cannot be seeked into, or record numbers are needed.
+    """
+    from itertools import izip
+
+    handles = [iter_fasta_lines(must_open(x)) for x in filenames]
+    first = 0
+    batch = [[] for x in filenames]
+    nrecords = nbytes = 0
+    for recs in izip(*handles):
+        for b, (header, lines) in zip(batch, recs):
+            b.append(header)
+            b.extend(lines)
+            nbytes += len(header) + sum(len(x) for x in lines)
+        nrecords += 1
+        if nbytes >= chunksize:
+            yield None, ["".join(x) for x in batch], first
+            first += nrecords
+            batch = [[] for x in filenames]
+            nrecords = nbytes = 0
+
+    if nrecords:
+        yield None, ["".join(x) for x in batch], first
+
+
+def iter_chunks(filenames, chunksize=8000000, indexed=False):
+    """
+    Chunks of input for `_process_chunk()`. A single plain FASTA file is split
+    by byte offsets, snapped to the record boundaries. Multiple files (read in
+    lockstep), compressed files, or `indexed` (record numbers needed) are
+    batched as text instead.
+    """
+    from jcvi.formats.base import snap_chunks
+
+    filename = filenames[0]
+    seekable = op.isfile(filename) and not filename.endswith((".gz", ".bz2"))
+    if len(filenames) == 1 and seekable and not indexed:
+        for span in snap_chunks(filename, chunksize):
+            yield [span], None, None
+    else:
+        for chunk in _iter_text_chunks(filenames, chunksize):
+            yield chunk
+
+
+def process_records(filenames, outfiles, transform, reader=read_fasta_texts,
+                    outformats=("fasta",), notesfile=None, cpus=1,
+                    chunksize=8000000, indexed=False):
+    """
+    Run `transform(rec, ctx)` on every record in the input and write the
+    returned records (None drops the record) to the outfiles, one per output
+    format, in the input order. The input is split into chunks of records that
+    are processed by a pool of `cpus` workers, with a bounded number of chunks
+    in flight.
+
+    Returns the merged counters, including the throughput counters.
+    """
+    import time
+    from collections import Counter
+    from jcvi.formats.base import imap_ordered
+
+    if isinstance(filenames, basestring):
+        filenames = [filenames]
+    if isinstance(outfiles, basestring):
+        outfiles = [outfiles]
+
+    _pipeline.update(filenames=filenames, transform=transform, reader=reader,
+                     outformats=outformats)
+    fws = [must_open(x, "w") for x in outfiles]
+    notesfw = must_open(notesfile, "w") if notesfile else None
+    chunks = iter_chunks(filenames, chunksize=chunksize, indexed=indexed)
+
+    stats = Counter()
+    t0 = time.time()
+
+    def flush(result):
+        texts, notes, chunkstats = result
+        for fw, text in zip(fws, texts):
+            fw.write(text)
+            stats["bytes_out"] += len(text)
+        if notesfw:
+            notesfw.writelines(x + "\n" for x in notes)
+        stats.update(chunkstats)
+        stats["chunks"] += 1
+
+    for result in imap_ordered(_process_chunk, chunks, cpus=cpus):
+        flush(result)
+
+    for fw in fws:
+        if fw is sys.stdout:  # Might be written again, e.g. by `pool()`
+            fw.flush()
+        else:
+            fw.close()
+    if notesfw:
+        notesfw.close()
+
+    elapsed = max(time.time() - t0, 1e-6)
+    logging.debug("Processed {0} records ({1} written) in {2} chunks on "
+                  "{3} cpus, {4:.1f}s, {5:.0f} records/s, {6:.1f} MB/s".\
+                  format(stats["records_in"], stats["records_out"],
+                         stats["chunks"], cpus, elapsed,
+                         stats["records_in"] / elapsed,
+                         stats["bytes_in"] / elapsed / 1e6))
+    return stats
+
+
+def shred_ranges(seqlen, readlen, depth):
+    """
+    Begins and ends of the shredded reads for a sequence, same as `shredContig`
+    in the runCA script: reads of readlen are evenly spaced to reach depth.
+    """
+    shredlen = min(seqlen - 50, readlen)
+    numreads = max(seqlen * depth / shredlen, 1)
+    if numreads == 1:
+        return np.array([0]), np.array([shredlen])
+
+    center_increments = (seqlen - shredlen) * 1. / (numreads - 1)
+    begins = center_increments * np.arange(numreads)
+    ends = (begins + shredlen).astype(int)
+    begins = begins.astype(int)
+    keep = np.ones(numreads, dtype=bool)
+    keep[1:] = begins[1:] != begins[:-1]
+    return begins[keep], ends[keep]
+
+
+def format_fragments(template, seq, begins, ends, names, qual=None,
+                     defaultqv=None, width=None, **kwargs):
+    """
+    Format the slices seq[begins[i]:ends[i]] of one record into one text.
+    Template may use the fields {name}, {seq}, {qual} and {slen}, and the extra
+    fields in kwargs. Without qual, qualities are filled with defaultqv. The
+    sequences are wrapped at width if given.
+    """
+    texts = []
+    for name, b, e in izip(names, begins, ends):
+        s = seq[b:e]
+        slen = len(s)
+        if qual is not None:
+            q = qual[b:e]
+        else:
+            q = defaultqv * slen if defaultqv else ""
+        if width:
+            s = "\n".join(s[i:i + width] for i in xrange(0, slen, width))
+        texts.append(template.format(name=name, seq=s, qual=q, slen=slen,
+                                     **kwargs))
+    return "".join(texts)
+
+
+def emit_fragments(func, items, fws, cpus=1, chunksize=100):
+    """
+    Run `func` on chunks of `chunksize` items on a pool of `cpus` workers. The
+    func returns a text for each of the output handles fws, which are written
+    in the input order with a bounded number of chunks in flight.
+
+    Returns the number of items processed.
+    """
+    from itertools import islice
+    from jcvi.formats.base import imap_ordered
+
+    nitems = [0]
+
+    def chunks():
+        it = iter(items)
+        while True:
+            chunk = list(islice(it, chunksize))
+            if not chunk:
+                break
+            nitems[0] += len(chunk)
+            yield chunk
+
+    for texts in imap_ordered(func, chunks(), cpus=cpus):
+        for fw, text in zip(fws, texts):
+            fw.write(text)
+
+    return nitems[0]
+
+
+def clean_record(rec, ctx):
+    seq = "".join(x for x in str(rec.seq).upper() \
+                  if x in string.letters or x == '*')
+    return SeqRecord(Seq(seq), id=rec.description, description="")
+
+
 def clean(args):
     """
     %prog clean fastafile
 
     Remove irregular chars in FASTA seqs.
     """
-    import string
-
     p = OptionParser(clean.__doc__)
+    set_cpus(p)
     set_outfile(p)
 
     opts, args = p.parse_args(args)
@@ -314,12 +703,67 @@ def clean(args):
         sys.exit(not p.print_help())
 
     fastafile, = args
-    fw = must_open(opts.outfile, "w")
-    for header, seq in parse_fasta(fastafile):
-        seq = "".join(x for x in seq if x in string.letters or x == '*')
-        seq = Seq(seq)
-        s = SeqRecord(seq, id=header, description="")
-        SeqIO.write([s], fw, "fasta")
+    process_records(fastafile, opts.outfile, clean_record, cpus=opts.cpus)
+
+
+TRANSLATE_LABELS = ("complete", "five_prime_missing", "three_prime_missing",
+                    "contain_ns", "cannot_translate")
+
+
+def translate_record(rec, ctx, longest=False):
+    """
+    Translate one CDS record, trying all three frames (or the longest ORF). The
+    labels of the translation are counted in ctx.stats and noted in ctx.notes.
+    """
+    name = rec.name
+    cds = rec.seq
+    cdslen = len(cds)
+    peplen = cdslen / 3
+
+    # if longest ORF is requested
+    # try all six frames
+    if longest:
+        orf = longest_orf(cds)
+        if len(orf) == 0:
+            return None
+        newcds = Seq(orf)
+        pep = newcds.translate()
+    else:
+        # Try all three frames
+        for i in xrange(3):
+            newcds = cds[i: i + peplen * 3]
+            pep = newcds.translate()
+            if "*" not in pep.rstrip("*"):
+                break
+
+    labels = []
+    if "*" in pep.rstrip("*"):
+        logging.error("{0} cannot translate".format(name))
+        labels.append("cannot_translate")
+
+    contains_start = pep.startswith("M")
+    contains_stop = pep.endswith("*")
+    contains_ns = "X" in pep
+    start_ns = pep.startswith("X")
+    end_ns = pep.endswith("X")
+
+    if not contains_start:
+        labels.append("five_prime_missing")
+    if not contains_stop:
+        labels.append("three_prime_missing")
+    if contains_ns:
+        labels.append("contain_ns")
+    if contains_start and contains_stop:
+        labels.append("complete")
+    if start_ns:
+        labels.append("start_ns")
+    if end_ns:
+        labels.append("end_ns")
+
+    ctx.stats.update(labels)
+    ctx.notes.append("\t".join((name, ",".join(labels))))
+
+    return SeqRecord(pep, id=name, description=rec.description)
 
 
 def translate(args):
@@ -330,7 +774,7 @@ def translate(args):
     represents a partial gene, therefore disrupting the frame of the protein.
     Check all three frames to get a valid translation.
     """
-    from collections import defaultdict
+    from functools import partial
     from jcvi.utils.cbook import percentage
 
     p = OptionParser(translate.__doc__)
@@ -339,6 +783,7 @@ def translate(args):
                       "label [default: %default]")
     p.add_option("--longest", default=False, action="store_true",
                  help="Find the longest ORF from each input CDS [default: %default]")
+    set_cpus(p)
     set_outfile(p)
 
     opts, args = p.parse_args(args)
@@ -347,75 +792,15 @@ def translate(args):
         sys.exit(not p.print_help())
 
     cdsfasta, = args
-    f = Fasta(cdsfasta, lazy=True)
-    fw = must_open(opts.outfile, "w")
+    idsfile = cdsfasta.rsplit(".", 1)[0] + ".ids" if opts.ids else None
 
-    if opts.ids:
-        idsfile = cdsfasta.rsplit(".", 1)[0] + ".ids"
-        ids = open(idsfile, "w")
-    else:
-        ids = None
-
-    five_prime_missing = three_prime_missing = 0
-    contain_ns = complete = cannot_translate = total = 0
-
-    for name, rec in f.iteritems_ordered():
-        cds = rec.seq
-        cdslen = len(cds)
-        peplen = cdslen / 3
-        total += 1
-
-        # if longest ORF is requested
-        # try all six frames
-        if opts.longest:
-            orf = longest_orf(cds)
-            if len(orf) == 0:
-                continue
-            newcds = Seq(orf)
-            pep = newcds.translate()
-        else:
-            # Try all three frames
-            for i in xrange(3):
-                newcds = cds[i: i + peplen * 3]
-                pep = newcds.translate()
-                if "*" not in pep.rstrip("*"):
-                    break
-
-        labels = []
-        if "*" in pep.rstrip("*"):
-            logging.error("{0} cannot translate".format(name))
-            cannot_translate += 1
-            labels.append("cannot_translate")
-
-        contains_start = pep.startswith("M")
-        contains_stop = pep.endswith("*")
-        contains_ns = "X" in pep
-        start_ns = pep.startswith("X")
-        end_ns = pep.endswith("X")
-
-        if not contains_start:
-            five_prime_missing += 1
-            labels.append("five_prime_missing")
-        if not contains_stop:
-            three_prime_missing += 1
-            labels.append("three_prime_missing")
-        if contains_ns:
-            contain_ns += 1
-            labels.append("contain_ns")
-        if contains_start and contains_stop:
-            complete += 1
-            labels.append("complete")
-        if start_ns:
-            labels.append("start_ns")
-        if end_ns:
-            labels.append("end_ns")
-
-        if ids:
-            print >> ids, "\t".join((name, ",".join(labels)))
-
-        peprec = SeqRecord(pep, id=name, description=rec.description)
-        SeqIO.write([peprec], fw, "fasta")
-        fw.flush()
+    transform = partial(translate_record, longest=opts.longest)
+    stats = process_records(cdsfasta, opts.outfile, transform,
+                            notesfile=idsfile, cpus=opts.cpus)
+
+    total = stats["records_in"]
+    complete, five_prime_missing, three_prime_missing, contain_ns, \
+            cannot_translate = [stats[x] for x in TRANSLATE_LABELS]
 
     print >> sys.stderr, "Complete gene models: {0}".\
                         format(percentage(complete, total))
@@ -431,15 +816,28 @@ def translate(args):
                         format(percentage(cannot_translate, total))
 
 
+def filter_record(rec, ctx, cutoff=0, less=False):
+    if less and len(rec) > cutoff:
+        return None
+
+    if (not less) and len(rec) < cutoff:
+        return None
+
+    return rec
+
+
 def filter(args):
     """
     %prog filter fastafile 100
 
     Filter the FASTA file to contain records with size >= or <= certain cutoff.
     """
+    from functools import partial
+
     p = OptionParser(filter.__doc__)
     p.add_option("--less", default=False, action="store_true",
                  help="filter the sizes <= certain cutoff [default: >=]")
+    set_cpus(p)
 
     opts, args = p.parse_args(args)
 
@@ -452,19 +850,8 @@ def filter(args):
     except ValueError:
         sys.exit(not p.print_help())
 
-    f = Fasta(fastafile, lazy=True)
-
-    fw = sys.stdout
-    for name, rec in f.iteritems_ordered():
-
-        if opts.less and len(rec) > cutoff:
-            continue
-
-        if (not opts.less) and len(rec) < cutoff:
-            continue
-
-        SeqIO.write([rec], fw, "fasta")
-        fw.flush()
+    transform = partial(filter_record, cutoff=cutoff, less=opts.less)
+    process_records(fastafile, "stdout", transform, cpus=opts.cpus)
 
 
 def pool(args):
@@ -521,15 +908,102 @@ def ids(args):
     fw.close()
 
 
+def iter_fasta_offsets(fastafile):
+    """
+    Scan the fastafile once and yield (name, offset, nbytes, seqlen) for each
+    record, where offset and nbytes span the raw record including its header.
+    """
+    fp = open(fastafile, "rb")
+    name, start, seqlen = None, 0, 0
+    pos = 0
+    for row in fp:
+        if row[0] == '>':
+            if name is not None:
+                yield name, start, pos - start, seqlen
+            name, start, seqlen = header_name(row), pos, 0
+        else:
+            seqlen += len(row.strip())
+        pos += len(row)
+
+    if name is not None:
+        yield name, start, pos - start, seqlen
+    fp.close()
+
+
+def _write_run(run):
+    from tempfile import NamedTemporaryFile
+
+    run.sort()
+    fw = NamedTemporaryFile(delete=False)
+    for x in run:
+        print >> fw, "\t".join(str(a) for a in x)
+    fw.close()
+    return fw.name
+
+
+def _read_run(runfile):
+    for row in open(runfile):
+        k, name, offset, nbytes = row.rstrip("\n").split("\t")
+        yield int(k), name, int(offset), int(nbytes)
+
+
+def sorted_fasta_offsets(fastafile, key="name", order=None, maxsize=10000000):
+    """
+    Yield (sortkey, name, offset, nbytes) sorted by name, decreasing length or
+    rank in `order` (records not in `order` go last, by name). When the index
+    holds more than `maxsize` records, sorted runs are spilled to disk and
+    k-way merged.
+    """
+    from heapq import merge
+
+    assert key in ("name", "sizes", "order")
+    nlast = len(order) if order else 0
+
+    run, runfiles = [], []
+    for name, offset, nbytes, seqlen in iter_fasta_offsets(fastafile):
+        if key == "name":
+            k = 0
+        elif key == "sizes":
+            k = -seqlen
+        else:
+            k = order.get(name, nlast)
+        run.append((k, name, offset, nbytes))
+        if len(run) >= maxsize:
+            runfiles.append(_write_run(run))
+            run = []
+
+    if not runfiles:
+        run.sort()
+        for x in run:
+            yield x
+        return
+
+    runfiles.append(_write_run(run))
+    logging.debug("Merge {0} sorted runs.".format(len(runfiles)))
+    for x in merge(*[_read_run(x) for x in runfiles]):
+        yield x
+
+    for runfile in runfiles:
+        os.remove(runfile)
+
+
 def sort(args):
     """
     %prog sort fastafile
 
-    Sort a list of sequences and output with sorted IDs, etc.
+    Sort a list of sequences and output with sorted IDs, etc. Only an offset
+    index of the records is sorted (out of core, beyond --maxsize records),
+    and the records are then copied out by seeking into fastafile.
     """
     p = OptionParser(sort.__doc__)
     p.add_option("--sizes", default=False, action="store_true",
                  help="Sort by decreasing size [default: %default]")
+    p.add_option("--order",
+                 help="Sort by the IDs in the first column of file, such as "
+                      "a .sizes or .ids file [default: %default]")
+    p.add_option("--maxsize", default=10000000, type="int",
+                 help="Records to sort in memory before spilling "
+                      "[default: %default]")
 
     opts, args = p.parse_args(args)
 
@@ -539,22 +1013,31 @@ def sort(args):
     fastafile, = args
     sortedfastafile = fastafile.rsplit(".", 1)[0] + ".sorted.fasta"
 
-    f = Fasta(fastafile, index=False)
-    fw = must_open(sortedfastafile, "w")
-    if opts.sizes:
-        # Sort by decreasing size
-        sortlist = sorted(f.itersizes(), key=lambda x: (-x[1], x[0]))
-        logging.debug("Sort by size: max: {0}, min: {1}".\
-                        format(sortlist[0], sortlist[-1]))
-        sortlist = [x for x, s in sortlist]
+    order = None
+    if opts.order:
+        key = "order"
+        order = {}
+        for row in open(opts.order):
+            atoms = row.split()
+            if atoms and atoms[0] not in order:
+                order[atoms[0]] = len(order)
+    elif opts.sizes:
+        key = "sizes"
     else:
-        sortlist = sorted(f.iterkeys())
+        key = "name"
 
-    for key in sortlist:
-        rec = f[key]
-        SeqIO.write([rec], fw, "fasta")
+    fp = open(fastafile, "rb")
+    fw = must_open(sortedfastafile, "w")
+    for k, name, offset, nbytes in sorted_fasta_offsets(fastafile, key=key,
+                                        order=order, maxsize=opts.maxsize):
+        fp.seek(offset)
+        rec = fp.read(nbytes)
+        if rec[-1] != "\n":  # last record without trailing newline
+            rec += "\n"
+        fw.write(rec)
 
     logging.debug("Sorted file written to `{0}`.".format(sortedfastafile))
+    fp.close()
     fw.close()
 
 
@@ -688,12 +1171,64 @@ def summary(args):
     return reals, nns, seqlen
 
 
+def format_record(rec, ctx, opts=None, mapping=None, annotation=None):
+    """
+    Rename one record following the options of `format()`.
+    """
+    i = ctx.index
+    origid = rec.id
+    description = rec.description
+    if opts.until:
+        description = description.split(opts.until, 1)[0]
+        rec.id = description
+    if opts.index:
+        description = description.split()[opts.index]
+        rec.id = description
+
+    if opts.gb:
+        # gi|262233616|gb|GU123895.1| Coffea arabica clone BAC
+        atoms = rec.id.split("|")
+        if len(atoms) >= 3:
+            rec.id = atoms[3]
+        elif len(atoms) == 2:
+            rec.id = atoms[1]
+    if opts.pairs:
+        id = "/1" if (i % 2 == 0) else "/2"
+        rec.id += id
+    if opts.noversion:
+        rec.id = rec.id.rsplit(".", 1)[0]
+    if opts.sequential:
+        rec.id = "{0:0{1}d}".format(i + 1, opts.pad0)
+    if opts.prefix:
+        rec.id = opts.prefix + rec.id
+    if opts.suffix:
+        rec.id += opts.suffix
+    if opts.template:
+        template, dir, lib = [x.split("=")[-1] for x in
+                rec.description.split()[1:4]]
+        rec.id = "{0}-{1}/{2}".format(lib, template, dir)
+    if mapping is not None:
+        if origid in mapping:
+            rec.id = mapping[origid]
+        else:
+            logging.error("{0} not found in `{1}`. ID unchanged.".\
+                    format(origid, mapping.filename))
+    rec.description = ""
+    if annotation is not None:
+        rec.description = annotation.get(origid, "")
+    ctx.notes.append("\t".join((origid, rec.id)))
+
+    return rec
+
+
 def format(args):
     """
     %prog format infasta outfasta
 
     Reformat FASTA file and also clean up names.
     """
+    from functools import partial
+
     p = OptionParser(format.__doc__)
     p.add_option("--pairs", default=False, action="store_true",
             help="Add trailing /1 and /2 for interleaved pairs [default: %default]")
@@ -717,82 +1252,26 @@ def format(args):
     p.add_option("--annotation", help="Add functional annotation from "
                         "two-column file ('ID <--> Annotation') [default: %default]")
     p.add_option("--ids", help="Generate ID conversion table [default: %default]")
+    set_cpus(p)
     opts, args = p.parse_args(args)
 
     if len(args) != 2:
         sys.exit(not p.print_help())
 
     infasta, outfasta = args
-    gb = opts.gb
-    until = opts.until
-    pairs = opts.pairs
-    prefix = opts.prefix
-    suffix = opts.suffix
-    noversion = opts.noversion
-    sequential = opts.sequential
-    idx = opts.index
-    mapfile = opts.switch
-    annotfile = opts.annotation
-    idsfile = opts.ids
-    idsfile = open(idsfile, "w") if idsfile else None
-
-    if mapfile:
-        mapping = DictFile(mapfile, delimiter="\t")
-    if annotfile:
-        annotation = DictFile(annotfile, delimiter="\t")
-
-    fw = must_open(outfasta, "w")
-    fp = SeqIO.parse(must_open(infasta), "fasta")
-    for i, rec in enumerate(fp):
-        origid = rec.id
-        description = rec.description
-        if until:
-            description = description.split(until, 1)[0]
-            rec.id = description
-        if idx:
-            description = description.split()[idx]
-            rec.id = description
-
-        if gb:
-            # gi|262233616|gb|GU123895.1| Coffea arabica clone BAC
-            atoms = rec.id.split("|")
-            if len(atoms) >= 3:
-                rec.id = atoms[3]
-            elif len(atoms) == 2:
-                rec.id = atoms[1]
-        if pairs:
-            id = "/1" if (i % 2 == 0) else "/2"
-            rec.id += id
-        if noversion:
-            rec.id = rec.id.rsplit(".", 1)[0]
-        if sequential:
-            rec.id = "{0:0{1}d}".format(i + 1, opts.pad0)
-        if prefix:
-            rec.id = prefix + rec.id
-        if suffix:
-            rec.id += suffix
-        if opts.template:
-            template, dir, lib = [x.split("=")[-1] for x in
-                    rec.description.split()[1:4]]
-            rec.id = "{0}-{1}/{2}".format(lib, template, dir)
-        if mapfile:
-            if origid in mapping:
-                rec.id = mapping[origid]
-            else:
-                logging.error("{0} not found in `{1}`. ID unchanged.".\
-                        format(origid, mapfile))
-        rec.description = ""
-        if annotfile:
-            rec.description = annotation.get(origid, "")
-        if idsfile:
-            print >> idsfile, "\t".join((origid, rec.id))
+    mapping = DictFile(opts.switch, delimiter="\t") if opts.switch else None
+    annotation = DictFile(opts.annotation, delimiter="\t") \
+                    if opts.annotation else None
 
-        SeqIO.write(rec, fw, "fasta")
+    transform = partial(format_record, opts=opts, mapping=mapping,
+                        annotation=annotation)
+    # Pairs and sequential IDs depend on the record number
+    indexed = opts.pairs or opts.sequential
+    process_records(infasta, outfasta, transform, notesfile=opts.ids,
+                    cpus=opts.cpus, indexed=indexed)
 
-    if idsfile:
-        logging.debug("Conversion table written to `{0}`.".\
-                      format(idsfile.name))
-        idsfile.close()
+    if opts.ids:
+        logging.debug("Conversion table written to `{0}`.".format(opts.ids))
 
 
 def print_first_difference(arec, brec, ignore_case=False, ignore_N=False,
@@ -942,17 +1421,237 @@ def get_qual(fastafile, suffix=QUALSUFFIX, check=True):
     return qualfile1
 
 
+def iter_raw_records(fp, format="fasta"):
+    """
+    Yields (header, lines) of raw FASTA (or FASTQ) records.
+    """
+    if format == "fastq":
+        from jcvi.formats.fastq import iter_fastq_lines
+        return iter_fastq_lines(fp)
+    return iter_fasta_lines(fp)
+
+
+def read_ids(listfile, buckets=False):
+    """
+    Read the IDs in the first column of listfile, and map each ID to the bucket
+    in the second column if `buckets` is set, or to None otherwise.
+    """
+    names = {}
+    for row in open(listfile):
+        atoms = row.split()
+        if not atoms:
+            continue
+        names[atoms[0]] = atoms[1] if buckets else None
+    return names
+
+
+def build_fai(filename, faifile):
+    """
+    Write the samtools .fai index (name, length, offset, linebases, linebytes)
+    of a FASTA file, without samtools. Lines within a record must have the
+    same length, except the last one.
+    """
+    fp = open(filename, "rb")
+    fw = open(faifile, "w")
+    entry = None
+    pos = 0
+
+    def flush(entry):
+        if entry:
+            name, length, offset, linebases, linebytes, last = entry
+            print >> fw, "\t".join(str(x) for x in \
+                    (name, length, offset, linebases, linebytes))
+
+    nrecords = 0
+    for row in fp:
+        pos += len(row)
+        if row[0] == ">":
+            flush(entry)
+            name = row[1:].split(None, 1)[0]
+            entry = [name, 0, pos, 0, 0, False]
+            nrecords += 1
+            continue
+
+        if entry is None:
+            continue
+        bases = len(row.rstrip("\r\n"))
+        if not bases:
+            entry[-1] = True
+            continue
+        assert not entry[-1], \
+                "Different line length in `{0}` of `{1}`".format(entry[0], filename)
+        if not entry[3]:
+            entry[3], entry[4] = bases, len(row)
+        elif bases != entry[3]:
+            # Only the last line is allowed to be shorter
+            assert bases < entry[3], \
+                "Different line length in `{0}` of `{1}`".format(entry[0], filename)
+            entry[-1] = True
+        entry[1] += bases
+
+    flush(entry)
+    fw.close()
+    logging.debug("Index of {0} records written to `{1}`.".\
+                    format(nrecords, faifile))
+
+
+class FastaIndex (object):
+    """
+    Random access to the sequences through the samtools .fai index, which is
+    (re)built if missing or older than the FASTA file. Only the requested
+    bytes are read, so no record is held in memory as a whole.
+    """
+    def __init__(self, filename):
+        from jcvi.apps.base import need_update
+
+        self.filename = filename
+        faifile = filename + ".fai"
+        if need_update(filename, faifile):
+            build_fai(filename, faifile)
+
+        self.entries = {}
+        for row in open(faifile):
+            atoms = row.split("\t")
+            self.entries[atoms[0]] = [int(x) for x in atoms[1:5]]
+        self.fp = open(filename, "rb")
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def size(self, name):
+        return self.entries[name][0]
+
+    def fetch(self, name, start, end):
+        """
+        Sequence of the 1-based, closed interval start..end as str.
+        """
+        assert name in self.entries, "`{0}` not in `{1}`".\
+                format(name, self.filename)
+        length, offset, linebases, linebytes = self.entries[name]
+        assert 1 <= start, "start ({0}) must > 0".format(start)
+        assert end <= length, "stop ({0}) must be <= length of `{1}` ({2})".\
+                format(end, name, length)
+        if start > end:
+            return ""
+
+        a = offset + (start - 1) / linebases * linebytes + \
+                     (start - 1) % linebases
+        b = offset + (end - 1) / linebases * linebytes + \
+                     (end - 1) % linebases + 1
+        self.fp.seek(a)
+        seq = self.fp.read(b - a)
+        if linebytes > linebases:
+            seq = seq.replace("\n", "").replace("\r", "")
+        return seq
+
+
+def _fai_spans(filename, names):
+    """
+    Byte spans (offset, nbytes) of the records in `names`, using the samtools
+    .fai index. Each record runs from its header line to the end of its last
+    sequence (or quality) line. Spans are returned in file order.
+    """
+    spans = []
+    fp = open(filename, "rb")
+    for row in open(filename + ".fai"):
+        atoms = row.split("\t")
+        name = atoms[0]
+        if name not in names:
+            continue
+
+        length, offset, linebases, linebytes = [int(x) for x in atoms[1:5]]
+        # The last block is the quality in FASTQ (6-column .fai)
+        lastoffset = int(atoms[5]) if len(atoms) > 5 else offset
+        nlines, rem = divmod(length, linebases) if linebases else (0, 0)
+        lastbytes = nlines * linebytes + \
+                    (rem + linebytes - linebases if rem else 0)
+
+        # Header line ends right before the sequence offset
+        lookback = max(offset - 65536, 0)
+        fp.seek(lookback)
+        block = fp.read(offset - lookback)
+        start = lookback + block.rfind("\n", 0, len(block) - 1) + 1
+        spans.append((start, lastoffset + lastbytes - start, names[name]))
+
+    fp.close()
+    spans.sort()
+    return spans
+
+
+def some_records(filename, names, fws, format="fasta", exclude=False,
+                 key=None, ratio=.01):
+    """
+    Copy the records whose ID is in `names` byte-for-byte from filename, where
+    `names` maps each ID to a bucket and `fws` maps each bucket to a handle.
+    Only headers are parsed. With `exclude`, records NOT in `names` are written
+    to fws[None].
+
+    When an up-to-date .fai index is found and the ID list is small compared to
+    the number of indexed records (< `ratio`), records are fetched by seeking.
+
+    Returns the number of records written.
+    """
+    from jcvi.apps.base import need_update
+
+    faifile = filename + ".fai"
+    if not exclude and key is None and op.exists(faifile) and \
+            not need_update(filename, faifile):
+        nrecords = sum(1 for x in open(faifile))
+        if len(names) < ratio * nrecords:
+            logging.debug("Fetch {0} of {1} records by seeking into `{2}`.".\
+                          format(len(names), nrecords, filename))
+            spans = _fai_spans(filename, names)
+            fp = open(filename, "rb")
+            for offset, nbytes, bucket in spans:
+                fp.seek(offset)
+                fws[bucket].write(fp.read(nbytes))
+            fp.close()
+            return len(spans)
+
+    nrecords = 0
+    for header, lines in iter_raw_records(must_open(filename), format=format):
+        name = header_name(header)
+        if key:
+            name = key(name)
+
+        if exclude:
+            if name in names:
+                continue
+            fw = fws[None]
+        else:
+            if name not in names:
+                continue
+            fw = fws[names[name]]
+
+        fw.write(header)
+        fw.writelines(lines)
+        nrecords += 1
+
+    return nrecords
+
+
 def some(args):
     """
     %prog some fastafile listfile outfastafile
 
-    generate a subset of fastafile, based on a list
+    Generate a subset of fastafile, based on a list. Records are copied as is
+    from fastafile, as well as from the .qual file if available.
+
+    With --buckets, the listfile has a second column naming the bucket for each
+    ID, and outfastafile is a folder that gets one `bucket.fasta` per bucket.
     """
+    from jcvi.apps.base import mkdir
+
     p = OptionParser(some.__doc__)
     p.add_option("--exclude", default=False, action="store_true",
             help="Output sequences not in the list file [default: %default]")
     p.add_option("--uniprot", default=False, action="store_true",
             help="Header is from uniprot [default: %default]")
+    p.add_option("--buckets", default=False, action="store_true",
+            help="Split into buckets in the second column [default: %default]")
 
     opts, args = p.parse_args(args)
 
@@ -960,35 +1659,30 @@ def some(args):
         sys.exit(p.print_help())
 
     fastafile, listfile, outfastafile = args
-    outfastahandle = must_open(outfastafile, "w")
+    assert not (opts.buckets and opts.exclude), \
+            "--buckets and --exclude cannot be on at the same time"
     qualfile = get_qual(fastafile)
+    names = read_ids(listfile, buckets=opts.buckets)
+    key = (lambda x: x.split("|")[-1]) if opts.uniprot else None
 
-    names = set(x.strip() for x in open(listfile))
-    if qualfile:
-        outqualfile = outfastafile + ".qual"
-        outqualhandle = open(outqualfile, "w")
-        parser = iter_fasta_qual(fastafile, qualfile)
+    if opts.buckets:
+        mkdir(outfastafile)
+        outfiles = dict((b, op.join(outfastafile, b + ".fasta")) \
+                        for b in set(names.values()))
     else:
-        parser = SeqIO.parse(fastafile, "fasta")
+        outfiles = {None: outfastafile}
 
-    num_records = 0
-    for rec in parser:
-        name = rec.id
-        if opts.uniprot:
-            name = name.split("|")[-1]
-
-        if opts.exclude:
-            if name in names:
-                continue
-        else:
-            if name not in names:
-                continue
-
-        SeqIO.write([rec], outfastahandle, "fasta")
-        if qualfile:
-            SeqIO.write([rec], outqualhandle, "qual")
+    fws = dict((b, must_open(f, "w")) for b, f in outfiles.items())
+    num_records = some_records(fastafile, names, fws, exclude=opts.exclude,
+                               key=key)
+    for fw in fws.values():
+        fw.close()
 
-        num_records += 1
+    if qualfile:
+        fws = dict((b, open(f + ".qual", "w")) for b, f in outfiles.items())
+        some_records(qualfile, names, fws, exclude=opts.exclude, key=key)
+        for fw in fws.values():
+            fw.close()
 
     logging.debug("A total of %d records written to `%s`" % \
             (num_records, outfastafile))
@@ -1046,15 +1740,16 @@ def pair(args):
     %prog pair fastafile
 
     Generate .pairs.fasta and .fragments.fasta by matching records
-    into the pairs and the rest go to fragments.
+    into the pairs and the rest go to fragments. The file is read once, and
+    records wait for their mates in a table that spills to disk.
     """
+    from jcvi.formats.base import iter_mates, iter_records, record_name, \
+            rename_record, mate_key, set_pair_options
+
     p = OptionParser(pair.__doc__)
-    p.add_option("-d", dest="separator", default=None,
-            help="separater in the name field to reduce to the same clone " +\
-                 "[e.g. GFNQ33242/1 use /, BOT01-2453H.b1 use .]" +\
-                 "[default: trim until last char]")
     p.add_option("-m", dest="matepairs", default=False, action="store_true",
             help="generate .matepairs file [often used for Celera Assembler]")
+    set_pair_options(p, rclip=1)
 
     opts, args = p.parse_args(args)
 
@@ -1070,7 +1765,6 @@ def pair(args):
     pairsfw = open(pairsfile, "w")
     fragsfw = open(fragsfile, "w")
 
-    #TODO: need a class to handle coupled fasta and qual iterating and indexing
     if opts.matepairs:
         matepairsfile = prefix + ".matepairs"
         matepairsfw = open(matepairsfile, "w")
@@ -1081,22 +1775,18 @@ def pair(args):
         fragsqualfile = fragsfile + ".qual"
         fragsqualhandle = open(fragsqualfile, "w")
 
-    f = Fasta(fastafile)
-    if qualfile:
-        q = SeqIO.index(qualfile, "qual")
-
-    all_keys = list(f.iterkeys())
-    all_keys.sort()
-    sep = opts.separator
+    # Records are (fasta, qual) texts, so that both are paired together
+    records = iter_records(fastafile, "fasta")
+    quals = iter_records(qualfile, "fasta") if qualfile else None
+    records = ((record_name(x), (x, q or "")) for x, q in \
+                    izip_longest(records, quals or []))
+    key_fun = mate_key(rclip=opts.rclip, separator=opts.separator)
 
-    if sep:
-        key_fun = lambda x: x.split(sep, 1)[0]
-    else:
-        key_fun = lambda x: x[:-1]
-
-    for key, variants in groupby(all_keys, key=key_fun):
-        variants = list(variants)
+    for a, b in iter_mates(records, key=key_fun, unsorted=True,
+                           maxsize=opts.maxsize):
+        variants = sorted(x for x in (a, b) if x)
         paired = (len(variants) == 2)
+        key = key_fun(record_name(variants[0][0]))
 
         if paired and opts.matepairs:
             print >> matepairsfw, "\t".join(("%s/1" % key, "%s/2" % key))
@@ -1105,19 +1795,11 @@ def pair(args):
         if qualfile:
             qualfw = pairsqualhandle if paired else fragsqualhandle
 
-        for i, var in enumerate(variants):
-            rec = f[var]
-            if qualfile:
-                recqual = q[var]
+        for i, (rec, recqual) in enumerate(variants):
             newid = "%s/%d" % (key, i + 1)
-
-            rec.id = newid
-            rec.description = ""
-            SeqIO.write([rec], fw, "fasta")
+            fw.write(rename_record(rec, newid))
             if qualfile:
-                recqual.id = newid
-                recqual.description = ""
-                SeqIO.write([recqual], qualfw, "qual")
+                qualfw.write(rename_record(recqual, newid))
 
     logging.debug("sequences written to `%s` and `%s`" % \
             (pairsfile, fragsfile))
@@ -1133,11 +1815,11 @@ def pairinplace(args):
     records. If they match, print to bulk.pairs.fasta, else print to
     bulk.frags.fasta.
     """
-    from jcvi.utils.iter import pairwise
+    from jcvi.formats.base import iter_mates, iter_named_records, mate_key, \
+            set_pair_options
 
     p = OptionParser(pairinplace.__doc__)
-    p.add_option("-r", dest="rclip", default=1, type="int",
-            help="pair ID is derived from rstrip N chars [default: %default]")
+    set_pair_options(p, rclip=1)
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
@@ -1155,28 +1837,17 @@ def pairinplace(args):
     fragsfw = must_open(frags, "w")
     pairsfw = must_open(pairs, "w")
 
-    N = opts.rclip
-    strip_name = lambda x: x[:-N] if N else str
-
-    skipflag = False  # controls the iterator skip
-    fastaiter = SeqIO.parse(fastafile, "fasta")
-    for a, b in pairwise(fastaiter):
-
-        aid, bid = [strip_name(x) for x in (a.id, b.id)]
-
-        if skipflag:
-            skipflag = False
-            continue
-
-        if aid == bid:
-            SeqIO.write([a, b], pairsfw, "fasta")
-            skipflag = True
+    key = mate_key(rclip=opts.rclip, separator=opts.separator)
+    records = iter_named_records(fastafile, "fasta")
+    for a, b in iter_mates(records, key=key, unsorted=opts.unsorted,
+                           maxsize=opts.maxsize):
+        if a and b:
+            pairsfw.write(a + b)
         else:
-            SeqIO.write([a], fragsfw, "fasta")
+            fragsfw.write(a or b)
 
-    # don't forget the last one, when b is None
-    if not skipflag:
-        SeqIO.write([a], fragsfw, "fasta")
+    fragsfw.close()
+    pairsfw.close()
 
     logging.debug("Reads paired into `%s` and `%s`" % (pairs, frags))
 
@@ -1187,16 +1858,37 @@ def extract(args):
 
     extract query out of fasta file, query needs to be in the form of
     "seqname", or "seqname:start-stop", or "seqname:start-stop:-"
+
+    With --ids, a file with a list of seqnames replaces the query, and the
+    records are copied as is in one pass (or by seeking, if fasta.fai is
+    present).
     """
     p = OptionParser(extract.__doc__)
     p.add_option('--include', default=False, action="store_true",
             help="search description line for match [default: %default]")
     p.add_option('--exclude', default=False, action="store_true",
             help="exclude description that matches [default: %default]")
+    p.add_option('--ids', help="file with a list of seqnames to extract, " +\
+                 "instead of the query [default: %default]")
     set_outfile(p)
 
     opts, args = p.parse_args(args)
 
+    if opts.ids:
+        if len(args) != 1:
+            sys.exit(p.print_help())
+
+        fastafile, = args
+        assert not (opts.include or opts.exclude), \
+                "--include and --exclude cannot be used with --ids"
+        names = read_ids(opts.ids)
+        fw = must_open(opts.outfile, "w")
+        nrecords = some_records(fastafile, names, {None: fw})
+        fw.close()
+        logging.debug("A total of {0} of {1} records extracted.".\
+                      format(nrecords, len(names)))
+        return
+
     if len(args) != 2:
         sys.exit(p.print_help())
 
@@ -1269,42 +1961,36 @@ def extract(args):
         SeqIO.write([rec], fw, "fasta")
 
 
-def _uniq_rec(fastafile):
-    """
-    Returns unique records
-    """
-    seen = set()
-    for rec in SeqIO.parse(fastafile, "fasta"):
-        name = rec.id
-        if name in seen:
-            logging.debug("ignore %s" % name)
-            continue
-        seen.add(name)
-        yield rec
-
-
 def uniq(args):
     """
     %prog uniq fasta uniq.fasta
 
-    remove fasta records that are the same
+    Remove fasta records that are the same, either by ID (default) or by
+    sequence. Only fixed-size digests are kept in memory, which spill to disk
+    after --maxsize records.
     """
     p = OptionParser(uniq.__doc__)
     p.add_option("-t", "--trimname", dest="trimname",
             action="store_true", default=False,
             help="turn on the defline trim to first space [default: %default]")
+    p.add_option("--seq", default=False, action="store_true",
+            help="collapse identical sequences instead of IDs [default: %default]")
+    p.add_option("--rc", default=False, action="store_true",
+            help="with --seq, also collapse reverse complements [default: %default]")
+    p.add_option("--clusters",
+            help="write duplicate clusters to file [default: %default]")
+    p.add_option("--maxsize", default=10000000, type="int",
+            help="digests kept in memory before spilling [default: %default]")
 
     opts, args = p.parse_args(args)
     if len(args) != 2:
         sys.exit(p.print_help())
 
     fastafile, uniqfastafile = args
-    fw = must_open(uniqfastafile, "w")
-
-    for rec in _uniq_rec(fastafile):
-        if opts.trimname:
-            rec.description = ""
-        SeqIO.write([rec], fw, "fasta")
+    mode = "seq" if opts.seq else "name"
+    write_uniq(fastafile, uniqfastafile, mode=mode, rc_canonical=opts.rc,
+               maxsize=opts.maxsize, trimname=opts.trimname,
+               clustersfile=opts.clusters)
 
 
 def random(args):
@@ -1339,6 +2025,11 @@ QUAL = 10  # default quality value
 OKQUAL = 15
 
 
+def set_qual(rec, qual=OKQUAL):
+    rec.letter_annotations['phred_quality'] = [qual] * len(rec)
+    return rec
+
+
 def modify_qual(rec):
     qv = rec.letter_annotations['phred_quality']
     for i, (s, q) in enumerate(zip(rec.seq, qv)):
@@ -1377,6 +2068,28 @@ def write_fasta_qual(rec, fastahandle, qualhandle):
         SeqIO.write([rec], qualhandle, "qual")
 
 
+def trim_record(rec, ctx, score=QUAL, min_length=64):
+    """
+    Trim to the subarray of quality values (offset by `score`) with the maximum
+    sum, and drop the trimmed records that are shorter than `min_length`.
+    """
+    from jcvi.algorithms.maxsum import max_sum
+
+    qv = [x - score for x in rec.letter_annotations["phred_quality"]]
+    msum, trim_start, trim_end = max_sum(qv)
+    size = trim_end - trim_start + 1
+
+    if size < min_length:
+        ctx.stats["dropped"] += 1
+        return None
+
+    if size < len(rec):
+        ctx.stats["trimmed"] += 1
+        rec = rec[trim_start:trim_end + 1]
+
+    return rec
+
+
 def trim(args):
     """
     %prog trim fasta.screen newfasta
@@ -1386,14 +2099,14 @@ def trim(args):
     trim if fasta.screen.qual is found. The trimming algorithm is based on
     finding the subarray that maximize the sum
     """
-
-    from jcvi.algorithms.maxsum import max_sum
+    from functools import partial
 
     p = OptionParser(trim.__doc__)
     p.add_option("-c", dest="min_length", type="int", default=64,
             help="minimum sequence length after trimming")
-    p.add_option("-s", dest="score", default=QUAL,
+    p.add_option("-s", dest="score", default=QUAL, type="int",
             help="quality trimming cutoff [default: %default]")
+    set_cpus(p)
     opts, args = p.parse_args(args)
 
     if len(args) != 2:
@@ -1406,33 +2119,21 @@ def trim(args):
     logging.debug("Trim bad sequence from fasta file `%s` to `%s`" % \
             (fastafile, newfastafile))
 
-    fw = must_open(newfastafile, "w")
-    fw_qual = open(newqualfile, "w")
-
-    dropped = trimmed = 0
-
-    for rec in iter_fasta_qual(fastafile, qualfile, modify=True):
-        qv = [x - opts.score for x in \
-                rec.letter_annotations["phred_quality"]]
-        msum, trim_start, trim_end = max_sum(qv)
-        score = trim_end - trim_start + 1
-
-        if score < opts.min_length:
-            dropped += 1
-            continue
-
-        if score < len(rec):
-            trimmed += 1
-            rec = rec[trim_start:trim_end + 1]
+    if qualfile:
+        infiles = [fastafile, qualfile]
+    else:
+        logging.warning("assume qual ({0})".format(OKQUAL))
+        infiles = [fastafile]
 
-        write_fasta_qual(rec, fw, fw_qual)
+    transform = partial(trim_record, score=opts.score,
+                        min_length=opts.min_length)
+    stats = process_records(infiles, [newfastafile, newqualfile], transform,
+                            reader=read_fasta_qual_texts,
+                            outformats=("fasta", "qual"), cpus=opts.cpus)
 
-    print >>sys.stderr, "A total of %d sequences modified." % trimmed
+    print >>sys.stderr, "A total of %d sequences modified." % stats["trimmed"]
     print >>sys.stderr, "A total of %d sequences dropped (length < %d)." % \
-        (dropped, opts.min_length)
-
-    fw.close()
-    fw_qual.close()
+        (stats["dropped"], opts.min_length)
 
 
 def sequin(args):
@@ -1515,6 +2216,50 @@ def sequin(args):
     return outputfasta, unknowns + knowns
 
 
+def tidy_record(rec, ctx, gapsize=100, minlen=100):
+    """
+    Normalize the gaps in one record to `gapsize`, and remove the components
+    shorter than `minlen`.
+    """
+    newseq = ""
+    dangle_gaps = 0
+    for gap, seq in groupby(rec.seq, lambda x: x.upper() == 'N'):
+        seq = "".join(seq)
+        seqlen = len(seq)
+        msg = None
+        if gap:
+            nsize = max(gapsize - dangle_gaps, 0)
+            if seqlen < 10:
+                if nsize > seqlen:
+                    nsize = seqlen
+                dangle_gaps += seqlen
+            else:
+                if seqlen != gapsize:
+                    msg = "Normalize gap size ({0}) to {1}" \
+                            .format(seqlen, nsize)
+                dangle_gaps = gapsize
+
+            newseq += nsize * 'N'
+        else:
+            if seqlen < minlen:
+                msg = "Discard component ({0})".format(seqlen)
+            else:
+                newseq += seq
+                # Discarding components might cause flank gaps to merge
+                # should be handled in dangle_gaps, which is only reset when
+                # seeing an actual sequence
+                dangle_gaps = 0
+
+        if msg:
+            msg = rec.id + ": " + msg
+            logging.info(msg)
+
+    newseq = newseq.strip('N')
+    rec.seq = Seq(newseq)
+
+    return rec
+
+
 def tidy(args):
     """
     %prog tidy fastafile
@@ -1522,11 +2267,14 @@ def tidy(args):
     Normalize gap sizes (default 100 N's) and remove small components (less than
     100 nucleotides).
     """
+    from functools import partial
+
     p = OptionParser(tidy.__doc__)
     p.add_option("--gapsize", dest="gapsize", default=100, type="int",
             help="Set all gaps to the same size [default: %default]")
     p.add_option("--minlen", dest="minlen", default=100, type="int",
             help="Minimum component size [default: %default]")
+    set_cpus(p)
 
     opts, args = p.parse_args(args)
 
@@ -1534,52 +2282,10 @@ def tidy(args):
         sys.exit(not p.print_help())
 
     fastafile, = args
-    gapsize = opts.gapsize
-    minlen = opts.minlen
     tidyfastafile = fastafile.rsplit(".", 1)[0] + ".tidy.fasta"
-    fw = must_open(tidyfastafile, "w")
-    normalized_gap = "N" * gapsize
-
-    for rec in SeqIO.parse(fastafile, "fasta"):
-        newseq = ""
-        dangle_gaps = 0
-        for gap, seq in groupby(rec.seq, lambda x: x.upper() == 'N'):
-            seq = "".join(seq)
-            seqlen = len(seq)
-            msg = None
-            if gap:
-                nsize = max(gapsize - dangle_gaps, 0)
-                if seqlen < 10:
-                    if nsize > seqlen:
-                        nsize = seqlen
-                    dangle_gaps += seqlen
-                else:
-                    if seqlen != gapsize:
-                        msg = "Normalize gap size ({0}) to {1}" \
-                                .format(seqlen, nsize)
-                    dangle_gaps = gapsize
-
-                newseq += nsize * 'N'
-            else:
-                if seqlen < minlen:
-                    msg = "Discard component ({0})".format(seqlen)
-                else:
-                    newseq += seq
-                    # Discarding components might cause flank gaps to merge
-                    # should be handled in dangle_gaps, which is only reset when
-                    # seeing an actual sequence
-                    dangle_gaps = 0
 
-            if msg:
-                msg = rec.id + ": " + msg
-                logging.info(msg)
-
-        newseq = newseq.strip('N')
-        ngaps = newseq.count(normalized_gap)
-
-        rec.seq = Seq(newseq)
-
-        SeqIO.write([rec], fw, "fasta")
+    transform = partial(tidy_record, gapsize=opts.gapsize, minlen=opts.minlen)
+    process_records(fastafile, tidyfastafile, transform, cpus=opts.cpus)
 
 
 def gaps(args):
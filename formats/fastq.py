@@ -11,12 +11,14 @@ import logging
 
 from collections import namedtuple
 from optparse import OptionParser
-from itertools import islice
+from itertools import izip
 
+import numpy as np
 from Bio.SeqIO.QualityIO import FastqGeneralIterator
 
 from jcvi.formats.fasta import must_open, rc
-from jcvi.apps.base import ActionDispatcher, debug, set_grid, sh, mkdir
+from jcvi.apps.base import ActionDispatcher, debug, set_outfile, mkdir, \
+        need_update
 debug()
 
 qual_offset = lambda x: 33 if x == "sanger" else 64
@@ -46,7 +48,7 @@ class FastqRecord (object):
         self.l3 = fh.readline().rstrip()
         self.qual = fh.readline().rstrip()
         if offset != 0:
-            self.qual = "".join(chr(ord(x) + offset) for x in self.qual)
+            self.qual = shift_qual(self.qual, offset)
         self.length = len(self.seq)
         assert self.length == len(self.qual), \
                 "length mismatch: seq(%s) and qual(%s)" % (self.seq, self.qual)
@@ -60,7 +62,7 @@ class FastqRecord (object):
 
     @property
     def quality(self):
-        return [ord(x) for x in self.qual]
+        return np.frombuffer(self.qual, dtype=np.uint8)
 
 
 def iter_fastq(filename, offset=0, key=None):
@@ -78,6 +80,322 @@ def iter_fastq(filename, offset=0, key=None):
     yield None  # sentinel
 
 
+def iter_fastq_lines(fp):
+    """
+    Yields (header, lines) with the three raw lines following the header,
+    newlines included, without decoding the record.
+    """
+    for a in izip(fp, fp, fp, fp):
+        yield a[0], a[1:]
+
+
+def shift_qual(qual, offset, lo=33, hi=126):
+    """
+    Add offset to every quality character, e.g. -31 for Phred+64 to Phred+33,
+    clipped to the printable range.
+    """
+    q = np.frombuffer(qual, dtype=np.uint8).astype(np.int16) + offset
+    return np.clip(q, lo, hi).astype(np.uint8).tostring()
+
+
+class FastqBlock (object):
+    """
+    A batch of FASTQ records kept as raw lines (without newlines), so that
+    quality checks run on the whole batch as NumPy arrays.
+    """
+    def __init__(self, names, seqs, plus, quals):
+        self.names = names
+        self.seqs = seqs
+        self.plus = plus
+        self.quals = quals
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        return FastqBlock(self.names[i], self.seqs[i], self.plus[i], self.quals[i])
+
+    @property
+    def lengths(self):
+        return np.array([len(x) for x in self.quals], dtype=np.int64)
+
+    @property
+    def ends(self):
+        return np.cumsum(self.lengths)
+
+    def quality(self, offset=0):
+        """
+        All qualities in the block as one uint8 array, use `ends` to split.
+        """
+        q = np.frombuffer("".join(self.quals), dtype=np.uint8)
+        return q - offset if offset else q
+
+    def highqv(self, qvchar, pct=90):
+        """
+        Boolean mask of the reads with at least pct% bases >= qvchar.
+        """
+        good = self.quality() >= ord(qvchar)
+        cs = np.concatenate(([0], np.cumsum(good)))
+        lengths = self.lengths
+        ends = np.cumsum(lengths)
+        highs = cs[ends] - cs[ends - lengths]
+        return highs >= lengths * pct / 100
+
+    def convert(self, offset):
+        """
+        Shift all qualities by offset in one vectorised operation.
+        """
+        if not offset or not self.quals:
+            return
+        q = shift_qual("".join(self.quals), offset)
+        ends = self.ends
+        starts = ends - self.lengths
+        self.quals = [q[a:b] for a, b in izip(starts, ends)]
+
+    def record(self, i):
+        return "\n".join((self.names[i], self.seqs[i], self.plus[i],
+                          self.quals[i])) + "\n"
+
+    def tostring(self, index=None):
+        if index is None:
+            index = xrange(len(self))
+        return "".join(self.record(i) for i in index)
+
+
+class FastqReader (object):
+    """
+    Low-level FASTQ reader, reads large buffered blocks and splits them into
+    lines in bulk. Records must be four lines each.
+    """
+    def __init__(self, filename, blocksize=1 << 22):
+        if isinstance(filename, basestring) and filename.endswith(".gz"):
+            import gzip
+            self.fp = gzip.open(filename)  # Block reads, so in-process is fast
+        elif isinstance(filename, basestring):
+            self.fp = must_open(filename)
+        else:
+            self.fp = filename
+        self.blocksize = blocksize
+        self.pending = []
+        self.rest = ""
+        self.eof = False
+
+    def __iter__(self):
+        return self.read_all()
+
+    def read_all(self, multiple=1):
+        while True:
+            block = self.read(multiple=multiple)
+            if block is None:
+                break
+            yield block
+
+    def _fill(self):
+        buf = self.fp.read(self.blocksize)
+        if not buf:
+            self.eof = True
+            pending = self.pending
+            if self.rest:
+                pending.append(self.rest)
+                self.rest = ""
+            while pending and not pending[-1].strip():
+                pending.pop()
+            assert len(pending) % 4 == 0, \
+                    "Truncated FASTQ record: {0}".format(pending[-4:])
+            return
+
+        lines = (self.rest + buf).split("\n")
+        self.rest = lines.pop()
+        self.pending.extend(lines)
+
+    def read(self, nrecords=None, multiple=1):
+        """
+        Return a FastqBlock of nrecords, or of all the whole records in the
+        next chunk (rounded down to a multiple, e.g. 2 for interleaved pairs).
+        Returns None at the end of file.
+        """
+        need = 4 * (nrecords or multiple)
+        while len(self.pending) < need and not self.eof:
+            self._fill()
+
+        pending = self.pending
+        if nrecords:
+            n = min(need, len(pending))
+        else:
+            n = len(pending) - len(pending) % (4 * multiple)
+            assert n == len(pending) or not self.eof, \
+                    "Records not in multiples of {0}".format(multiple)
+        if not n:
+            return None
+
+        lines = pending[:n]
+        del pending[:n]
+        return FastqBlock(lines[0::4], lines[1::4], lines[2::4], lines[3::4])
+
+
+def index_offsets(fastqfile, blocksize=1 << 24):
+    """
+    Byte offset of each record in an uncompressed fastqfile, followed by the
+    file size, so record i spans offsets[i]:offsets[i + 1]. The index is
+    cached as `fastqfile.offsets` and rebuilt when the fastqfile is newer.
+    """
+    offsetsfile = fastqfile + ".offsets"
+    if not need_update(fastqfile, offsetsfile):
+        return np.fromfile(offsetsfile, dtype=np.int64)
+
+    assert not fastqfile.endswith(".gz"), \
+            "Cannot index compressed file `{0}`".format(fastqfile)
+
+    fp = open(fastqfile, "rb")
+    starts = [np.zeros(1, dtype=np.int64)]
+    pos = nlines = 0
+    last = "\n"
+    while True:
+        buf = fp.read(blocksize)
+        if not buf:
+            break
+        ends = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == 10)
+        # A record starts after every fourth newline
+        first = (3 - nlines) % 4
+        starts.append(ends[first::4] + (pos + 1))
+        nlines += len(ends)
+        pos += len(buf)
+        last = buf[-1]
+    fp.close()
+
+    if last != "\n":
+        nlines += 1
+        starts.append(np.array([pos], dtype=np.int64))
+    assert nlines % 4 == 0, "Truncated FASTQ record in `{0}`".format(fastqfile)
+
+    offsets = np.concatenate(starts).astype(np.int64)
+    offsets.tofile(offsetsfile)
+    logging.debug("Offsets of {0} reads written to `{1}`.".\
+                  format(len(offsets) - 1, offsetsfile))
+    return offsets
+
+
+BASECODES = np.array([4] * 256, dtype=np.int64)
+for i, b in enumerate("ACGT"):
+    BASECODES[ord(b)] = BASECODES[ord(b.lower())] = i
+
+
+class ReadProfile (object):
+    """
+    Read-set QC summaries collected in one pass over FastqBlocks. Quality
+    counts are kept per cycle for every raw quality char, which is a fixed
+    memory sketch of the quality distributions; quantiles and the quality
+    offset are derived from it at the end. Distinct reads are estimated with
+    HyperLogLog.
+    """
+    quantiles = (10, 25, 50, 75, 90)
+
+    def __init__(self, hllbits=14):
+        from jcvi.utils.cbook import HyperLogLog
+
+        self.nreads = self.nbases = 0
+        self.lengths = np.zeros(1, dtype=np.int64)
+        self.quals = np.zeros((0, 128), dtype=np.int64)
+        self.bases = np.zeros((0, 5), dtype=np.int64)
+        self.hll = HyperLogLog(hllbits)
+
+    @property
+    def ncycles(self):
+        return len(self.quals)
+
+    def _grow(self, maxlen):
+        extra = maxlen - self.ncycles
+        if extra <= 0:
+            return
+        self.lengths = np.concatenate((self.lengths,
+                                       np.zeros(extra, dtype=np.int64)))
+        self.quals = np.vstack((self.quals,
+                                np.zeros((extra, 128), dtype=np.int64)))
+        self.bases = np.vstack((self.bases,
+                                np.zeros((extra, 5), dtype=np.int64)))
+
+    def update(self, block):
+        if not len(block):
+            return
+
+        lengths = block.lengths
+        self._grow(lengths.max())
+        n = self.ncycles
+        self.lengths += np.bincount(lengths, minlength=n + 1)
+
+        # Cycle of every base in the block
+        ends = np.cumsum(lengths)
+        cycles = np.arange(ends[-1]) - np.repeat(ends - lengths, lengths)
+        q = block.quality() & 127
+        self.quals += np.bincount(cycles * 128 + q, minlength=n * 128).\
+                        reshape(n, 128)
+        seq = np.frombuffer("".join(block.seqs), dtype=np.uint8)
+        self.bases += np.bincount(cycles * 5 + BASECODES[seq],
+                                  minlength=n * 5).reshape(n, 5)
+
+        self.hll.add(block.seqs)
+        self.nreads += len(block)
+        self.nbases += ends[-1]
+
+    @property
+    def offset(self):
+        chars = np.flatnonzero(self.quals.sum(axis=0))
+        if not len(chars) or chars[0] < 59:
+            return 33
+        return 64 if chars[-1] > 74 else 33
+
+    @property
+    def distinct(self):
+        return min(len(self.hll), self.nreads)
+
+    def quality_quantiles(self):
+        """
+        Per-cycle mean and quantiles, decoded with the quality offset.
+        """
+        counts = self.quals
+        totals = np.maximum(counts.sum(axis=1), 1)
+        chars = np.arange(128)
+        means = (counts * chars).sum(axis=1) * 1. / totals - self.offset
+        cum = np.cumsum(counts, axis=1)
+        qs = [np.argmax(cum * 100 >= totals[:, None] * x, axis=1) - self.offset \
+                for x in self.quantiles]
+        return means, np.column_stack(qs)
+
+    def write(self, fw):
+        from jcvi.utils.cbook import percentage
+
+        print >> fw, "# Reads: {0}".format(self.nreads)
+        print >> fw, "# Bases: {0}".format(self.nbases)
+        print >> fw, "# Quality offset: {0}".format(self.offset)
+        if self.nreads:
+            dups = self.nreads - self.distinct
+            print >> fw, "# Duplicate reads (estimated): {0}".\
+                            format(percentage(dups, self.nreads))
+
+        print >> fw, "\t".join(("#Length", "Count"))
+        for length in np.flatnonzero(self.lengths):
+            print >> fw, "{0}\t{1}".format(length, self.lengths[length])
+
+        means, qs = self.quality_quantiles()
+        header = ["#Cycle", "Mean"] + ["P{0}".format(x) for x in self.quantiles]
+        header += list("ACGTN")
+        print >> fw, "\t".join(header)
+        for i in xrange(self.ncycles):
+            total = max(self.bases[i].sum(), 1)
+            comp = ["{0:.1f}".format(x * 100. / total) for x in self.bases[i]]
+            row = [str(i + 1), "{0:.1f}".format(means[i])] + \
+                  [str(x) for x in qs[i]] + comp
+            print >> fw, "\t".join(row)
+
+    def plot(self):
+        from jcvi.graphics.histogram import counthistogram
+
+        counthistogram(self.lengths, title="Read lengths")
+        offset = self.offset
+        quals = self.quals.sum(axis=0)[offset:]
+        counthistogram(quals, vmin=0, title="Base qualities")
+
+
 def main():
 
     actions = (
@@ -90,15 +408,38 @@ def main():
         ('pairinplace', 'collect pairs by checking adjacent ids'),
         ('convert', 'convert between illumina and sanger offset'),
         ('filter', 'filter to get high qv reads'),
-        ('trim', 'trim reads using fastx_trimmer'),
+        ('trim', 'trim reads from begin or end'),
         ('some', 'select a subset of fastq reads'),
         ('deconvolute', 'split fastqfile into subsets'),
         ('guessoffset', 'guess the quality offset of the fastq records'),
+        ('profile', 'one-pass QC summary of the reads'),
+        ('sample', 'subsample reads or pairs by fraction or count'),
             )
     p = ActionDispatcher(actions)
     p.dispatch(globals())
 
 
+def iter_fastq_pairs(read1, read2, blocksize=1 << 22):
+    """
+    Yield pairs of aligned FastqBlocks, from two files or from one interleaved
+    file (when read1 == read2).
+    """
+    if read1 == read2:
+        for block in FastqReader(read1, blocksize=blocksize).read_all(multiple=2):
+            yield block[0::2], block[1::2]
+        return
+
+    ra = FastqReader(read1, blocksize=blocksize)
+    rb = FastqReader(read2, blocksize=blocksize)
+    for a in ra:
+        b = rb.read(len(a))
+        assert b is not None and len(b) == len(a), \
+                "`{0}` has fewer records than `{1}`".format(read2, read1)
+        yield a, b
+    assert rb.read() is None, \
+                "`{0}` has more records than `{1}`".format(read2, read1)
+
+
 def FastqPairedIterator(read1, read2):
     if read1 == read2:
         p1fp = p2fp = must_open(read1)
@@ -111,16 +452,193 @@ def FastqPairedIterator(read1, read2):
 
 def isHighQv(qs, qvchar, pct=90):
     cutoff = len(qs) * pct / 100
-    highs = sum(1 for x in qs if x >= qvchar)
+    highs = (np.frombuffer(qs, dtype=np.uint8) >= ord(qvchar)).sum()
     return highs >= cutoff
 
 
+def adapter_start(seq, adapter, minoverlap=8):
+    """
+    Position where the adapter, or a 3' partial adapter of at least minoverlap
+    bases, starts in seq. Returns len(seq) if not found.
+    """
+    seed = adapter[:minoverlap]
+    i = seq.find(seed)
+    while i != -1:
+        if adapter.startswith(seq[i:i + len(adapter)]):
+            return i
+        i = seq.find(seed, i + 1)
+    return len(seq)
+
+
+class ReadFilter (object):
+    """
+    Trim and filter the reads in a FastqBlock. Trimming cuts a fixed range
+    (first/last) and then the adapter; filters are checked in the order of
+    `reasons` and a read is counted against the first filter it fails.
+    """
+    reasons = ("length", "N", "quality")
+
+    def __init__(self, first=0, last=0, adapter=None, minoverlap=8,
+                 minlength=0, maxN=None, qvchar=None, pct=90):
+        self.first = first
+        self.last = last
+        self.adapter = adapter.upper() if adapter else None
+        self.minoverlap = minoverlap
+        self.minlength = minlength
+        self.maxN = maxN
+        self.qvchar = qvchar
+        self.pct = pct
+
+    def trim(self, block):
+        if self.first or self.last:
+            start = max(self.first - 1, 0)
+            end = self.last or None
+            block.seqs = [x[start:end] for x in block.seqs]
+            block.quals = [x[start:end] for x in block.quals]
+        if self.adapter:
+            adapter, minoverlap = self.adapter, self.minoverlap
+            ends = [adapter_start(x.upper(), adapter, minoverlap) \
+                    for x in block.seqs]
+            block.seqs = [x[:i] for x, i in izip(block.seqs, ends)]
+            block.quals = [x[:i] for x, i in izip(block.quals, ends)]
+
+    def classify(self, block):
+        """
+        Return the index into `reasons` of the failed filter, -1 for pass.
+        """
+        fail = -np.ones(len(block), dtype=np.int8)
+        # Assign in reverse order so that the first failed filter sticks
+        if self.qvchar:
+            fail[~block.highqv(self.qvchar, pct=self.pct)] = 2
+        if self.maxN is not None:
+            ns = np.array([x.upper().count("N") for x in block.seqs])
+            fail[ns > self.maxN] = 1
+        if self.minlength:
+            fail[block.lengths < self.minlength] = 0
+        return fail
+
+    def __call__(self, block, tag, stats):
+        self.trim(block)
+        fail = self.classify(block)
+        for i, reason in enumerate(self.reasons):
+            stats["{0} {1}".format(tag, reason)] += (fail == i).sum()
+        return fail < 0
+
+
+_readfilter = {}
+
+
+def _filter_chunk(task):
+    """
+    Filter one chunk of reads (or pairs), returns the texts for each output in
+    the layout and the counts.
+    """
+    from collections import Counter
+
+    a, b = task
+    rf, layout = _readfilter["filter"], _readfilter["layout"]
+    stats = Counter()
+    if b is None:
+        ka = rf(a, "R1", stats)
+        keep = np.flatnonzero(ka)
+        stats["reads"] += len(a)
+        stats["kept"] += len(keep)
+        return [a.tostring(keep)], stats
+
+    ka, kb = rf(a, "R1", stats), rf(b, "R2", stats)
+    both = np.flatnonzero(ka & kb)
+    orphans = "".join(a.record(i) if ka[i] else b.record(i) \
+                      for i in np.flatnonzero(ka ^ kb))
+    stats["pairs"] += len(a)
+    stats["kept"] += len(both)
+    stats["orphans"] += (ka ^ kb).sum()
+    if layout == "interleaved":
+        pairs = "".join(a.record(i) + b.record(i) for i in both)
+        return [pairs, orphans], stats
+    return [a.tostring(both), b.tostring(both), orphans], stats
+
+
+def filter_reads(r1, r2, outfiles, readfilter, layout="interleaved", cpus=1,
+                 blocksize=1 << 22):
+    """
+    Run the readfilter over single reads (r2 is None) or over pairs in
+    lockstep chunks on `cpus` workers. Outputs are written in the input order:
+    [reads] for single reads, [pairs, orphans] for interleaved output and
+    [r1, r2, orphans] for split output. Returns the counts.
+    """
+    from collections import Counter
+    from jcvi.formats.base import imap_ordered
+
+    _readfilter.update(filter=readfilter, layout=layout)
+    if r2 is None:
+        chunks = ((x, None) for x in FastqReader(r1, blocksize=blocksize))
+    else:
+        chunks = iter_fastq_pairs(r1, r2, blocksize=blocksize)
+
+    fws = [must_open(x, "w") for x in outfiles]
+    stats = Counter()
+
+    def flush(result):
+        texts, chunkstats = result
+        for fw, text in zip(fws, texts):
+            fw.write(text)
+        stats.update(chunkstats)
+
+    for result in imap_ordered(_filter_chunk, chunks, cpus=cpus):
+        flush(result)
+
+    for fw in fws:
+        fw.close()
+
+    unit = "reads" if r2 is None else "pairs"
+    logging.debug("A total of {0} of {1} {2} written to `{3}`.".\
+                  format(stats["kept"], stats[unit], unit, outfiles[0]))
+    if r2 is not None:
+        logging.debug("A total of {0} orphans written to `{1}`.".\
+                      format(stats["orphans"], outfiles[-1]))
+    for tag in ("R1", "R2"):
+        for reason in readfilter.reasons:
+            key = "{0} {1}".format(tag, reason)
+            if stats[key]:
+                logging.debug("{0} reads rejected by {1}.".\
+                              format(stats[key], key))
+    return stats
+
+
+def fastq_base(filename):
+    """
+    Strip directory, .gz and the file extension.
+    """
+    base = op.basename(filename)
+    if base.endswith(".gz"):
+        base = base[:-3]
+    return base.rsplit(".", 1)[0]
+
+
+def set_filter_options(p):
+    from jcvi.apps.base import set_cpus
+
+    p.add_option("-m", dest="minlength", default=0, type="int",
+                 help="Discard reads shorter than [default: %default]")
+    p.add_option("--maxN", default=None, type="int",
+                 help="Discard reads with more Ns than [default: %default]")
+    p.add_option("--adapter",
+                 help="Trim adapter sequence and the rest [default: %default]")
+    p.add_option("--minoverlap", default=8, type="int",
+                 help="Min adapter overlap at the 3'-end [default: %default]")
+    p.add_option("--gzip", default=False, action="store_true",
+                 help="Write gzipped outputs [default: %default]")
+    set_cpus(p)
+
+
 def filter(args):
     """
     %prog filter paired.fastq
 
     Filter to get high qv reads. Use interleaved format (one file) or paired
-    format (two files) to filter on paired reads.
+    format (two files) to filter on paired reads. Pairs where both mates pass
+    are written interleaved to `.paired.fastq`, single passing mates to
+    `.orphans.fastq`.
     """
     p = OptionParser(filter.__doc__)
     p.add_option("-q", dest="qv", default=20, type="int",
@@ -128,6 +646,7 @@ def filter(args):
     p.add_option("-p", dest="pct", default=95, type="int",
                  help="Minimum percent of bases that have [-q] quality "\
                  "[default: %default]")
+    set_filter_options(p)
 
     opts, args = p.parse_args(args)
 
@@ -140,53 +659,77 @@ def filter(args):
         r1, r2 = args
 
     qv = opts.qv
-    pct = opts.pct
 
     offset = guessoffset([r1])
     qvchar = chr(offset + qv)
     logging.debug("Call base qv >= {0} as good.".format(qvchar))
-    outfile = r1.rsplit(".", 1)[0] + ".q{0}.paired.fastq".format(qv)
-    fw = open(outfile, "w")
-
-    p1fp, p2fp = FastqPairedIterator(r1, r2)
-    while True:
-        a = list(islice(p1fp, 4))
-        if not a:
-            break
+    gz = ".gz" if opts.gzip else ""
+    prefix = r1.rsplit(".gz", 1)[0].rsplit(".", 1)[0] + ".q{0}".format(qv)
+    outfiles = [prefix + ".paired.fastq" + gz, prefix + ".orphans.fastq" + gz]
 
-        b = list(islice(p2fp, 4))
-        q1 = a[-1].rstrip()
-        q2 = b[-1].rstrip()
+    rf = ReadFilter(adapter=opts.adapter, minoverlap=opts.minoverlap,
+                    minlength=opts.minlength, maxN=opts.maxN,
+                    qvchar=qvchar, pct=opts.pct)
+    filter_reads(r1, r2, outfiles, rf, cpus=opts.cpus)
 
-        if isHighQv(q1, qvchar, pct=pct) and isHighQv(q2, qvchar, pct=pct):
-            fw.writelines(a)
-            fw.writelines(b)
+    return outfiles
 
 
 BarcodeLine = namedtuple("BarcodeLine", ["id", "seq"])
 
 
-def split_barcode(t):
+def mismatch_variants(seq, mismatch=0, alphabet="ACGTN"):
+    """
+    All sequences within `mismatch` substitutions of seq, including itself.
+    """
+    variants = set([seq])
+    for i in xrange(mismatch):
+        extra = set()
+        for v in variants:
+            for j, b in enumerate(v):
+                for c in alphabet:
+                    if c != b:
+                        extra.add(v[:j] + c + v[j + 1:])
+        variants |= extra
+    return variants
+
+
+class BarcodeMatcher (object):
+    """
+    Hash every allowed mismatch variant of the barcodes, one table per barcode
+    length. Reads are looked up against the longest barcodes first, so a read is
+    assigned to at most one barcode. Variants that are shared by several
+    barcodes are ambiguous and dropped.
+    """
+    def __init__(self, barcodes, mismatch=0):
+        tables = {}
+        ambiguous = set()
+        for bc in barcodes:
+            table = tables.setdefault(len(bc.seq), {})
+            for v in mismatch_variants(bc.seq, mismatch):
+                if v in table and table[v] != bc:
+                    ambiguous.add(v)
+                table[v] = bc
+        # Exact barcode always wins over a mismatch variant
+        for bc in barcodes:
+            tables[len(bc.seq)][bc.seq] = bc
+            ambiguous.discard(bc.seq)
 
-    barcode, excludebarcode, site, outdir, inputfile = t
-    trim = len(barcode.seq)
+        for table in tables.values():
+            for v in ambiguous:
+                table.pop(v, None)
+        if ambiguous:
+            logging.debug("A total of {0} ambiguous variants dropped.".\
+                          format(len(ambiguous)))
 
-    fp = must_open(inputfile)
-    outfastq = op.join(outdir, barcode.id + ".fastq")
-    fw = open(outfastq, "w")
-    for title, seq, qual in FastqGeneralIterator(fp):
-        if seq[:trim] != barcode.seq:
-            continue
-        hasexclude = any(seq.startswith(x.seq) for x in excludebarcode)
-        if hasexclude:
-            continue
-        seq = seq[trim:]
-        hassite = any(seq.startswith(x) for x in site)
-        if not hassite:
-            continue
-        print >> fw, "@{0}\n{1}\n+\n{2}".format(title, seq, qual[trim:])
+        self.tables = sorted(tables.items(), reverse=True)
 
-    fw.close()
+    def match(self, seq):
+        for size, table in self.tables:
+            bc = table.get(seq[:size])
+            if bc:
+                return bc
+        return None
 
 
 def deconvolute(args):
@@ -198,18 +741,21 @@ def deconvolute(args):
     ID01	AGTCCAG
 
     Input fastqfiles can be several files. Output files are ID01.fastq,
-    ID02.fastq, one file per line in barcodefile.
+    ID02.fastq, one file per line in barcodefile. Each input is read once, and
+    every read goes to the longest barcode it matches.
     """
-    from multiprocessing import Pool, cpu_count
+    from jcvi.formats.base import HandlePool
 
     p = OptionParser(deconvolute.__doc__)
-    p.add_option("--cpus", default=32, type="int",
-                 help="Number of processes to run [default: %default]")
     p.add_option("--outdir", default="deconv",
                  help="Output directory [default: %default]")
     p.add_option("--checkprefix", default=False, action="store_true",
                  help="Check shared prefix [default: %default]")
     p.add_option("--site", help="Keep reads start with RE site [default: %default]")
+    p.add_option("--mismatch", default=0, type="int",
+                 help="Mismatches allowed in the barcode [default: %default]")
+    p.add_option("--maxopen", default=256, type="int",
+                 help="Maximum number of open output files [default: %default]")
     opts, args = p.parse_args(args)
 
     if len(args) < 2:
@@ -218,14 +764,12 @@ def deconvolute(args):
     barcodefile = args[0]
     fastqfile = args[1:]
     fp = open(barcodefile)
-    barcodes = [BarcodeLine._make(x.split()) for x in fp]
-    nbc = len(barcodes)
+    barcodes = [BarcodeLine._make(x.split()) for x in fp if x.strip()]
+    fp.close()
 
     if opts.checkprefix:
         # Sanity check of shared prefix
-        excludebarcodes = []
         for bc in barcodes:
-            exclude = []
             for s in barcodes:
                 if bc.id == s.id:
                     continue
@@ -233,25 +777,112 @@ def deconvolute(args):
                 assert bc.seq != s.seq
                 if s.seq.startswith(bc.seq) and len(s.seq) > len(bc.seq):
                     logging.error("{0} shares same prefix as {1}.".format(s, bc))
-                    exclude.append(s)
-            excludebarcodes.append(exclude)
-    else:
-        excludebarcodes = nbc * [[]]
 
     outdir = opts.outdir
     site = opts.site
     if site:
-        site = site.split(",")
+        site = tuple(site.split(","))
         logging.debug("Check against sites {0}".format(site))
 
     mkdir(outdir)
 
-    cpus = min(opts.cpus, cpu_count())
-    logging.debug("Create a pool of {0} workers.".format(cpus))
-    pool = Pool(cpus)
-    pool.map(split_barcode, \
-             zip(barcodes, excludebarcodes, nbc * [site],
-             nbc * [outdir], nbc * [fastqfile]))
+    matcher = BarcodeMatcher(barcodes, mismatch=opts.mismatch)
+    outfiles = dict((bc.id, op.join(outdir, bc.id + ".fastq")) \
+                    for bc in barcodes)
+    counts = dict((bc.id, 0) for bc in barcodes)
+    pool = HandlePool(maxopen=opts.maxopen)
+    nreads = 0
+    for inputfile in fastqfile:
+        fp = must_open(inputfile)
+        for title, seq, qual in FastqGeneralIterator(fp):
+            nreads += 1
+            bc = matcher.match(seq)
+            if bc is None:
+                continue
+            trim = len(bc.seq)
+            seq = seq[trim:]
+            if site and not seq.startswith(site):
+                continue
+            pool.write(outfiles[bc.id], "@{0}\n{1}\n+\n{2}\n".\
+                       format(title, seq, qual[trim:]))
+            counts[bc.id] += 1
+        fp.close()
+
+    # Barcodes without any reads still get an (empty) output file
+    for bc in barcodes:
+        if not counts[bc.id]:
+            pool.write(outfiles[bc.id], "")
+            pool.flush(outfiles[bc.id])
+    pool.close()
+
+    assigned = sum(counts.values())
+    for bc in barcodes:
+        logging.debug("{0}: {1} reads written to `{2}`.".\
+                      format(bc.id, counts[bc.id], outfiles[bc.id]))
+    logging.debug("A total of {0} of {1} reads assigned to {2} barcodes.".\
+                  format(assigned, nreads, len(barcodes)))
+
+
+def convert_record(text, offset):
+    """
+    Shift the qualities of a raw FASTQ record by offset.
+    """
+    lines = text.split("\n")
+    lines[3] = shift_qual(lines[3], offset)
+    return "\n".join(lines)
+
+
+def write_mates(opts, a, b, pairsfw, frags, tag=False, offset=0):
+    """
+    Pair up reads with `iter_mates()`, using the pair options in opts. Inputs
+    are FASTQ files or (name, text) iterables, b is None for one interleaved
+    input. Pairs go to pairsfw, interleaved, or to (fw1, fw2). Reads without
+    mates go to frags, a file that is only created if needed, or a handle
+    that is left open.
+
+    Returns the number of reads in pairs and the number of frags.
+    """
+    from jcvi.formats.base import iter_mates, iter_named_records, mate_key, \
+            rename_record
+
+    if isinstance(a, basestring):
+        a = iter_named_records(a)
+    if isinstance(b, basestring):
+        b = iter_named_records(b)
+    key = mate_key(rclip=opts.rclip, separator=opts.separator)
+    fw1, fw2 = pairsfw if isinstance(pairsfw, tuple) else (pairsfw, pairsfw)
+
+    fragsfw = None if isinstance(frags, basestring) else frags
+    nreads = nfrags = 0
+    for ra, rb in iter_mates(a, b, key=key, unsorted=opts.unsorted,
+                             maxsize=opts.maxsize):
+        if ra is None or rb is None:
+            if fragsfw is None:
+                fragsfw = must_open(frags, "w")
+            r = ra or rb
+            fragsfw.write(convert_record(r, offset) if offset else r)
+            nfrags += 1
+            continue
+
+        if tag:
+            name = ra[1:ra.find("\n")].rstrip()
+            if fw1 is fw2:  # Interleaved, both named after the first mate
+                ra, rb = rename_record(ra, name + "/1"), \
+                         rename_record(rb, name + "/2")
+            else:
+                ra = rename_record(ra, name.split()[0] + "/1")
+                rb = rename_record(rb, rb[1:rb.find("\n")].split()[0] + "/2")
+        if offset:
+            ra, rb = convert_record(ra, offset), convert_record(rb, offset)
+        fw1.write(ra)
+        fw2.write(rb)
+        nreads += 2
+
+    if fragsfw and fragsfw is not frags:
+        fragsfw.close()
+        logging.debug("A total of {0} reads without mates written to `{1}`.".\
+                      format(nfrags, frags))
+    return nreads, nfrags
 
 
 def checkShuffleSizes(p1, p2, pairsfastq, extra=0):
@@ -269,13 +900,15 @@ def shuffle(args):
     """
     %prog shuffle p1.fastq p2.fastq pairs.fastq
 
-    Shuffle pairs into interleaved format, using `shuffleSequences_fastq.pl`.
+    Shuffle pairs into interleaved format. Mates are matched by names in
+    lockstep; reads without mates go to `pairs.frags.fastq`.
     """
-    from itertools import izip
+    from jcvi.formats.base import set_pair_options
 
     p = OptionParser(shuffle.__doc__)
     p.add_option("--tag", dest="tag", default=False, action="store_true",
             help="add tag (/1, /2) to the read name")
+    set_pair_options(p)
     opts, args = p.parse_args(args)
 
     if len(args) != 3:
@@ -284,46 +917,26 @@ def shuffle(args):
     p1, p2, pairsfastq = args
     tag = opts.tag
 
-    p1fp = must_open(p1)
-    p2fp = must_open(p2)
     pairsfw = must_open(pairsfastq, "w")
-    nreads = 0
-    while True:
-        a = list(islice(p1fp, 4))
-        if not a:
-            break
-
-        b = list(islice(p2fp, 4))
-        if tag:
-            name = a[0].rstrip()
-            a[0] = name + "/1\n"
-            b[0] = name + "/2\n"
-
-        pairsfw.writelines(a)
-        pairsfw.writelines(b)
-        nreads += 2
-
+    frags = fastq_base(pairsfastq) + ".frags.fastq"
+    nreads, nfrags = write_mates(opts, p1, p2, pairsfw, frags, tag=tag)
     pairsfw.close()
-    extra = nreads * 2 if tag else 0
-    checkShuffleSizes(p1, p2, pairsfastq, extra=extra)
 
-    logging.debug("File sizes verified after writing {0} reads.".format(nreads))
+    if not nfrags and not pairsfastq.endswith(".gz"):
+        extra = nreads * 2 if tag else 0
+        checkShuffleSizes(p1, p2, pairsfastq, extra=extra)
+        logging.debug("File sizes verified after writing {0} reads.".\
+                      format(nreads))
 
 
 def split(args):
     """
     %prog split pairs.fastq
 
-    Split shuffled pairs into `.1.fastq` and `.2.fastq`, using `sed`. Can work
-    on gzipped file.
-
-    <http://seqanswers.com/forums/showthread.php?t=13776>
+    Split shuffled pairs into `.1.fastq` and `.2.fastq`. Can work on gzipped
+    file.
     """
-    from jcvi.apps.grid import Jobs
-
     p = OptionParser(split.__doc__)
-    set_grid(p)
-
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
@@ -334,31 +947,27 @@ def split(args):
     pf = pairsfastq.replace(".gz", "").rsplit(".", 1)[0]
     p1 = pf + ".1.fastq"
     p2 = pf + ".2.fastq"
-
-    cmd = "zcat" if gz else "cat"
-    p1cmd = cmd + " {0} | sed -ne '1~8{{N;N;N;p}}'".format(pairsfastq)
-    p2cmd = cmd + " {0} | sed -ne '5~8{{N;N;N;p}}'".format(pairsfastq)
-
     if gz:
-        p1cmd += " | gzip"
-        p2cmd += " | gzip"
         p1 += ".gz"
         p2 += ".gz"
 
-    p1cmd += " > " + p1
-    p2cmd += " > " + p2
-
-    if opts.grid:
-        sh(p1cmd, grid=True)
-        sh(p2cmd, grid=True)
-
-    else:
-        args = [(p1cmd, ), (p2cmd, )]
-        m = Jobs(target=sh, args=args)
-        m.run()
+    fw1 = must_open(p1, "w")
+    fw2 = must_open(p2, "w")
+    npairs = 0
+    for a, b in iter_fastq_pairs(pairsfastq, pairsfastq):
+        fw1.write(a.tostring())
+        fw2.write(b.tostring())
+        npairs += len(a)
+    fw1.close()
+    fw2.close()
 
+    logging.debug("A total of {0} pairs written to `{1}` and `{2}`.".\
+                  format(npairs, p1, p2))
+    if not gz:
         checkShuffleSizes(p1, p2, pairsfastq)
 
+    return p1, p2
+
 
 def guessoffset(args):
     """
@@ -390,20 +999,19 @@ def guessoffset(args):
         sys.exit(not p.print_help())
 
     fastqfile, = args
-    ai = iter_fastq(fastqfile)
-    rec = ai.next()
     offset = 64
-    while rec:
-        quality = rec.quality
-        lowcounts = len([x for x in quality if x < 59])
-        highcounts = len([x for x in quality if x > 74])
-        diff = highcounts - lowcounts
-        if diff > 10:
+    for block in FastqReader(fastqfile, blocksize=1 << 16):
+        quality = block.quality()
+        low = np.concatenate(([0], np.cumsum(quality < 59)))
+        high = np.concatenate(([0], np.cumsum(quality > 74)))
+        ends = block.ends
+        diff = (high[ends] - high[ends - block.lengths]) - \
+               (low[ends] - low[ends - block.lengths])
+        decided = np.flatnonzero(abs(diff) > 10)
+        if len(decided):
+            if diff[decided[0]] < 0:
+                offset = 33
             break
-        elif diff < -10:
-            offset = 33
-            break
-        rec = ai.next()
 
     if offset == 33:
         print >> sys.stderr, "Sanger encoding (offset=33)"
@@ -415,67 +1023,99 @@ def guessoffset(args):
 
 def some(args):
     """
-    %prog some idsfile afastq bfastq
+    %prog some idsfile afastq [bfastq]
 
-    Select a subset of the reads with ids present in the idsfile.
+    Select a subset of the reads with ids present in the idsfile. If bfastq is
+    given, the mates are selected along with the reads in afastq and written
+    interleaved. Records are copied as is, only the headers are parsed.
     """
+    from jcvi.formats.fasta import read_ids, some_records, header_name
+
     p = OptionParser(some.__doc__)
+    set_outfile(p)
     opts, args = p.parse_args(args)
 
-    if len(args) != 3:
+    if len(args) not in (2, 3):
         sys.exit(not p.print_help())
 
-    idsfile, afastq, bfastq = args
-    fp = open(idsfile)
+    idsfile, afastq = args[:2]
+    names = read_ids(idsfile)
+    fw = must_open(opts.outfile, "w")
 
-    ai = iter_fastq(open(afastq))
-    arec = ai.next()
-    bi = iter_fastq(open(bfastq))
-    brec = bi.next()
+    if len(args) == 2:
+        some_records(afastq, names, {None: fw}, format="fastq")
+        return
 
-    for row in fp:
-        name = row.strip()
-        while arec:
-            if arec.name[1:] == name:
-                print arec
-                print brec
-                break
-            else:
-                arec = ai.next()
-                brec = bi.next()
+    bfastq = args[2]
+    ai = iter_fastq_lines(must_open(afastq))
+    bi = iter_fastq_lines(must_open(bfastq))
+    for (aheader, alines), (bheader, blines) in izip(ai, bi):
+        if header_name(aheader) not in names:
+            continue
+        fw.write(aheader)
+        fw.writelines(alines)
+        fw.write(bheader)
+        fw.writelines(blines)
 
 
 def trim(args):
     """
-    %prog trim fastqfile
+    %prog trim fastqfile [fastqfile2]
 
-    Wraps `fastx_trimmer` to trim from begin or end of reads.
+    Trim from begin or end of reads, same as `fastx_trimmer`, and optionally
+    the adapter. With two files, the mates are kept in sync and mates of
+    discarded reads go to `.ntrimmed.orphans.fastq`.
     """
     p = OptionParser(trim.__doc__)
-    set_grid(p)
-
     p.add_option("-f", dest="first", default=0, type="int",
             help="First base to keep. Default is 1.")
     p.add_option("-l", dest="last", default=0, type="int",
             help="Last base to keep. Default is entire read.")
+    set_filter_options(p)
+    p.set_defaults(minlength=1)
 
     opts, args = p.parse_args(args)
-    if len(args) != 1:
+    if len(args) not in (1, 2):
         sys.exit(not p.print_help())
 
-    grid = opts.grid
+    gz = ".gz" if opts.gzip else ""
+    rf = ReadFilter(first=opts.first, last=opts.last, adapter=opts.adapter,
+                    minoverlap=opts.minoverlap, minlength=opts.minlength,
+                    maxN=opts.maxN)
+    if len(args) == 1:
+        fastqfile, = args
+        base = op.basename(fastqfile).split(".")[0]
+        outfiles = [base + ".ntrimmed.fastq" + gz]
+        filter_reads(fastqfile, None, outfiles, rf, cpus=opts.cpus)
+        return outfiles[0]
+
+    r1, r2 = args
+    b1, b2 = fastq_base(r1), fastq_base(r2)
+    outfiles = [b1 + ".ntrimmed.fastq" + gz, b2 + ".ntrimmed.fastq" + gz,
+                b1 + ".ntrimmed.orphans.fastq" + gz]
+    filter_reads(r1, r2, outfiles, rf, layout="split", cpus=opts.cpus)
 
-    fastqfile, = args
-    base = op.basename(fastqfile).split(".")[0]
-    fq = base + ".ntrimmed.fastq"
+    return outfiles
 
-    cmd = "fastx_trimmer -Q33 "
-    if opts.first:
-        cmd += "-f {0.first} ".format(opts)
-    if opts.last:
-        cmd += "-l {0.last} ".format(opts)
 
-    sh(cmd, grid=grid, infile=fastqfile, outfile=fq)
+def split_reads(blocks, n=76, revcomp=False):
+    """
+    Cut each read in the FastqBlocks at the n-th base, returns the texts of
+    the first and second halves.
+    """
+    texts1, texts2 = [], []
+    for block in blocks:
+        names = block.names
+        seqs, quals = block.seqs, block.quals
+        seqs2, quals2 = [x[n:] for x in seqs], [x[n:] for x in quals]
+        if revcomp:
+            seqs2 = [rc(x) for x in seqs2]
+            quals2 = [x[::-1] for x in quals2]
+        plus = ["+"] * len(block)
+        texts1.append(FastqBlock(names, [x[:n] for x in seqs], plus,
+                                 [x[:n] for x in quals]).tostring())
+        texts2.append(FastqBlock(names, seqs2, plus, quals2).tostring())
+    return "".join(texts1), "".join(texts2)
 
 
 def splitread(args):
@@ -484,11 +1124,16 @@ def splitread(args):
 
     Split fastqfile into two read fastqfiles, cut in the middle.
     """
+    from functools import partial
+    from jcvi.apps.base import set_cpus
+    from jcvi.formats.fasta import emit_fragments
+
     p = OptionParser(splitread.__doc__)
     p.add_option("-n", dest="n", default=76, type="int",
             help="Split at N-th base position [default: %default]")
     p.add_option("--rc", default=False, action="store_true",
             help="Reverse complement second read [default: %default]")
+    set_cpus(p, cpus=1)
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
@@ -502,25 +1147,56 @@ def splitread(args):
     fw1 = must_open(fq1, "w")
     fw2 = must_open(fq2, "w")
 
-    fp = must_open(pairsfastq)
-    n = opts.n
-
-    for name, seq, qual in FastqGeneralIterator(fp):
-
-        name = "@" + name
-        rec1 = FastqLite(name, seq[:n], qual[:n])
-        rec2 = FastqLite(name, seq[n:], qual[n:])
-        if opts.rc:
-            rec2.rc()
-
-        print >> fw1, rec1
-        print >> fw2, rec2
+    func = partial(split_reads, n=opts.n, revcomp=opts.rc)
+    emit_fragments(func, FastqReader(pairsfastq), [fw1, fw2], cpus=opts.cpus,
+                   chunksize=1)
 
     logging.debug("Reads split into `{0},{1}`".format(fq1, fq2))
     fw1.close()
     fw2.close()
 
 
+def hash_sample(block, fraction, seed=0, key=None):
+    """
+    Indices of the reads in the block that are sampled. The decision depends
+    only on the (mate) name and the seed, so that mates are sampled together
+    even when the files are read separately.
+    """
+    from zlib import crc32
+    from jcvi.utils.cbook import mix64
+
+    key = key or str
+    h = mix64([crc32(key(x[1:].split(None, 1)[0]), seed) for x in block.names])
+    cutoff = np.uint64(min(int(fraction * 2 ** 64), 2 ** 64 - 1))
+    return np.flatnonzero(h < cutoff)
+
+
+class ReservoirSample (object):
+    """
+    Keep a uniform sample of exactly `size` items (algorithm R), seeded. Items
+    are added in batches; the sample is returned in input order.
+    """
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.rs = np.random.RandomState(seed)
+        self.items = []
+        self.seen = 0
+
+    def add(self, items):
+        n, size = len(items), self.size
+        idx = np.arange(self.seen, self.seen + n)
+        slots = (self.rs.random_sample(n) * (idx + 1)).astype(np.int64)
+        for i in xrange(n):
+            if idx[i] < size:
+                self.items.append((idx[i], items[i]))
+            elif slots[i] < size:
+                self.items[slots[i]] = (idx[i], items[i])
+        self.seen += n
+
+    def __iter__(self):
+        return (x for i, x in sorted(self.items))
+
+
 def size(args):
     """
     %prog size fastqfile
@@ -533,15 +1209,113 @@ def size(args):
     total_size = 0
     total_numrecords = 0
     for f in args:
-        for rec in iter_fastq(f):
-            if rec:
-                total_numrecords += 1
-                total_size += len(rec)
+        for block in FastqReader(f):
+            total_numrecords += len(block)
+            total_size += block.lengths.sum()
 
     print >>sys.stderr, "A total %d bases in %s sequences" % (total_size,
             total_numrecords)
 
 
+def profile(args):
+    """
+    %prog profile fastqfile [fastqfile ...]
+
+    Collect QC summaries in one pass: read count, length histogram, quality
+    offset, per-cycle quality quantiles and base composition, and duplicate
+    rate. The table is written to --outfile, and the length and quality
+    distributions are plotted as text histograms.
+    """
+    p = OptionParser(profile.__doc__)
+    p.add_option("--noplot", default=False, action="store_true",
+            help="do not plot the histograms [default: %default]")
+    set_outfile(p)
+    opts, args = p.parse_args(args)
+
+    if len(args) < 1:
+        sys.exit(not p.print_help())
+
+    rp = ReadProfile()
+    for f in args:
+        for block in FastqReader(f):
+            rp.update(block)
+
+    fw = must_open(opts.outfile, "w")
+    rp.write(fw)
+    if fw is not sys.stdout:
+        fw.close()
+
+    if not opts.noplot:
+        rp.plot()
+
+    return rp
+
+
+def sample(args):
+    """
+    %prog sample fastqfile [fastqfile2]
+
+    Subsample reads, or pairs when given two files. With -f, each read is
+    kept based on a seeded hash of its name (without the /1 or /2), so mates
+    stay together and nothing is held in memory. With -n, exactly that many
+    reads (or pairs) are taken by reservoir sampling. Output is written to
+    `.sample.fastq` next to each input.
+    """
+    from jcvi.formats.base import mate_key
+
+    p = OptionParser(sample.__doc__)
+    p.add_option("-f", dest="fraction", type="float",
+            help="fraction of the reads to keep [default: %default]")
+    p.add_option("-n", dest="number", type="int",
+            help="number of reads to keep [default: %default]")
+    p.add_option("--seed", default=0, type="int",
+            help="random seed [default: %default]")
+    p.add_option("--gzip", default=False, action="store_true",
+            help="write gzipped outputs [default: %default]")
+    opts, args = p.parse_args(args)
+
+    if len(args) not in (1, 2) or (opts.fraction is None) == \
+            (opts.number is None):
+        sys.exit(not p.print_help())
+
+    gz = ".gz" if opts.gzip else ""
+    outfiles = [fastq_base(x) + ".sample.fastq" + gz for x in args]
+    fws = [must_open(x, "w") for x in outfiles]
+    if len(args) == 1:
+        blocks = ((x,) for x in FastqReader(args[0]))
+    else:
+        blocks = iter_fastq_pairs(*args)
+
+    nreads = nkept = 0
+    if opts.fraction is not None:
+        key = mate_key()
+        for blockset in blocks:
+            index = hash_sample(blockset[0], opts.fraction, seed=opts.seed,
+                                key=key)
+            for block, fw in zip(blockset, fws):
+                fw.write(block.tostring(index))
+            nreads += len(blockset[0])
+            nkept += len(index)
+    else:
+        rs = ReservoirSample(opts.number, seed=opts.seed)
+        for blockset in blocks:
+            rs.add(zip(*[[b.record(i) for i in xrange(len(b))] \
+                            for b in blockset]))
+            nreads += len(blockset[0])
+        for records in rs:
+            for record, fw in zip(records, fws):
+                fw.write(record)
+            nkept += 1
+
+    for fw in fws:
+        fw.close()
+
+    logging.debug("Sampled {0} of {1} {2} into `{3}`.".\
+                  format(nkept, nreads, "pairs" if len(args) == 2 else "reads",
+                         ",".join(outfiles)))
+    return outfiles
+
+
 def convert(args):
     """
     %prog convert in.fastq out.fastq
@@ -557,7 +1331,6 @@ def convert(args):
     p.add_option("-q", dest="outfastq", default="sanger", choices=supported_qvs,
             help="output qv, one of {0} [default: %default]".\
                 format("|".join(supported_qvs)))
-    set_grid(p)
 
     opts, args = p.parse_args(args)
 
@@ -566,19 +1339,17 @@ def convert(args):
 
     infastq, outfastq = args
 
-    from jcvi.apps.command import EMBOSSPATH
-
-    seqret = EMBOSSPATH("seqret")
-    if infastq.endswith(".gz"):
-        cmd = "zcat {0} | ".format(infastq)
-        cmd += seqret + " fastq-{0}::stdin fastq-{1}::stdout".\
-                format(opts.infastq, opts.outfastq)
-        cmd += " | gzip > {0}".format(outfastq)
-    else:
-        cmd = seqret + " fastq-{0}::{1} fastq-{2}::{3}".\
-                format(opts.infastq, infastq, opts.outfastq, outfastq)
+    offset = qual_offset(opts.outfastq) - qual_offset(opts.infastq)
+    fw = must_open(outfastq, "w")
+    nreads = 0
+    for block in FastqReader(infastq):
+        block.convert(offset)
+        fw.write(block.tostring())
+        nreads += len(block)
+    fw.close()
 
-    sh(cmd, grid=opts.grid)
+    logging.debug("A total of {0} reads converted ({1}=>{2}) to `{3}`.".\
+                  format(nreads, opts.infastq, opts.outfastq, outfastq))
 
     return outfastq
 
@@ -590,10 +1361,14 @@ def unpair(args):
     Reverse operation of `pair`:
     /1 will be placed in unpaired.1.fastq,
     /2 will be placed in unpaired.2.fastq.
+    Reads without mates go to unpaired.frags.fastq.
     """
+    from jcvi.formats.base import iter_named_records, set_pair_options
+
     p = OptionParser(unpair.__doc__)
     p.add_option("--tag", dest="tag", default=False, action="store_true",
             help="add tag (/1, /2) to the read name")
+    set_pair_options(p)
     opts, args = p.parse_args(args)
 
     if len(args) < 2:
@@ -605,27 +1380,27 @@ def unpair(args):
     base = args[-1]
     afastq = base + ".1.fastq"
     bfastq = base + ".2.fastq"
+    frags = base + ".frags.fastq"
     assert not op.exists(afastq), "File `{0}` exists.".format(afastq)
 
     afw = open(afastq, "w")
     bfw = open(bfastq, "w")
+    fragsfw = open(frags, "w")
 
+    nfrags = 0
     for pairsfastq in pairsfastqs:
         assert op.exists(pairsfastq)
-        it = iter_fastq(pairsfastq)
-        rec = it.next()
-        while rec:
-            if tag:
-                rec.name += "/1"
-            print >> afw, rec
-            rec = it.next()
-            if tag:
-                rec.name += "/2"
-            print >> bfw, rec
-            rec = it.next()
+        records = iter_named_records(pairsfastq)
+        nreads, n = write_mates(opts, records, None, (afw, bfw), fragsfw,
+                                tag=tag)
+        nfrags += n
 
     afw.close()
     bfw.close()
+    fragsfw.close()
+
+    logging.debug("A total of {0} reads without mates written to `{1}`.".\
+                  format(nfrags, frags))
 
     logging.debug("Reads unpaired into `{0},{1}`".\
             format(afastq, bfastq))
@@ -639,11 +1414,10 @@ def pairinplace(args):
     records. If they match, print to bulk.pairs.fastq, else print to
     bulk.frags.fastq.
     """
-    from jcvi.utils.iter import pairwise
+    from jcvi.formats.base import iter_named_records, set_pair_options
 
     p = OptionParser(pairinplace.__doc__)
-    p.add_option("-r", dest="rclip", default=1, type="int",
-            help="pair ID is derived from rstrip N chars [default: %default]")
+    set_pair_options(p, rclip=1)
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
@@ -658,47 +1432,26 @@ def pairinplace(args):
         frags += ".gz"
         pairs += ".gz"
 
-    fragsfw = must_open(frags, "w")
     pairsfw = must_open(pairs, "w")
-
-    N = opts.rclip
-    strip_name = lambda x: x[:-N] if N else str
-
-    fh_iter = iter_fastq(fastqfile, key=strip_name)
-    skipflag = False  # controls the iterator skip
-    for a, b in pairwise(fh_iter):
-        if b is None:  # hit the eof
-            break
-
-        if skipflag:
-            skipflag = False
-            continue
-
-        if a.id == b.id:
-            print >> pairsfw, a
-            print >> pairsfw, b
-            skipflag = True
-        else:
-            print >> fragsfw, a
-
-    # don't forget the last one, when b is None
-    if not skipflag:
-        print >> fragsfw, a
+    records = iter_named_records(fastqfile)
+    write_mates(opts, records, None, pairsfw, frags)
+    pairsfw.close()
 
     logging.debug("Reads paired into `%s` and `%s`" % (pairs, frags))
 
 
 def pair(args):
     """
-    %prog pair 1.fastq 2.fastq ref.fastq
+    %prog pair 1.fastq 2.fastq
 
     Pair up the records in 1.fastq and 2.fastq, pairs are indicated by trailing
-    "/1" and "/2". If using raw sequences, this is trivial, since we can just
-    iterate one at a time for both files; however if two files do not match,
-    (e.g. due to trimming), we need a third fastq that provides the order. Two
-    output files will be automatically written, one `frags.fastq` and
+    "/1" and "/2". The two files are read in lockstep; if they do not match
+    (e.g. due to trimming), reads wait in a disk-backed table for their mates.
+    Two output files will be automatically written, one `frags.fastq` and
     `pairs.fastq`
     """
+    from jcvi.formats.base import set_pair_options
+
     p = OptionParser(pair.__doc__)
     p.add_option("-Q", dest="infastq", default="sanger",
             help="input fastq [default: %default]")
@@ -706,12 +1459,13 @@ def pair(args):
             help="output fastq format [default: %default]")
     p.add_option("-o", dest="outputdir", default=None,
             help="deposit output files into specified directory")
+    set_pair_options(p, rclip=1)
     opts, args = p.parse_args(args)
 
-    if len(args) != 3:
+    if len(args) != 2:
         sys.exit(not p.print_help())
 
-    afastq, bfastq, ref = args
+    afastq, bfastq = args
 
     assert op.exists(afastq) and op.exists(bfastq)
     logging.debug("pair up `%s` and `%s`" % (afastq, bfastq))
@@ -730,46 +1484,10 @@ def pair(args):
     in_offset = qual_offset(opts.infastq)
     out_offset = qual_offset(opts.outfastq)
     offset = out_offset - in_offset
-    ref = opts.ref
-
-    strip_name = lambda x: x[:-1]
-
-    ah_iter = iter_fastq(afastq, offset=offset, key=strip_name)
-    bh_iter = iter_fastq(bfastq, offset=offset, key=strip_name)
 
-    a = ah_iter.next()
-    b = bh_iter.next()
-
-    fragsfw = open(frags, "w")
     pairsfw = open(pairs, "w")
-
-    for r in iter_fastq(ref, offset=0, key=strip_name):
-        if not a or not b or not r:
-            break
-
-        if a.id == b.id:
-            print >>pairsfw, a
-            print >>pairsfw, b
-            a = ah_iter.next()
-            b = bh_iter.next()
-        elif a.id == r.id:
-            print >>fragsfw, a
-            a = ah_iter.next()
-        elif b.id == r.id:
-            print >>fragsfw, b
-            b = bh_iter.next()
-
-        # update progress
-        pos = rh.tell()
-
-    # write all the leftovers to frags file
-    while a:
-        print >>fragsfw, a
-        a = ah_iter.next()
-
-    while b:
-        print >>fragsfw, b
-        b = bh_iter.next()
+    write_mates(opts, afastq, bfastq, pairsfw, frags, offset=offset)
+    pairsfw.close()
 
 
 if __name__ == '__main__':
@@ -2,34 +2,49 @@
 # -*- coding: UTF-8 -*-
 
 
+import re
 import sys
 import os
 import os.path as op
 import itertools
 import logging
 
+import numpy as np
+
 from collections import defaultdict
+from itertools import izip
 from urlparse import unquote
 from optparse import OptionParser
 
-from jcvi.formats.base import LineFile, must_open
+from jcvi.formats.base import LineFile, ReadNames, must_open
 from jcvi.formats.fasta import Fasta, SeqIO
 from jcvi.formats.bed import Bed, BedLine
 from jcvi.utils.iter import flatten
 from jcvi.utils.orderedcollections import DefaultOrderedDict, parse_qs
-from jcvi.apps.base import ActionDispatcher, set_outfile, mkdir, need_update, sh
+from jcvi.apps.base import ActionDispatcher, set_outfile, set_cpus, mkdir, \
+        need_update, sh
 
 
 Valid_strands = ('+', '-', '?', '.')
 Valid_phases = ('0', '1', '2', '.')
 FastaTag = "##FASTA"
 RegionTag = "##sequence-region"
+Gtf_types = ("CDS", "exon", "start_codon", "stop_codon")
+Gff3_transcript_types = ("mRNA", "transcript")
+Gtf_attribute = re.compile(r'([^\s;]+)\s+(?:"([^"]*)"|([^\s;]*))')
+Attribute_patterns = {}
 
 
 class GffLine (object):
     """
     Specification here (http://www.sequenceontology.org/gff3.shtml)
+
+    The attributes are parsed on first access only; `get_attr()` and `accn`
+    scan the GFF3 text directly until then.
     """
+    __slots__ = ("seqid", "source", "type", "start", "end", "score", "strand",
+                 "phase", "attributes_text", "gff3", "key", "_attributes")
+
     def __init__(self, sline, key="ID"):
         args = sline.strip().split("\t")
         self.seqid = args[0]
@@ -44,12 +59,38 @@ class GffLine (object):
         self.phase = args[7]
         assert self.phase in Valid_phases, \
                 "phase must be one of {0}".format(Valid_phases)
-        self.attributes_text = unquote(args[8].strip())
-        self.gff3 = gff3 = "=" in self.attributes_text
-        self.attributes = make_attributes(self.attributes_text, gff3=gff3)
+        text = args[8].strip()
+        self.attributes_text = unquote(text) if "%" in text else text
+        self.gff3 = "=" in self.attributes_text
+        self._attributes = None
         # key is not in the gff3 field, this indicates the conversion to accn
         self.key = key  # usually it's `ID=xxxxx;`
 
+    @property
+    def attributes(self):
+        if self._attributes is None:
+            self._attributes = make_attributes(self.attributes_text,
+                                               gff3=self.gff3)
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, attributes):
+        self._attributes = attributes
+
+    def get_attr(self, key, first=True):
+        """
+        Value (or the list of values) of an attribute, None if absent. Unless
+        the attributes are already parsed, GFF3 text is scanned for this key
+        only.
+        """
+        if self._attributes is not None or not self.gff3:
+            values = self.attributes.get(key)
+        else:
+            values = scan_attribute(self.attributes_text, key)
+        if not values:
+            return None
+        return values[0] if first else values
+
     def __getitem__(self, key):
         return getattr(self, key)
 
@@ -75,8 +116,10 @@ class GffLine (object):
 
     @property
     def accn(self):
-        if self.key and self.key in self.attributes:
-            return self.attributes[self.key][0]
+        if self.key:
+            value = self.get_attr(self.key)
+            if value is not None:
+                return value
         return self.attributes_text.split()[0]
 
     id = accn
@@ -94,12 +137,22 @@ class GffLine (object):
 
 
 class Gff (LineFile):
-
-    def __init__(self, filename, key="ID"):
+    """
+    Features of a GFF file. Each iteration parses the file again, unless
+    `cached`, where the file is parsed once into a GffTable on first use.
+    """
+    def __init__(self, filename, key="ID", cached=False):
         super(Gff, self).__init__(filename)
         self.key = key
+        self.cached = cached
+        self.table = None
 
     def __iter__(self):
+        if self.cached:
+            return iter(self.load())
+        return self.iter_lines()
+
+    def iter_lines(self):
         fp = must_open(self.filename)
         for row in fp:
             row = row.strip()
@@ -111,11 +164,340 @@ class Gff (LineFile):
                 continue
             yield GffLine(row, key=self.key)
 
+    def load(self):
+        if self.table is None:
+            self.table = GffTable(self.iter_lines(), key=self.key)
+        return self.table
+
     @property
     def seqids(self):
+        if self.cached:
+            return set(self.load().seqnames)
         return set(x.seqid for x in self)
 
 
+class GffTable (object):
+    """
+    Features parsed once into columns: coded seqid, source, type, strand and
+    phase, coordinates in arrays, score and attributes as raw strings, and the
+    accn and parents of each feature. Iterating yields fresh GffLine objects,
+    so edits do not stick.
+    """
+    def __init__(self, gfflines, key="ID"):
+        self.key = key
+        seqids, sources, types, starts, ends = [], [], [], [], []
+        strands, phases = [], []
+        self.scores, self.attributes = [], []
+        self.accns, self.parents = [], []
+        for g in gfflines:
+            seqids.append(g.seqid)
+            sources.append(g.source)
+            types.append(g.type)
+            starts.append(g.start)
+            ends.append(g.end)
+            strands.append(g.strand)
+            phases.append(g.phase)
+            self.scores.append(g.score)
+            self.attributes.append(g.attributes_text)
+            self.accns.append(g.accn)
+            self.parents.append(g.get_attr("Parent", first=False))
+
+        self.seqnames, self.seqcodes = encode(seqids)
+        self.sourcenames, self.sourcecodes = encode(sources)
+        self.typenames, self.typecodes = encode(types)
+        self.strandnames, self.strandcodes = encode(strands)
+        self.phasenames, self.phasecodes = encode(phases)
+        self.starts = np.array(starts, dtype=np.int64)
+        self.ends = np.array(ends, dtype=np.int64)
+        self._children = None
+        logging.debug("A total of {0} features loaded.".format(len(self)))
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __iter__(self):
+        return self.iter_features(xrange(len(self)))
+
+    def feature(self, i):
+        return self.iter_features([i]).next()
+
+    def iter_features(self, rows, chunksize=1 << 16):
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = (self.seqcodes, self.sourcecodes, self.typecodes,
+                   self.starts, self.ends, self.strandcodes, self.phasecodes)
+        seqnames, sourcenames, typenames = \
+                self.seqnames, self.sourcenames, self.typenames
+        strandnames, phasenames = self.strandnames, self.phasenames
+        scores, attributes = self.scores, self.attributes
+        for k in xrange(0, len(rows), chunksize):
+            chunk = rows[k:k + chunksize]
+            for (i, seqid, source, type, start, end, strand, phase) in \
+                    izip(chunk.tolist(), *(x[chunk].tolist() for x in columns)):
+                g = GffLine.__new__(GffLine)
+                g.seqid = seqnames[seqid]
+                g.source = sourcenames[source]
+                g.type = typenames[type]
+                g.start = start
+                g.end = end
+                g.score = scores[i]
+                g.strand = strandnames[strand]
+                g.phase = phasenames[phase]
+                g.attributes_text = text = attributes[i]
+                g.gff3 = "=" in text
+                g.key = self.key
+                g._attributes = None
+                yield g
+
+    def rows_of_type(self, types):
+        if isinstance(types, basestring):
+            types = [types]
+        codes = [i for i, x in enumerate(self.typenames) if x in types]
+        return np.flatnonzero(np.in1d(self.typecodes, codes))
+
+    def iter_type(self, types):
+        """
+        Features of the type(s), in file order.
+        """
+        return self.iter_features(self.rows_of_type(types))
+
+    @property
+    def children_rows(self):
+        """
+        Parent ID => rows of its children, in file order.
+        """
+        if self._children is None:
+            self._children = defaultdict(list)
+            for i, parents in enumerate(self.parents):
+                for parent in parents or []:
+                    self._children[parent].append(i)
+        return self._children
+
+    def children(self, parent):
+        """
+        Features whose parent is the ID, by start.
+        """
+        rows = self.children_rows.get(parent, [])
+        rows = sorted(rows, key=lambda x: self.starts[x])
+        return self.iter_features(rows)
+
+    def group_by_parent(self, types=None):
+        """
+        Yield (parent, children) for the parents in order of first child,
+        children optionally limited to certain types.
+        """
+        rows = self.rows_of_type(types) if types else xrange(len(self))
+        groups = DefaultOrderedDict(list)
+        for i in rows:
+            for parent in self.parents[i] or []:
+                groups[parent].append(i)
+        for parent, rows in groups.iteritems():
+            yield parent, list(self.iter_features(rows))
+
+
+def encode(values):
+    """
+    Distinct values (as a list of str) and the code of each value.
+    """
+    names, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+    return names.tolist(), codes
+
+
+class GffIndex (object):
+    """
+    Feature index of a GFF file, built in one pass and saved to the sidecar
+    `gff_file.idx.npz`, which is reused until the GFF changes. Features are
+    held in columnar arrays, with ID => rows, parent => children adjacency
+    and per-seqid sorted coordinates. The full GffLine of a feature is read
+    back by seeking to its line.
+    """
+    def __init__(self, gff_file, key="ID"):
+        self.filename = gff_file
+        self.key = key
+        idxfile = gff_file + ".idx.npz"
+        if need_update(gff_file, idxfile):
+            self.build(idxfile)
+
+        idx = np.load(idxfile)
+        for name in idx.files:
+            setattr(self, name, idx[name])
+        self.names = ReadNames(self.ids)
+        self.fp = open(gff_file, "rb")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def build(self, idxfile):
+        offsets, seqids, types, starts, ends = [], [], [], [], []
+        ids, parents = [], []
+        fp = open(self.filename, "rb")
+        pos = 0
+        for row in fp:
+            offset = pos
+            pos += len(row)
+            if row[0] == '#':
+                if row.strip() == FastaTag:
+                    break
+                continue
+            if row.strip() == "":
+                continue
+
+            g = GffLine(row, key=self.key)
+            offsets.append(offset)
+            seqids.append(g.seqid)
+            types.append(g.type)
+            starts.append(g.start)
+            ends.append(g.end)
+            ids.append(g.get_attr("ID") or "")
+            parents.append(g.get_attr("Parent", first=False) or [])
+        fp.close()
+
+        n = len(offsets)
+        seqnames, seqcodes = np.unique(np.array(seqids, dtype=str),
+                                       return_inverse=True)
+        typenames, typecodes = np.unique(np.array(types, dtype=str),
+                                         return_inverse=True)
+        starts = np.array(starts, dtype=np.int64)
+        ends = np.array(ends, dtype=np.int64)
+
+        names = ReadNames.build(x for x in ids if x)
+        idranks = names.lookup(ids)
+        rows = np.flatnonzero(idranks >= 0)
+        rows = rows[np.argsort(idranks[rows], kind="mergesort")]
+        id_ptr = np.searchsorted(idranks[rows], np.arange(len(names) + 1))
+
+        # Parent => children, children ordered by start
+        crows = np.array([i for i, x in enumerate(parents) for p in x],
+                         dtype=np.int64)
+        pranks = names.lookup([p for x in parents for p in x])
+        valid = pranks >= 0
+        if not valid.all():
+            logging.error("{0} features have undefined parents.".\
+                          format(len(valid) - valid.sum()))
+        crows, pranks = crows[valid], pranks[valid]
+        parent_ptr = np.searchsorted(crows, np.arange(n + 1))
+        order = np.lexsort((crows, starts[crows], pranks))
+        child_ptr = np.searchsorted(pranks[order], np.arange(len(names) + 1))
+
+        # Per-seqid sorted coordinates for region queries
+        seqorder = np.lexsort((starts, seqcodes))
+        seq_ptr = np.searchsorted(seqcodes[seqorder],
+                                  np.arange(len(seqnames) + 1))
+        seq_maxlen = np.zeros(len(seqnames), dtype=np.int64)
+        np.maximum.at(seq_maxlen, seqcodes, ends - starts + 1)
+
+        np.savez(idxfile, offsets=np.array(offsets, dtype=np.int64),
+                 seqnames=seqnames, seqcodes=seqcodes, typenames=typenames,
+                 typecodes=typecodes, starts=starts, ends=ends,
+                 ids=names.names, idranks=idranks, id_ptr=id_ptr, id_rows=rows,
+                 parent_ptr=parent_ptr, parent_ranks=pranks,
+                 child_ptr=child_ptr, child_rows=crows[order],
+                 seqorder=seqorder, seq_ptr=seq_ptr, seq_maxlen=seq_maxlen)
+        logging.debug("Index of {0} features written to `{1}`.".\
+                      format(n, idxfile))
+
+    def feature(self, row):
+        self.fp.seek(self.offsets[row])
+        return GffLine(self.fp.readline(), key=self.key)
+
+    def iter_features(self, rows):
+        for row in rows:
+            yield self.feature(row)
+
+    def rows(self, id):
+        rank, = self.names.lookup([id])
+        if rank < 0:
+            return self.id_rows[:0]
+        return self.id_rows[self.id_ptr[rank]:self.id_ptr[rank + 1]]
+
+    def get(self, id):
+        """
+        The first feature with this ID, None if not found.
+        """
+        rows = self.rows(id)
+        return self.feature(rows[0]) if len(rows) else None
+
+    def children(self, id, level=1):
+        """
+        Features that are `level` generations below the ID, by start.
+        """
+        ranks = self.names.lookup([id])
+        ranks = ranks[ranks >= 0]
+        for i in xrange(level):
+            rows = gather(self.child_ptr, self.child_rows, ranks)
+            ranks = np.unique(self.idranks[rows])
+            ranks = ranks[ranks >= 0]
+        rows = np.unique(rows)
+        rows = rows[np.argsort(self.starts[rows], kind="mergesort")]
+        return self.iter_features(rows)
+
+    def parents(self, id, level=1):
+        """
+        Features that are `level` generations above the ID.
+        """
+        rows = self.rows(id)
+        for i in xrange(level):
+            ranks = np.unique(gather(self.parent_ptr, self.parent_ranks, rows))
+            rows = gather(self.id_ptr, self.id_rows, ranks)
+        return self.iter_features(rows)
+
+    def features_of_type(self, type):
+        """
+        Features of the type, sorted by seqid and start.
+        """
+        code = np.searchsorted(self.typenames, type)
+        if code == len(self.typenames) or self.typenames[code] != type:
+            return self.iter_features([])
+        rows = self.seqorder[self.typecodes[self.seqorder] == code]
+        return self.iter_features(rows)
+
+    def region(self, seqid, start, end, type=None):
+        """
+        Features that overlap seqid:start-end, sorted by start.
+        """
+        code = np.searchsorted(self.seqnames, seqid)
+        if code == len(self.seqnames) or self.seqnames[code] != seqid:
+            return self.iter_features([])
+        block = self.seqorder[self.seq_ptr[code]:self.seq_ptr[code + 1]]
+        bstarts = self.starts[block]
+        lo = np.searchsorted(bstarts, start - self.seq_maxlen[code] + 1)
+        hi = np.searchsorted(bstarts, end, side="right")
+        rows = block[lo:hi]
+        rows = rows[self.ends[rows] >= start]
+        if type is not None:
+            rows = [x for x in rows if self.typenames[self.typecodes[x]] == type]
+        return self.iter_features(rows)
+
+
+def gather(ptr, values, keys):
+    """
+    Concatenate the values of the keys in a CSR layout, where the values of
+    key k are values[ptr[k]:ptr[k + 1]].
+    """
+    if not len(keys):
+        return values[:0]
+    return np.concatenate([values[ptr[k]:ptr[k + 1]] for k in keys])
+
+
+def scan_attribute(s, key):
+    """
+    Values of one GFF3 attribute, parsed the same way as make_attributes()
+    but without building the dict of all the attributes.
+    """
+    pattern = Attribute_patterns.get(key)
+    if pattern is None:
+        pattern = Attribute_patterns[key] = \
+                re.compile(r"(?:^|[;&]){0}=([^;&]*)".format(re.escape(key)))
+
+    values = []
+    for value in pattern.findall(s):
+        if not value:
+            continue
+        if "%" in value or "+" in value:
+            value = unquote(value.replace("+", " "))
+        values.extend(value.split(","))
+    return values
+
+
 def make_attributes(s, gff3=True):
     """
     In GFF3, the last column is typically:
@@ -247,29 +629,27 @@ def filter(args):
 
     gffile, = args
 
-    gff = Gff(gffile)
+    gff = Gff(gffile, cached=True).load()
     bad = set()
     relatives = set()
-    for g in gff:
-        if g.type != opts.type:
-            continue
-        identity = float(g.attributes["Identity"][0])
-        coverage = float(g.attributes["Coverage"][0])
+    for g in gff.iter_type(opts.type):
+        identity = float(g.get_attr("Identity"))
+        coverage = float(g.get_attr("Coverage"))
         if identity < opts.id or coverage < opts.coverage:
             bad.add(g.accn)
-            relatives.add(g.attributes["Parent"][0])
+            relatives.add(g.get_attr("Parent"))
 
     logging.debug("{0} bad accns marked.".format(len(bad)))
 
-    for g in gff:
-        if "Parent" in g.attributes and g.attributes["Parent"][0] in bad:
-            relatives.add(g.accn)
+    for accn, parents in izip(gff.accns, gff.parents):
+        if parents and parents[0] in bad:
+            relatives.add(accn)
 
     logging.debug("{0} bad relatives marked.".format(len(relatives)))
 
-    for g in gff:
-        if g.accn in bad or g.accn in relatives:
-            continue
+    keep = [i for i, accn in enumerate(gff.accns) \
+                if not (accn in bad or accn in relatives)]
+    for g in gff.iter_features(keep):
         print g
 
 
@@ -323,15 +703,13 @@ def format(args):
     if mapfile:
         mapping = DictFile(mapfile, delimiter="\t")
 
+    gff = Gff(gffile, cached=unique)
     if unique:
         dupcounts = defaultdict(int)
-        gff = Gff(gffile)
-        for g in gff:
-            id = g.accn
+        for id in gff.load().accns:
             dupcounts[id] += 1
         seen = defaultdict(int)
 
-    gff = Gff(gffile)
     notes = {}
     for g in gff:
         origid = g.seqid
@@ -353,7 +731,7 @@ def format(args):
         if gsac and g.type == "gene":
             notes[g.accn] = g.attributes["Name"]
 
-        pp = g.attributes.get("Parent", [])
+        pp = g.get_attr("Parent", first=False) or []
         if opts.multiparents and len(pp) > 1:  # separate multiple parents
             id = g.attributes["ID"][0]
             for i, parent in enumerate(pp):
@@ -377,16 +755,32 @@ def liftover(args):
 
     Adjust gff coordinates based on tile number. For example,
     "gannotation.asmbl.000095.7" is the 8-th tile on asmbl.000095.
+
+    With --chain, lift the coordinates through a chain file, or an AGP file
+    (components to objects) if the name ends with .agp, instead.
     """
     p = OptionParser(liftover.__doc__)
     p.add_option("--tilesize", default=50000, type="int",
                  help="The size for each tile [default: %default]")
+    p.add_option("--chain",
+                 help="Lift through chain or AGP file [default: %default]")
+    p.add_option("--unmapped",
+                 help="Write the features not lifted to file [default: %default]")
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
         sys.exit(not p.print_help())
 
     gffile, = args
+    if opts.chain:
+        from jcvi.formats.chain import LiftOver, liftover_file
+
+        lo = LiftOver.load(opts.chain)
+        fwunmapped = must_open(opts.unmapped, "w") if opts.unmapped else None
+        liftover_file(lo, gffile, sys.stdout, fwunmapped=fwunmapped,
+                      format="gff")
+        return
+
     gff = Gff(gffile)
     for g in gff:
         seqid = g.seqid
@@ -399,19 +793,28 @@ def liftover(args):
         print g
 
 
-def get_piles(allgenes):
+def get_piles(seqids, starts, ends):
     """
     Before running uniq, we need to compute all the piles. The piles are a set
-    of redundant features we want to get rid of. Input are a list of GffLines
-    features. Output are list of list of features distinct "piles".
+    of redundant features we want to get rid of. The features are swept along
+    each seqid, and a new pile starts when a feature starts after the end of
+    all previous ones. Returns the order of the features by seqid and start,
+    and the pile number of each feature in that order.
     """
-    from jcvi.utils.range import Range, range_piles
-
-    ranges = [Range(a.seqid, a.start, a.end, 0, i) \
-                    for i, a in enumerate(allgenes)]
-
-    for pile in range_piles(ranges):
-        yield [allgenes[x] for x in pile]
+    seqnames, seqcodes = np.unique(np.array(seqids, dtype=str),
+                                   return_inverse=True)
+    starts = np.array(starts, dtype=np.int64)
+    ends = np.array(ends, dtype=np.int64)
+    order = np.lexsort((starts, seqcodes))
+
+    # Shift each seqid beyond the previous, so one running max serves all
+    shift = seqcodes[order] * (max(ends.max(), starts.max()) + 1) \
+                if len(order) else 0
+    starts, ends = starts[order] + shift, ends[order] + shift
+    maxends = np.maximum.accumulate(ends)
+    breaks = np.ones(len(order), dtype=np.int64)
+    breaks[1:] = starts[1:] > maxends[:-1]
+    return order, np.cumsum(breaks) - 1
 
 
 def uniq(args):
@@ -419,7 +822,8 @@ def uniq(args):
     %prog uniq gffile > uniq.gff
 
     Remove redundant gene models. For overlapping gene models, take the longest
-    gene. A second scan takes only the genes selected.
+    gene. The gff is read once to build the parent/child model, and a second
+    pass copies the lines of the genes selected and their children.
 
     --mode controls whether you want larger feature, or higher scoring feature.
     --best controls how many redundant features to keep, e.g. 10 for est2genome.
@@ -445,82 +849,140 @@ def uniq(args):
         sys.exit(not p.print_help())
 
     gffile, = args
-    gff = Gff(gffile)
     mode = opts.mode
     bestn = opts.best
-    allgenes = []
-    for g in gff:
+
+    offsets, lineends, accns, types, parents = [], [], [], [], []
+    genes = []
+    seqids, starts, ends, scores, names = [], [], [], [], []
+    fp = open(gffile, "rb")
+    pos = 0
+    for row in fp:
+        offset = pos
+        pos += len(row)
+        if row[0] == '#':
+            if row.strip() == FastaTag:
+                break
+            continue
+        if row.strip() == "":
+            continue
+
+        g = GffLine(row)
+        offsets.append(offset)
+        lineends.append(pos)
+        accns.append(g.accn)
+        types.append(g.type)
+        parents.append(g.get_attr("Parent", first=False) or [])
         if g.type != opts.type:
             continue
-        allgenes.append(g)
 
-    logging.debug("A total of {0} genes imported.".format(len(allgenes)))
-    allgenes.sort(key=lambda x: (x.seqid, x.start))
+        genes.append(len(accns) - 1)
+        seqids.append(g.seqid)
+        starts.append(g.start)
+        ends.append(g.end)
+        scores.append(g.score)
+        names.append(g.get_attr("Name") if opts.name else g.accn)
 
-    g = get_piles(allgenes)
+    logging.debug("A total of {0} genes imported.".format(len(genes)))
+    order, piles = get_piles(seqids, starts, ends)
 
-    bestids = set()
-    for group in g:
-        if mode == "span":
-            scores_group = [(- x.span, x) for x in group]
-        else:
-            scores_group = [(- float(x.score), x) for x in group]
+    if mode == "span":
+        scores = np.array(starts) - np.array(ends)
+    else:
+        scores = -np.array(scores, dtype=float)
+    ranked = order[np.lexsort((scores[order], piles))] if len(order) else order
+    ranked_piles = np.sort(piles)
 
-        scores_group.sort()
-        seen = set()
-        for score, x in scores_group:
-            if len(seen) >= bestn:
-                break
+    bestids = set()
+    current = None
+    for i, pile in izip(ranked, ranked_piles):
+        if pile != current:
+            current = pile
+            seen = set()
+        if len(seen) >= bestn:
+            continue
 
-            name = x.attributes["Name"][0] if opts.name else x.accn
-            if name in seen:
-                continue
+        name = names[i]
+        if name in seen:
+            continue
 
-            seen.add(name)
-            bestids.add(x.accn)
+        seen.add(name)
+        bestids.add(accns[genes[i]])
 
     logging.debug("A total of {0} genes selected.".format(len(bestids)))
     logging.debug("Populate children. Iteration 1..")
-    gff = Gff(gffile)
     children = set()
-    for g in gff:
-        if "Parent" not in g.attributes:
-            continue
-        for parent in g.attributes["Parent"]:
+    for accn, pp in izip(accns, parents):
+        for parent in pp:
             if parent in bestids:
-                children.add(g.accn)
+                children.add(accn)
 
     if opts.iter == "2":
         logging.debug("Populate children. Iteration 2..")
-        gff = Gff(gffile)
-        for g in gff:
-            if "Parent" not in g.attributes:
-                continue
-            for parent in g.attributes["Parent"]:
+        for accn, pp in izip(accns, parents):
+            for parent in pp:
                 if parent in children:
-                    children.add(g.accn)
+                    children.add(accn)
 
     logging.debug("Filter gff file..")
-    gff = Gff(gffile)
     seen = set()
-    for g in gff:
-        accn = g.accn
+    selected = []
+    for i, (accn, type) in enumerate(izip(accns, types)):
         if accn in seen:
             continue
-        if (g.type == opts.type and accn in bestids) or (accn in children):
+        if (type == opts.type and accn in bestids) or (accn in children):
             seen.add(accn)
-            print g
+            selected.append(i)
+
+    copy_lines(fp, offsets, lineends, selected, sys.stdout)
+    fp.close()
+
+
+def copy_lines(fp, starts, ends, selected, fw, bufsize=1 << 24):
+    """
+    Copy the selected lines byte-for-byte, line i spans starts[i] to ends[i].
+    Adjacent lines are copied as one range.
+    """
+    selected = np.array(selected, dtype=np.int64)
+    if not len(selected):
+        return
+
+    starts = np.array(starts, dtype=np.int64)[selected]
+    ends = np.array(ends, dtype=np.int64)[selected]
+    breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+    firsts = np.concatenate(([0], breaks))
+    lasts = np.concatenate((breaks - 1, [len(selected) - 1]))
+    buf = ""
+    for a, b in izip(starts[firsts], ends[lasts]):
+        fp.seek(a)
+        nbytes = b - a
+        while nbytes > 0:
+            buf = fp.read(min(nbytes, bufsize))
+            nbytes -= len(buf)
+            fw.write(buf)
+    if buf and buf[-1] != "\n":
+        fw.write("\n")
 
 
 def sort(args):
     """
     %prog sort gffile
 
-    Sort gff file.
+    Sort gff file by seqid and start. Each gene model (gene => mRNA =>
+    exon/CDS) is sorted as one unit, by its top feature, and written parents
+    before children. Sorted runs are limited by --memory and merged, so the
+    whole file does not need to fit in memory. The parent, seqid and start of
+    every ID (and the sort key of every parent) are kept in memory on top of
+    that, so memory still grows with the number of IDs.
     """
+    from jcvi.formats.base import external_sort
+
     p = OptionParser(sort.__doc__)
     p.add_option("-i", dest="inplace", default=False, action="store_true",
                  help="Sort inplace [default: %default]")
+    p.add_option("--memory", default=256, type="int",
+                 help="Size of the sorted runs (lines and sort keys), " +\
+                      "in MB [default: %default]")
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
@@ -529,10 +991,87 @@ def sort(args):
     gffile, = args
     sortedgff = op.basename(gffile).rsplit(".", 1)[0] + ".sorted.gff"
     if opts.inplace:
+        sortedgff = gffile + ".sorted"
+
+    headers, fastaoffset = [], None
+    nodes = {}
+    fp = open(gffile, "rb")
+    pos = 0
+    for i, row in enumerate(fp):
+        offset = pos
+        pos += len(row)
+        if row[0] == '#':
+            if row.strip() == FastaTag:
+                fastaoffset = offset
+                break
+            if row.strip() != "###":  # Resolution directives are positional
+                headers.append(row)
+            continue
+        if row.strip() == "":
+            continue
+
+        g = GffLine(row)
+        id = g.get_attr("ID")
+        if id and id not in nodes:
+            nodes[id] = (g.get_attr("Parent"), g.seqid, g.start, i)
+
+    def iter_keys():
+        fp.seek(0)
+        paths = {}
+        for i, row in enumerate(fp):
+            if row[0] == '#':
+                if row.strip() == FastaTag:
+                    break
+                continue
+            if row.strip() == "":
+                continue
+
+            g = GffLine(row)
+            parent = g.get_attr("Parent")
+            if parent in nodes:
+                key = unit_path(parent, nodes, paths) + ((g.start, i),)
+            else:
+                key = ((g.seqid, g.start, i),)
+            yield key, row
+
+    fw = open(sortedgff, "wb")
+    fw.writelines(headers)
+    for key, row in external_sort(iter_keys(), maxbytes=opts.memory << 20):
+        fw.write(row if row[-1] == "\n" else row + "\n")
+    if fastaoffset is not None:
+        fp.seek(fastaoffset)
+        for row in fp:
+            fw.write(row)
+    fp.close()
+    fw.close()
+
+    if opts.inplace:
+        os.rename(sortedgff, gffile)
         sortedgff = gffile
+    logging.debug("Sorted gff written to `{0}`.".format(sortedgff))
+    return sortedgff
 
-    cmd = "sort -k1,1 -k4,4n {0} -o {1}".format(gffile, sortedgff)
-    sh(cmd)
+
+def unit_path(id, nodes, paths):
+    """
+    Sort key of a feature within the sorted gff: the (seqid, start, row) of
+    the top feature of its unit, followed by the (start, row) of every feature
+    down the first-parent chain. Parents thus sort before their children.
+    """
+    if id in paths:
+        return paths[id]
+
+    chain = []
+    while id in nodes and id not in paths and len(chain) < 100:
+        chain.append(id)
+        id = nodes[id][0]
+
+    path = paths.get(id, ())
+    for id in reversed(chain):
+        parent, seqid, start, row = nodes[id]
+        path += ((start, row),) if path else ((seqid, start, row),)
+        paths[id] = path
+    return path
 
 
 def fromgb(args):
@@ -555,38 +1094,181 @@ def fromgb(args):
     sh(cmd, outfile=outfile)
 
 
+def gtf_attributes(text):
+    """
+    Keys (in order) and values of the GTF attributes, e.g.
+    gene_id "g1"; transcript_id "g1.t1"; tag "basic";
+    """
+    keys, values = [], {}
+    for key, quoted, plain in Gtf_attribute.findall(text):
+        if key not in values:
+            keys.append(key)
+            values[key] = []
+        values[key].append(quoted or plain)
+    return keys, values
+
+
+def gff3_attributes_text(keys, values):
+    attributes = []
+    for key in keys:
+        val = ",".join(values[key])
+        if " " in val:
+            val = "\"{0}\"".format(val)
+        attributes.append(key + "=" + val)
+    return ";".join(attributes)
+
+
+def iter_gtf_to_gff3(lines, grouped=False):
+    """
+    Convert GTF lines to GFF3 lines. Transcript lines become mRNA with
+    ID=transcript_id and Parent=gene_id, gene lines get ID=gene_id, and the
+    other features Parent=transcript_id.
+
+    The lines of each transcript are buffered, so that a transcript without
+    its transcript line gets an mRNA that spans its features. This requires
+    the input to be clustered by transcript (unless `grouped`); the hashes of
+    the transcripts done are kept to check that, and None is yielded once a
+    transcript comes back.
+    """
+    done = set()
+    run, tid = [], None
+    for row in itertools.chain(lines, [None]):
+        if row is not None:
+            if row[0] == '#' or not row.strip():
+                continue
+            atoms = row.rstrip("\r\n").split("\t")
+            keys, values = gtf_attributes(atoms[8])
+            current = atoms, keys, values
+            rtid = values.get("transcript_id", [None])[0]
+            if rtid == tid:
+                run.append(current)
+                continue
+
+        if tid is not None:
+            h = hash(tid)
+            if h in done and not grouped:
+                yield None
+                return
+            done.add(h)
+            if not any(atoms[2] == "transcript" for atoms, k, v in run):
+                atoms, keys, values = run[0]
+                gid = values.get("gene_id", [tid])[0]
+                start = min(int(x[0][3]) for x in run)
+                end = max(int(x[0][4]) for x in run)
+                yield "\t".join(atoms[:2] + ["mRNA", str(start), str(end),
+                        ".", atoms[6], ".",
+                        gff3_attributes_text(["ID", "Parent"],
+                                             {"ID": [tid], "Parent": [gid]})])
+
+        for atoms, keys, values in run:
+            if atoms[2] == "transcript":
+                atoms[2] = "mRNA"
+                extra = [("ID", values.pop("transcript_id", None)),
+                         ("Parent", values.pop("gene_id", None))]
+            elif atoms[2] == "gene":
+                extra = [("ID", values.pop("gene_id", None))]
+            else:
+                extra = [("Parent", values.pop("transcript_id", None))]
+
+            for key, val in extra:
+                if val is None:
+                    continue
+                if key not in values:
+                    keys.append(key)
+                values[key] = val
+            keys = [x for x in keys if x in values]
+            atoms[8] = gff3_attributes_text(keys, values)
+            yield "\t".join(atoms)
+
+        if row is None:
+            break
+        run, tid = [current], rtid
+
+
+def gtf_group_key(row, i):
+    """
+    Sort key that groups the GTF lines by transcript, transcript line first.
+    """
+    if row[0] == '#' or not row.strip():
+        return None
+    atoms = row.split("\t")
+    keys, values = gtf_attributes(atoms[8])
+    tid = values.get("transcript_id", [""])[0]
+    return [((tid, atoms[2] != "transcript", i), row)]
+
+
+def write_clustered(filename, outfile, convert, group_key, memory=256):
+    """
+    Write the lines from convert(lines) into outfile in one streaming pass,
+    for input clustered by transcript. Once convert() yields None, the input
+    turns out not to be clustered; the lines are then grouped by group_key()
+    with an external sort and converted again. Output to stdout goes through
+    a temporary file for that reason.
+    """
+    from jcvi.formats.base import external_sort
+
+    tostdout = outfile in ("-", "stdout")
+
+    def write(lines, chunksize=10000):
+        fw = must_open("tmp" if tostdout else outfile, "w")
+        for chunk in iter(lambda: list(itertools.islice(lines, chunksize)), []):
+            if None in chunk:
+                fw.close()
+                if tostdout:
+                    os.remove(fw.name)
+                return None
+            print >> fw, "\n".join(chunk)
+        fw.close()
+        return fw.name
+
+    result = write(convert(must_open(filename)))
+    if result is None:
+        assert filename not in ("-", "stdin"), \
+                "Input from stdin must be clustered by transcript"
+        logging.debug("`{0}` not clustered by transcript, group the lines "
+                      "first.".format(filename))
+
+        def iter_items():
+            for i, row in enumerate(must_open(filename)):
+                for item in group_key(row, i) or []:
+                    yield item
+
+        lines = (row for key, row in \
+                    external_sort(iter_items(), maxbytes=memory << 20))
+        result = write(convert(lines, grouped=True))
+
+    if tostdout:
+        import shutil
+
+        shutil.copyfileobj(open(result), sys.stdout)
+        os.remove(result)
+
+
 def fromgtf(args):
     """
     %prog fromgtf gtffile
 
     Convert gtf to gff file. In gtf, the "transcript_id" will convert to "ID=",
     the "transcript_id" in exon/CDS feature will be converted to "Parent=".
+    Transcripts without a transcript line get an mRNA that spans their
+    features.
+
+    The gtf is converted in one streaming pass, buffering one transcript at a
+    time, if it is clustered by transcript as most tools write it; otherwise
+    the lines are grouped first with an external sort.
     """
     p = OptionParser(fromgtf.__doc__)
+    p.add_option("--memory", default=256, type="int",
+                 help="Size of the sorted runs, in MB [default: %default]")
+    set_outfile(p)
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
         sys.exit(not p.print_help())
 
     gtffile, = args
-    gff = Gff(gtffile)
-    for g in gff:
-        if g.type == "transcript":
-            g.type = "mRNA"
-            g.attributes["ID"] = g.attributes["transcript_id"]
-            g.attributes["Parent"] = g.attributes["gene_id"]
-            del g.attributes["transcript_id"]
-            del g.attributes["gene_id"]
-        elif g.type in ("exon", "CDS"):
-            g.attributes["Parent"] = g.attributes["transcript_id"]
-            del g.attributes["transcript_id"]
-        elif g.type == "gene":
-            g.attributes["Parent"] = g.attributes["gene_id"]
-        else:
-            assert 0, "Doesn't know how to deal with {0}".format(g.type)
-
-        g.update_attributes(gff3=True)
-        print g
+    write_clustered(gtffile, opts.outfile, iter_gtf_to_gff3, gtf_group_key,
+                    memory=opts.memory)
 
 
 def frombed(args):
@@ -613,6 +1295,96 @@ def frombed(args):
         print b.gffline(type=opts.type, source=opts.source)
 
 
+def transcript_gene(text):
+    """
+    Transcript and gene of an mRNA, given its GFF3 attributes.
+    """
+    tid, gid = scan_attribute(text, "ID"), scan_attribute(text, "Parent")
+    if tid and gid:
+        return tid[0], gid[0]
+    tid, gid = scan_attribute(text, "mRNA"), scan_attribute(text, "Gene")
+    if tid and gid:
+        return tid[0], gid[0]
+    tid = scan_attribute(text, "ID")[0]
+    return tid, tid
+
+
+def iter_gff3_to_gtf(lines, grouped=False, window=1000):
+    """
+    Convert GFF3 lines to GTF lines. Only exon/CDS features are written, once
+    per parent, with gene_id and transcript_id from the mRNA.
+
+    Only the last `window` mRNAs are kept, so the input must list each mRNA
+    before its children, and not too far apart (unless `grouped`). None is
+    yielded once a feature comes with an mRNA that is not at hand. In grouped
+    input, such features take their transcript as gene.
+    """
+    from collections import Counter, deque
+
+    genes, recent, counts = {}, deque(), Counter()
+    for row in lines:
+        if row[0] == '#':
+            if row.startswith(FastaTag):
+                break
+            continue
+        if not row.strip():
+            continue
+
+        atoms = row.rstrip("\r\n").split("\t")
+        type, text = atoms[2], atoms[8]
+        if type in Gff3_transcript_types:
+            tid, gid = transcript_gene(text)
+            genes[tid] = gid
+            recent.append(tid)
+            counts[tid] += 1
+            if len(recent) > window:
+                old = recent.popleft()
+                counts[old] -= 1
+                if not counts[old]:
+                    del counts[old]
+                    genes.pop(old, None)
+            continue
+
+        if type not in Gtf_types:
+            continue
+
+        for tid in scan_attribute(text, "Parent") or \
+                   scan_attribute(text, "mRNA"):
+            gid = genes.get(tid)
+            if gid is None:
+                if not grouped:
+                    yield None
+                    return
+                gid = tid
+            atoms[8] = "gene_id \"{0}\"; transcript_id \"{1}\";".\
+                            format(gid, tid)
+            yield "\t".join(atoms)
+
+
+def gff3_group_key(row, i):
+    """
+    Sort key that groups the GFF3 lines by transcript, mRNA first. Features
+    with several parents are repeated for each.
+    """
+    if row[0] == '#' or not row.strip():
+        return None
+    atoms = row.rstrip("\r\n").split("\t")
+    if len(atoms) < 9:
+        return None
+    type, text = atoms[2], atoms[8]
+    if type in Gff3_transcript_types:
+        tid, gid = transcript_gene(text)
+        return [((tid, 0, i), row)]
+    if type not in Gtf_types:
+        return None
+
+    items = []
+    for tid in scan_attribute(text, "Parent") or scan_attribute(text, "mRNA"):
+        atoms[8] = "Parent=" + tid
+        items.append(((tid, 1, i), "\t".join(atoms)))
+    return items
+
+
 def gtf(args):
     """
     %prog gtf gffile
@@ -620,44 +1392,22 @@ def gtf(args):
     Convert gff to gtf file. In gtf, only exon/CDS features are important. The
     first 8 columns are the same as gff, but in the attributes field, we need to
     specify "gene_id" and "transcript_id".
+
+    The gff is converted in one streaming pass, if each mRNA comes before its
+    children; otherwise the lines are grouped first with an external sort.
     """
     p = OptionParser(gtf.__doc__)
+    p.add_option("--memory", default=256, type="int",
+                 help="Size of the sorted runs, in MB [default: %default]")
+    set_outfile(p)
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
         sys.exit(not p.print_help())
 
     gffile, = args
-    gff = Gff(gffile)
-    transcript_to_gene = {}
-    for g in gff:
-        if g.type == "mRNA":
-            if "ID" in g.attributes and "Parent" in g.attributes:
-                transcript_id = g.attributes["ID"][0]
-                gene_id = g.attributes["Parent"][0]
-            elif "mRNA" in g.attributes and "Gene" in g.attributes:
-                transcript_id = g.attributes["mRNA"][0]
-                gene_id = g.attributes["Gene"][0]
-            else:
-                transcript_id = g.attributes["ID"][0]
-                gene_id = transcript_id
-            transcript_to_gene[transcript_id] = gene_id
-            continue
-
-        if g.type not in ("CDS", "exon", "start_codon", "stop_codon"):
-            continue
-
-        try:
-            transcript_id = g.attributes["Parent"]
-        except IndexError:
-            transcript_id = g.attributes["mRNA"]
-
-        for tid in transcript_id:
-            gene_id = transcript_to_gene[tid]
-            g.attributes = dict(gene_id=[gene_id], transcript_id=[tid])
-            g.update_attributes()
-
-            print g
+    write_clustered(gffile, opts.outfile, iter_gff3_to_gtf, gff3_group_key,
+                    memory=opts.memory)
 
 
 def merge(args):
@@ -758,7 +1508,7 @@ def extract(args):
 
         b = GffLine(row)
         is_right_contig = (contigID and tag in contigID) or (not contigID)
-        is_right_names = (names and b.attributes["Name"][0] in names) or \
+        is_right_names = (names and b.get_attr("Name") in names) or \
                          (not names)
 
         if is_right_contig and is_right_names:
@@ -773,14 +1523,80 @@ def extract(args):
             SeqIO.write([f[s]], fw, "fasta")
 
 
+def iter_split_gff(gffile, outdir="."):
+    """
+    Route the lines of the gff to `outdir/seqid.gff`, as (outfile, text). The
+    header (directives before the first feature) starts every file, except
+    the ##sequence-region lines that go to their own seqid. Other comments
+    follow the last feature, and the FASTA records go after ##FASTA in the
+    file of their seqid.
+    """
+    headers, regions = [], defaultdict(list)
+    started, fastas = set(), set()
+    outfile = None
+    infeatures = infasta = False
+
+    def header(outfile):
+        if outfile in started:
+            return []
+        started.add(outfile)
+        text = "".join(headers + regions.pop(outfile, []))
+        return [(outfile, text)] if text else []
+
+    for row in must_open(gffile):
+        if infasta:
+            if row[0] == '>':
+                outfile = op.join(outdir, row[1:].split(None, 1)[0] + ".gff")
+                for x in header(outfile):
+                    yield x
+                if outfile not in fastas:
+                    fastas.add(outfile)
+                    yield outfile, FastaTag + "\n"
+            if outfile:
+                yield outfile, row
+            continue
+
+        if not row.strip():
+            continue
+        if row[0] == '#':
+            if row.startswith(FastaTag):
+                infasta, outfile = True, None
+            elif row.startswith(RegionTag):
+                regionfile = op.join(outdir, row.split()[1] + ".gff")
+                if infeatures:
+                    for x in header(regionfile):
+                        yield x
+                    yield regionfile, row
+                else:
+                    regions[regionfile].append(row)
+            elif not infeatures:
+                headers.append(row)
+            elif outfile:
+                yield outfile, row
+            continue
+
+        infeatures = True
+        outfile = op.join(outdir, row.split("\t", 1)[0] + ".gff")
+        for x in header(outfile):
+            yield x
+        yield outfile, row
+
+
 def split(args):
     """
     %prog split gffile outdir
 
     Split the gff into one contig per file. Will also take sequences if the file
-    contains FASTA sequences.
+    contains FASTA sequences. The gff is read once, with at most --maxopen
+    files open; --cpus splits the output files among processes.
     """
+    from functools import partial
+    from jcvi.formats.base import split_keyed
+
     p = OptionParser(split.__doc__)
+    p.add_option("--maxopen", default=256, type="int",
+                 help="Maximum number of open output files [default: %default]")
+    set_cpus(p, cpus=1)
 
     opts, args = p.parse_args(args)
 
@@ -790,12 +1606,8 @@ def split(args):
     gffile, outdir = args
     mkdir(outdir)
 
-    g = Gff(gffile)
-    seqids = g.seqids
-
-    for s in seqids:
-        outfile = op.join(outdir, s + ".gff")
-        extract([gffile, s, "--outfile=" + outfile])
+    split_keyed(gffile, partial(iter_split_gff, outdir=outdir),
+                cpus=opts.cpus, maxopen=opts.maxopen)
 
 
 def note(args):
@@ -822,8 +1634,9 @@ def note(args):
     gff = Gff(gffile)
     seen = set()
     for g in gff:
-        if attrib in g.attributes:
-            keyval = (g.attributes[key][0], g.attributes[attrib][0])
+        value = g.get_attr(attrib)
+        if value is not None:
+            keyval = (g.get_attr(key), value)
             if keyval not in seen:
                 print "\t".join(keyval)
                 seen.add(keyval)
@@ -907,17 +1720,9 @@ def bed(args):
 
 def make_index(gff_file):
     """
-    Make a sqlite database for fast retrieval of features.
+    Make a binary index for fast retrieval of features, see GffIndex.
     """
-    import GFFutils
-    db_file = gff_file + ".db"
-
-    if need_update(gff_file, db_file):
-        if op.exists(db_file):
-            os.remove(db_file)
-        GFFutils.create_gffdb(gff_file, db_file)
-
-    return GFFutils.GFFDB(db_file)
+    return GffIndex(gff_file)
 
 
 def get_parents(gff_file, parents):
@@ -945,17 +1750,113 @@ def children(args):
         sys.exit(not p.print_help())
 
     gff_file, = args
-    g = make_index(gff_file)
+    g = Gff(gff_file, cached=True).load()
     parents = set(opts.parents.split(','))
 
-    for feat in get_parents(gff_file, parents):
+    for feat in g.iter_type(parents):
 
-        cc = [c.id for c in g.children(feat.id, 1)]
+        cc = [c.id for c in g.children(feat.id)]
         if len(cc) <= 1:
             continue
 
         print "\t".join(str(x) for x in \
-                    (feat.id, feat.start, feat.stop, "|".join(cc)))
+                    (feat.id, feat.start, feat.end, "|".join(cc)))
+
+
+def feature_segments(g, parents, children, attr=None):
+    """
+    Group the features of the parent types by seqid, as (name, description,
+    segments), where segments are the (start, end, strand) of the children in
+    the order of the spliced sequence. Seqids come in order of first parent,
+    the features of a seqid in file order.
+    """
+    children_rows = g.children_rows
+    starts, ends = g.starts.tolist(), g.ends.tolist()
+    strands = [g.strandnames[x] for x in g.strandcodes.tolist()]
+    typecodes = g.typecodes.tolist()
+    ctypes = set(i for i, x in enumerate(g.typenames) if x in children)
+    groups = DefaultOrderedDict(list)
+    for i in g.rows_of_type(parents).tolist():
+        name = g.accns[i]
+        rows = [x for x in children_rows.get(name, []) \
+                    if typecodes[x] in ctypes]
+        if not rows:
+            print >>sys.stderr, "[warning] %s has no children with type %s" \
+                                    % (name, ','.join(children))
+            continue
+        # sort children in incremental position, reverse if negative strand
+        rows.sort(key=lambda x: starts[x])
+        if strands[i] == '-':
+            rows.reverse()
+        segments = [(starts[x], ends[x], strands[x]) for x in rows]
+
+        description = None
+        if attr:
+            description = g.feature(i).get_attr(attr, first=False)
+        description = ",".join(description).replace("\"", "") \
+                if description else ""
+        groups[g.seqnames[g.seqcodes[i]]].append((name, description, segments))
+
+    return groups
+
+
+def _fetch_sequences(task):
+    """
+    Splice the features on one seqid. Nearby segments are clustered into
+    regions (no more than `maxsize` bases, unless one segment is longer) that
+    are each read once from the indexed FASTA.
+    """
+    from jcvi.formats.fasta import FastaIndex, Seq
+
+    fastafile, seqid, features, gap, maxsize = task
+    f = FastaIndex(fastafile)
+    segments = [(start, end, strand, i, j) for i, (name, description, segs) \
+                    in enumerate(features) \
+                    for j, (start, end, strand) in enumerate(segs)]
+    segments.sort()
+    pieces = [[None] * len(segs) for name, description, segs in features]
+
+    region = []
+    reach = 0
+    for k, seg in enumerate(segments + [None]):
+        if region and (seg is None or seg[0] > reach + gap or \
+                       seg[1] - region[0][0] + 1 > maxsize):
+            rstart = region[0][0]
+            rseq = f.fetch(seqid, rstart, reach)
+            for start, end, strand, i, j in region:
+                piece = rseq[start - rstart: end - rstart + 1]
+                if strand == '-':
+                    piece = str(Seq(piece).reverse_complement())
+                pieces[i][j] = piece
+            region = []
+        if seg is None:
+            break
+        reach = max(reach, seg[1]) if region else seg[1]
+        region.append(seg)
+
+    return [(name, description, "".join(p)) for (name, description, segs), p \
+                in zip(features, pieces)]
+
+
+def feature_sequences(g, fastafile, parents, children, attr=None, cpus=1,
+                      gap=10000, maxsize=1 << 24):
+    """
+    Yield (name, description, spliced sequence) of the features of the parent
+    types, one seqid at a time, with the seqids processed in parallel. The
+    genome is never loaded; each region of the seqids is read once through the
+    .fai index.
+    """
+    from jcvi.formats.base import imap_ordered
+    from jcvi.formats.fasta import FastaIndex
+
+    FastaIndex(fastafile)  # Make sure the index is built once
+    groups = feature_segments(g, parents, children, attr=attr)
+    tasks = ((fastafile, seqid, features, gap, maxsize) \
+                for seqid, features in groups.iteritems())
+
+    for result in imap_ordered(_fetch_sequences, tasks, cpus=cpus):
+        for x in result:
+            yield x
 
 
 def load(args):
@@ -966,6 +1867,10 @@ def load(args):
     For example, to get the CDS sequences, do this::
 
     $ %prog load athaliana.gff athaliana.fa --parents mRNA --children CDS
+
+    The sequences are read through the fasta_file.fai index (built if missing),
+    region by region, and written one seqid after another. Use --translate to
+    write the protein sequences instead.
     '''
     from jcvi.formats.fasta import Seq, SeqRecord
 
@@ -978,6 +1883,9 @@ def load(args):
             "'five_prime_UTR,CDS,three_prime_UTR') [default: %default]")
     p.add_option("--attribute",
             help="The attribute field to extract [default: %default]")
+    p.add_option("--translate", default=False, action="store_true",
+            help="Translate the spliced sequences [default: %default]")
+    set_cpus(p, cpus=1)
     set_outfile(p)
 
     opts, args = p.parse_args(args)
@@ -987,43 +1895,19 @@ def load(args):
 
     gff_file, fasta_file = args
 
-    g = make_index(gff_file)
-    f = Fasta(fasta_file, index=False)
+    g = Gff(gff_file, cached=True).load()
     fw = must_open(opts.outfile, "w")
 
     parents = set(opts.parents.split(','))
     children_list = set(opts.children.split(','))
-    attr = opts.attribute
 
-    for feat in get_parents(gff_file, parents):
-
-        children = []
-        for c in g.children(feat.id, 1):
-
-            if c.featuretype not in children_list:
-                continue
-            child = f.sequence(dict(chr=c.chrom, start=c.start, stop=c.stop,
-                strand=c.strand))
-            children.append((child, c))
-
-        if not children:
-            print >>sys.stderr, "[warning] %s has no children with type %s" \
-                                    % (feat.id, ','.join(children_list))
-            continue
-        # sort children in incremental position
-        children.sort(key=lambda x: x[1].start)
-        # reverse children if negative strand
-        if feat.strand == '-':
-            children.reverse()
-        feat_seq = ''.join(x[0] for x in children)
-
-        description = ",".join(feat.attributes[attr]) \
-                if attr and attr in feat.attributes else ""
-        description = description.replace("\"", "")
-
-        rec = SeqRecord(Seq(feat_seq), id=feat.id, description=description)
+    for name, description, seq in feature_sequences(g, fasta_file, parents,
+                    children_list, attr=opts.attribute, cpus=opts.cpus):
+        seq = Seq(seq)
+        if opts.translate:
+            seq = seq.translate()
+        rec = SeqRecord(seq, id=name, description=description)
         SeqIO.write([rec], fw, "fasta")
-        fw.flush()
 
 
 def bed12(args):
@@ -1064,14 +1948,15 @@ def bed12(args):
     parent, block, thick = opts.parent, opts.block, opts.thick
     outfile = opts.outfile
 
-    g = make_index(gffile)
+    g = Gff(gffile, cached=True).load()
     fw = must_open(outfile, "w")
 
-    for f in g.features_of_type(parent):
+    parents = sorted(g.iter_type(parent), key=lambda x: (x.seqid, x.start))
+    for f in parents:
 
-        chrom = f.chrom
+        chrom = f.seqid
         chromStart = f.start - 1
-        chromEnd = f.stop
+        chromEnd = f.end
         name = f.id
         score = 0
         strand = f.strand
@@ -1079,16 +1964,16 @@ def bed12(args):
         thickEnd = 0
         blocks = []
 
-        for c in g.children(name, 1):
+        for c in g.children(name):
 
-            cstart, cend = c.start - 1, c.stop
+            cstart, cend = c.start - 1, c.end
 
-            if c.featuretype == block:
+            if c.type == block:
                 blockStart = cstart - chromStart
                 blockSize = cend - cstart
                 blocks.append((blockStart, blockSize))
 
-            elif c.featuretype == thick:
+            elif c.type == thick:
                 thickStart = min(thickStart, cstart)
                 thickEnd = max(thickEnd, cend)
 
@@ -15,11 +15,13 @@ import logging
 
 from collections import namedtuple, defaultdict
 from optparse import OptionParser
-from itertools import groupby
+from itertools import groupby, islice
 
-from jcvi.formats.base import BaseFile, LineFile
+import numpy as np
+
+from jcvi.formats.base import BaseFile, LineFile, ReadNames
 from jcvi.formats.blast import set_options_pairs
-from jcvi.apps.base import ActionDispatcher, sh, debug
+from jcvi.apps.base import ActionDispatcher, sh, debug, need_update
 debug()
 
 
@@ -55,30 +57,76 @@ class LibraryLine (object):
         return (distance - self.mean) / self.sd
 
 
-class MatesFile (BaseFile, dict):
-
-    def __init__(self, filename):
+class MatesFile (BaseFile):
+    """
+    Mate and library of each read, as integer arrays over a ReadNames
+    dictionary of the reads. These are cached in the sidecar files
+    `matesfile.names.npy`, `matesfile.mates.npy` and `matesfile.libs.npy`,
+    which are memory-mapped and rebuilt when the matesfile is newer.
+    """
+    def __init__(self, filename, chunksize=1000000):
         super(MatesFile, self).__init__(filename)
 
-        libraries = {}
+        namesfile, matesfile, libsfile = [filename + x for x in \
+                (".names.npy", ".mates.npy", ".libs.npy")]
+        if need_update(filename, (namesfile, matesfile, libsfile)):
+            self.index(namesfile, matesfile, libsfile, chunksize=chunksize)
 
-        fp = open(filename)
-        for row in fp:
-            atoms = row.split()
-            if atoms[0] == LibraryTag:
-                lib = LibraryLine(row)
-                libraries[lib.library] = lib
-            else:
-                mate = MateLine(row)
-                lib = libraries[mate.library]
-                r1, r2 = mate.read1, mate.read2
-                self[r1] = (r2, lib)
-                self[r2] = (r1, lib)
+        self.names = ReadNames.load(namesfile)
+        self.mates = np.load(matesfile, mmap_mode="r")
+        self.liblist = [LibraryLine(x) for x in np.load(libsfile)]
+        self.libraries = dict((x.library, x) for x in self.liblist)
 
         logging.debug("Libraries: {0}, Mates: {1}".\
-                    format(len(libraries), len(self)))
-
-        self.libraries = libraries
+                    format(len(self.libraries), len(self)))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, read):
+        return read in self.names
+
+    def __getitem__(self, read):
+        i = self.names.lookup([read])[0]
+        if i < 0:
+            raise KeyError(read)
+        mate, lib = self.mates[i]
+        return self.names[mate], self.liblist[lib]
+
+    def get(self, read, default=None):
+        return self[read] if read in self else default
+
+    def iter_mates(self):
+        for row in open(self.filename):
+            if row.split()[0] != LibraryTag:
+                yield MateLine(row)
+
+    def index(self, namesfile, matesfile, libsfile, chunksize=1000000):
+        """
+        Build the read dictionary and the mates table in two streaming passes.
+        """
+        librows = [x.strip() for x in open(self.filename) \
+                    if x.split()[0] == LibraryTag]
+        libnames = [LibraryLine(x).library for x in librows]
+
+        reads = (x for m in self.iter_mates() for x in (m.read1, m.read2))
+        names = ReadNames.build(reads, filename=namesfile, chunksize=chunksize)
+
+        mates = -np.ones((len(names), 2), dtype=np.int64)
+        rows = self.iter_mates()
+        while True:
+            chunk = list(islice(rows, chunksize))
+            if not chunk:
+                break
+            r1 = names.lookup([x.read1 for x in chunk])
+            r2 = names.lookup([x.read2 for x in chunk])
+            libs = [libnames.index(x.library) for x in chunk]
+            mates[r1, 0], mates[r2, 0] = r2, r1
+            mates[r1, 1] = mates[r2, 1] = libs
+
+        np.save(matesfile, mates)
+        np.save(libsfile, np.array(librows, dtype=str))
+        logging.debug("Mates table written to `{0}`.".format(matesfile))
 
 
 MatesLine = namedtuple("MatesLine",
@@ -136,6 +136,27 @@ def stem_leaf_plot(data, vmin, vmax, bins, digit=1, title=None):
     print >> sys.stderr, "Last bin ends in {0}, inclusive.".format(vmax)
 
 
+def counthistogram(counts, vmin=None, vmax=None, bins=20, digit=1,
+                   title=None):
+    """
+    ASCII histogram of data that are already counted, counts[i] is the number
+    of occurrences of value i. Used for the summaries of large data sets that
+    are collected in one pass.
+    """
+    counts = np.asarray(counts)
+    values = np.flatnonzero(counts)
+    if not len(values):
+        return
+
+    vmin = values[0] if vmin is None else vmin
+    vmax = values[-1] if vmax is None else vmax
+    step = int(ceil((vmax - vmin) * 1. / bins)) or 1
+    edges = np.arange(vmin, vmax + step + 1, step)
+    hist, bin_edges = np.histogram(np.arange(len(counts)), bins=edges,
+                                   weights=counts)
+    asciiplot(bin_edges[:-1], hist.astype(int), digit=digit, title=title)
+
+
 def texthistogram(numberfiles, vmin, vmax, title=None,
                   bins=20, skip=0, log=0):
 
@@ -194,7 +215,34 @@ def histogram_multiple(numberfiles, vmin, vmax, xlabel, title,
             print >> fw, "\t".join((val, tag))
     fw.close()
 
-    numberfile = newfile
+    plot_multiple(newfile, vmin, vmax, xlabel, title, bins=bins, skip=skip,
+                  facet=facet, fill=fill, prefix=prefix)
+
+
+def histogram_arrays(datasets, vmin, vmax, xlabel, title,
+                     bins=20, facet=False, fill="white", prefix=""):
+    """
+    Same as histogram_multiple(), but the numbers are given as a list of (tag,
+    array), e.g. loaded from a binary table instead of one file per group.
+    """
+    newfile = "_".join(tag for tag, data in datasets)
+
+    fw = open(newfile, "w")
+    print >> fw, "{0}\tgrp".format(xlabel)
+    for tag, data in datasets:
+        for val in data:
+            print >> fw, "{0}\t{1}".format(val, tag)
+    fw.close()
+
+    plot_multiple(newfile, vmin, vmax, xlabel, title, bins=bins,
+                  facet=facet, fill=fill, prefix=prefix)
+
+
+def plot_multiple(numberfile, vmin, vmax, xlabel, title,
+                  bins=20, skip=0, facet=False, fill="white", prefix=""):
+    """
+    Plot the combined numberfile (value, group per line) with ggplot2.
+    """
     outfile = numberfile + '.pdf'
     if prefix:
         outfile = prefix + outfile
@@ -150,6 +150,61 @@ class SummaryStats (object):
                         format(self.size, filename))
 
 
+def mix64(hashes):
+    """
+    Scramble an array of 64-bit ints (e.g. hash() or crc32 values) into
+    uniformly distributed uint64, with the splitmix64 finalizer.
+    """
+    import numpy as np
+
+    h = np.asarray(hashes, dtype=np.int64).view(np.uint64)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+
+
+class HyperLogLog (object):
+    """
+    Estimate the number of distinct items in fixed memory, 2 ** p registers.
+    Items are added in batches as arrays of 64-bit hashes, which are mixed
+    first so that python's hash() can be used. The standard error is about
+    1.04 / sqrt(2 ** p).
+    """
+    def __init__(self, p=14):
+        import numpy as np
+
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        import numpy as np
+
+        h = mix64(hashes)
+        p = self.p
+        idx = (h >> np.uint64(64 - p)).astype(np.int64)
+        w = (h & np.uint64((1 << (64 - p)) - 1)).astype(np.float64)
+        bitlength = np.zeros(len(w), dtype=np.int64)
+        nz = w > 0
+        bitlength[nz] = np.floor(np.log2(w[nz])).astype(np.int64) + 1
+        rank = (64 - p - bitlength + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def add(self, items):
+        self.add_hashes([hash(x) for x in items])
+
+    def __len__(self):
+        import numpy as np
+
+        m = self.m
+        alpha = .7213 / (1 + 1.079 / m)
+        est = alpha * m * m / np.sum(2. ** -self.registers.astype(np.float64))
+        zeros = (self.registers == 0).sum()
+        if est <= 2.5 * m and zeros:
+            est = m * np.log(float(m) / zeros)  # Linear counting
+        return int(round(est))
+
+
 def percentage(a, b, denominator=True):
     """
     >>> percentage(100, 200)